@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import logging
+import os
+import signal
+import pathlib
+import sys
+import threading
+
+from .config import DEFAULT_SETTINGS, LOGLEVEL, NAME, Config, LogHandler
+from .engine import Engine
+from .index import FileIndex
+from .scheduler import Task
+from .store import export_xlsx, read_results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m XRD_batch_helper',
+        description='Batch refine XRD patterns with TOPAS.')
+    # A frozen app keeps config.ini next to its executable
+    app_dir = pathlib.Path(sys.executable).parent \
+        if getattr(sys, 'frozen', False) else pathlib.Path('.')
+    parser.add_argument(
+        '--app-dir', type=pathlib.Path, default=app_dir,
+        help='directory holding config.ini and app.log (default: ., or '
+             'the executable\'s when frozen)')
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help='refine patterns without the GUI')
+    run.add_argument('--inp', type=pathlib.Path,
+                     help='TOPAS INP file used for every pattern')
+    run.add_argument('--patterns', nargs='+',
+                     help='pattern files, globs, e.g. "data/**/*.raw", or '
+                          'directories searched by the [INDEX] globs')
+    run.add_argument('--output', type=pathlib.Path,
+                     help='CSV file the results are appended to')
+    run.add_argument('--task', nargs=3, action='append', default=[],
+                     metavar=('INP', 'PATTERNS', 'OUTPUT'),
+                     help='one more INP, pattern glob and CSV, run over the '
+                          'same workers; can be repeated')
+    run.add_argument('--tc', type=pathlib.Path,
+                     help='tc executable, overrides config.ini')
+    run.add_argument('--workers', type=int,
+                     help='parallel tc runs, overrides config.ini')
+    run.add_argument('--no-cache', action='store_true',
+                     help='refine every pattern, ignoring cached results')
+    run.add_argument('--clear-cache', action='store_true',
+                     help='drop all cached results before running')
+    run.add_argument('--resume', action='store_true',
+                     help='skip patterns that already have a row in output')
+    run.add_argument('--warm-start', action='store_true',
+                     help='start from the values refined for the previous pattern')
+    run.add_argument('--distributed', action='store_true',
+                     help='send the patterns to workers started with the '
+                          'worker command instead of running tc here')
+    run.add_argument('--profile', action='store_true',
+                     help='write a profile report and trace next to app.log')
+    run.add_argument('--record', type=pathlib.Path, metavar='ARCHIVE',
+                     help='record every tc run to this zip for replay; '
+                          'cached patterns are not run, see --no-cache')
+
+    watch = commands.add_parser(
+        'watch', help='refine patterns as they appear in a directory')
+    watch.add_argument('--dir', type=pathlib.Path, required=True,
+                       help='directory the diffractometer writes to')
+    watch.add_argument('--inp', type=pathlib.Path, required=True,
+                       help='TOPAS INP file used for every pattern')
+    watch.add_argument('--output', type=pathlib.Path, required=True,
+                       help='file the results are appended to')
+    watch.add_argument('--tc', type=pathlib.Path,
+                       help='tc executable, overrides config.ini')
+    watch.add_argument('--workers', type=int,
+                       help='parallel tc runs, overrides config.ini')
+    watch.add_argument('--existing', action='store_true',
+                       help='refine the patterns already there too')
+    watch.add_argument('--profile', action='store_true',
+                       help='write a profile report and trace next to app.log')
+    watch.add_argument('--record', type=pathlib.Path, metavar='ARCHIVE',
+                       help='record every tc run to this zip for replay')
+
+    worker = commands.add_parser(
+        'worker', help='refine patterns for a coordinator (run --distributed)')
+    worker.add_argument('--connect', required=True,
+                        help='host:port of the coordinator')
+    worker.add_argument('--tc', type=pathlib.Path,
+                        help='tc executable, overrides config.ini')
+    worker.add_argument('--slots', type=int, default=0,
+                        help='parallel tc runs, default one per core')
+    worker.add_argument('--name', help='name in the coordinator stats, '
+                                       'default host-pid')
+
+    export = commands.add_parser(
+        'export', help='export a Parquet/Feather store to xlsx or CSV')
+    export.add_argument('store', type=pathlib.Path,
+                        help='.parquet or .feather store directory')
+    export.add_argument('output', type=pathlib.Path,
+                        help='.xlsx or .csv file to write')
+    export.add_argument('--columns', nargs='+',
+                        help='only these columns, e.g. id r_wp Alite')
+
+    analyze = commands.add_parser(
+        'analyze', help='statistics and outliers over result files')
+    analyze.add_argument('sources', nargs='+',
+                         help='CSV files, .parquet/.feather stores or globs')
+    analyze.add_argument('--window', type=int,
+                         help='patterns per rolling mean, overrides config.ini')
+    analyze.add_argument('--threshold', type=float,
+                         help='outlier |z-score|, overrides config.ini')
+    analyze.add_argument('--report', type=pathlib.Path,
+                         help='write the tables to this .xlsx, or to CSVs '
+                              'named after it')
+
+    replay = commands.add_parser(
+        'replay', help='make a tc stand-in replaying a recorded archive')
+    replay.add_argument('archive', type=pathlib.Path,
+                        help='zip written by run --record')
+    replay.add_argument('--launcher', type=pathlib.Path,
+                        help='write an executable to give as --tc here, '
+                             'a .bat/.cmd file on Windows')
+    replay.add_argument('--scale', type=float, default=1.0,
+                        help='times the recorded wall times, e.g. 0.01')
+
+    commands.add_parser('gui', help='start the tkinter GUI')
+    return parser
+
+
+def get_logger(app_dir):
+    logger = LogHandler(name=NAME, level=LOGLEVEL, file=app_dir / 'app.log')
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    logger.addHandler(stream_handler)
+    return logger
+
+
+def expand_patterns(globs, index=None, config=None):
+    '''
+    Files matching globs, a directory stands for the patterns found in it
+    through index by the [INDEX] globs of config
+    '''
+    patterns = []
+    for pattern in globs:
+        if index is not None and os.path.isdir(pattern):
+            section = config['INDEX']
+            patterns.extend(index.find(pattern, section['patterns'],
+                                       recursive=section.getboolean('recursive')))
+            continue
+        matches = glob.glob(pattern, recursive=True)
+        patterns.extend(matches if matches else [pattern])
+    return patterns
+
+
+def start_profiler(args, config, engine, logger):
+    '''
+    A started Profiler when --profile or [PROFILE] enabled asks for one
+    '''
+    if not (args.profile or config['PROFILE'].getboolean('enabled')):
+        return None
+    from .profiling import Profiler
+    return Profiler.from_config(config, engine.metrics, logger).start()
+
+
+def start_recorder(args, config, engine, logger):
+    '''
+    A Recorder set on engine when --record or [REPLAY] record asks for one
+    '''
+    from .replay import Recorder
+    if args.record is not None:
+        engine.recorder = Recorder(args.record, logger=logger)
+    elif config['REPLAY']['record']:
+        engine.recorder = Recorder.from_config(config, logger)
+    return engine.recorder
+
+
+def run(args):
+    logger = get_logger(args.app_dir)
+    config = Config(file=args.app_dir / 'config.ini', default=DEFAULT_SETTINGS)
+    engine = Engine.from_config(config, logger)
+    if args.tc is not None:
+        engine.tc = args.tc
+    if args.workers is not None:
+        engine.workers = args.workers or engine.workers
+    if args.no_cache:
+        engine.use_cache = False
+    if args.clear_cache and engine.cache is not None:
+        engine.cache.clear()
+    if args.resume:
+        engine.resume = True
+    if args.warm_start:
+        engine.warm_start = True
+    index = FileIndex.from_config(config, logger)
+    tasks = []
+    if args.inp is not None:
+        tasks.append(Task(args.inp, expand_patterns(args.patterns, index, config),
+                          args.output))
+    for inp, patterns, output in args.task:
+        tasks.append(Task(inp, expand_patterns([patterns], index, config), output))
+    for task in tasks:
+        task.progress = lambda done, total, task=task: logger.debug(
+            f'{task.inp.name} {done}/{total}')
+
+    coordinator = None
+    if args.distributed:
+        from .distributed import Coordinator
+        try:
+            coordinator = Coordinator.from_config(config, engine, logger)
+        except ValueError as e:
+            logger.error(f'run: {e}')
+            return 2
+    try:
+        recorder = start_recorder(args, config, engine, logger)
+    except FileExistsError as e:
+        logger.error(f'run: {e}')
+        return 2
+    if coordinator is not None:
+        # Threads only wait for the workers here
+        engine.workers = config['DISTRIBUTED'].getint('slots')
+        for task in tasks:
+            task.process_func = coordinator.process_TC
+        coordinator.start()
+    profiler = start_profiler(args, config, engine, logger)
+    try:
+        # A resume finding every row already written is done, not failed
+        if not engine.process_tasks(tasks) and not all(
+                task.skipped for task in tasks):
+            return 1
+    except KeyboardInterrupt:
+        logger.info('run: interrupted, the rows finished are written')
+        return 130
+    finally:
+        if coordinator is not None:
+            coordinator.shutdown()
+        if profiler is not None:
+            profiler.stop()
+        if recorder is not None:
+            recorder.close()
+    return 0 if all(task.success for task in tasks) else 1
+
+
+def watch(args):
+    from .watch import Watcher
+    logger = get_logger(args.app_dir)
+    config = Config(file=args.app_dir / 'config.ini', default=DEFAULT_SETTINGS)
+    engine = Engine.from_config(config, logger)
+    if args.tc is not None:
+        engine.tc = args.tc
+    if args.workers is not None:
+        engine.workers = args.workers or engine.workers
+    section = config['WATCH']
+    watcher = Watcher(args.dir, suffix=section['suffix'],
+                      settle=section.getfloat('settle'),
+                      poll_interval=section.getfloat('poll_interval'),
+                      existing=args.existing,
+                      use_inotify=section.getboolean('inotify'),
+                      logger=logger)
+    stop = threading.Event()
+    cancel = threading.Event()
+
+    def interrupt(signum, frame):
+        # The first Ctrl-C finishes the patterns queued, the second kills them
+        if stop.is_set():
+            cancel.set()
+        stop.set()
+        logger.info('watch: stopping, Ctrl-C again to cancel the queued patterns')
+
+    signal.signal(signal.SIGINT, interrupt)
+    task = Task(args.inp, [], args.output, cancel=cancel)
+    task.progress = lambda done, total: logger.debug(f'{done}/{total}')
+    logger.info(f'watch: watching {watcher.directory} with '
+                f'{type(watcher.source).__name__}')
+    try:
+        recorder = start_recorder(args, config, engine, logger)
+    except FileExistsError as e:
+        logger.error(f'watch: {e}')
+        return 2
+    profiler = start_profiler(args, config, engine, logger)
+    try:
+        engine.follow(task, watcher.batches(stop))
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if recorder is not None:
+            recorder.close()
+    return 0 if task.success else 1
+
+
+def worker(args):
+    from .distributed import Worker, parse_address, read_authkey
+    logger = get_logger(args.app_dir)
+    config = Config(file=args.app_dir / 'config.ini', default=DEFAULT_SETTINGS)
+    try:
+        authkey = read_authkey(config)
+    except ValueError as e:
+        logger.error(f'worker: {e}')
+        return 2
+    engine = Engine.from_config(config, logger)
+    Worker(address=parse_address(args.connect, default_host='localhost'),
+           authkey=authkey,
+           tc=args.tc or engine.tc,
+           logger=logger,
+           slots=args.slots or os.cpu_count(),
+           name=args.name,
+           runner=engine.runner,
+           workspace=engine.workspace).run()
+    return 0
+
+
+def export(args):
+    if args.output.suffix.lower() == '.xlsx':
+        count = export_xlsx(args.store, args.output, columns=args.columns)
+    else:
+        table = read_results(args.store, columns=args.columns)
+        import pyarrow.csv
+        pyarrow.csv.write_csv(table, args.output)
+        count = table.num_rows
+    print(f'{count} rows written to {args.output}')
+    return 0
+
+
+def analyze(args):
+    from . import analytics
+    config = Config(file=args.app_dir / 'config.ini', default=DEFAULT_SETTINGS)
+    window = args.window or config['ANALYTICS'].getint('window')
+    threshold = args.threshold or config['ANALYTICS'].getfloat('threshold')
+    frame = analytics.load(expand_patterns(args.sources))
+    tables = analytics.summarize(frame, window=window, threshold=threshold)
+    for name, table in tables.items():
+        if name == 'Rolling means':
+            # A row per pattern, only for the report
+            continue
+        print(f'{name}:')
+        print(table.to_string(index=False, max_rows=40))
+        print()
+    if args.report is not None:
+        analytics.write_report(tables, args.report)
+        print(f'report written to {args.report}')
+    return 0
+
+
+def replay(args):
+    from .replay import Replay, write_launcher
+    runs = Replay(args.archive).runs
+    walls = sorted(run['wall'] for run in runs)
+    print(f'{len(runs)} tc runs, '
+          f'{sum(len(run["patterns"]) for run in runs)} patterns, '
+          f'{sum(run["returncode"] != 0 for run in runs)} failed')
+    if walls:
+        print(f'wall p50 {walls[len(walls) // 2]:.1f}s max {walls[-1]:.1f}s, '
+              f'chunk sizes {sorted({len(run["patterns"]) for run in runs})}')
+    if args.launcher is not None:
+        launcher = write_launcher(args.launcher, args.archive, scale=args.scale)
+        print(f'tc stand-in written to {launcher}, run with --tc {launcher}')
+    return 0
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        given = [args.inp, args.patterns, args.output]
+        if any(given) and not all(given):
+            parser.error('--inp, --patterns and --output go together')
+        if not any(given) and not args.task:
+            parser.error('give --inp, --patterns and --output, or --task')
+        return run(args)
+    if args.command == 'export':
+        return export(args)
+    if args.command == 'analyze':
+        return analyze(args)
+    if args.command == 'worker':
+        return worker(args)
+    if args.command == 'watch':
+        return watch(args)
+    if args.command == 'replay':
+        return replay(args)
+    # The GUI is the default, as when the app is double clicked
+    from .app import main as gui_main
+    gui_main(file_path=args.app_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import csv
+import io
+import pathlib
+
+from .store import FORMATS, read_results
+from .writer import is_header
+
+# Columns that are not phase weights
+META = ('id', 'pattern', 'inp', 'batch', 'timestamp', 'source', 'r_wp',
+        'error', 'failed')
+
+
+def import_pandas():
+    '''
+    pandas and numpy are only needed for analysis, so they are imported on use
+    '''
+    try:
+        import numpy
+        import pandas
+    except ImportError as e:
+        raise ImportError('Result analysis needs pandas and numpy, '
+                          'pip install pandas') from e
+    return numpy, pandas
+
+
+def load_csv(path):
+    '''
+    A result CSV, parsed a block at a time: a header line names the rows
+    below it, a later one may add phases. Rows name their run in the batch
+    column; files from older versions have none but repeat the header per
+    run, so there each header starts a batch.
+    '''
+    _, pd = import_pandas()
+    blocks = []
+    with open(path, mode='r', newline='') as f:
+        for line in f:
+            if line.startswith('id,') and is_header(next(csv.reader([line]))):
+                blocks.append([])
+            if blocks:
+                blocks[-1].append(line)
+    frames = []
+    for number, lines in enumerate(blocks, start=1):
+        frame = pd.read_csv(io.StringIO(''.join(lines)),
+                            dtype={'id': str, 'batch': str})
+        batch = f'{path.stem}-{number}'
+        frame['batch'] = frame['batch'].fillna(batch) if 'batch' in frame else batch
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['id', 'r_wp', 'batch'])
+    frame = pd.concat(frames, ignore_index=True, sort=False)
+    for column in frame.columns:
+        if column not in ('id', 'batch'):
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    return frame
+
+
+def load(sources, columns=None):
+    '''
+    Results of CSV files and Parquet/Feather stores as one DataFrame, a row
+    per pattern with the file it came from in source.
+    '''
+    _, pd = import_pandas()
+    frames = []
+    for source in sources:
+        source = pathlib.Path(source)
+        if source.suffix.lower() in FORMATS:
+            frame = read_results(source, columns=columns).to_pandas()
+        else:
+            frame = load_csv(source)
+            if columns is not None:
+                frame = frame[[column for column in frame.columns
+                               if column in columns or column in META]]
+        frame['source'] = str(source)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['id', 'r_wp', 'inp', 'batch', 'source'])
+    frame = pd.concat(frames, ignore_index=True, sort=False)
+    # CSVs carry no INP, their file stands in for it
+    if 'inp' not in frame:
+        frame['inp'] = None
+    # Categories, so every groupby below skips hashing the strings again
+    frame['inp'] = frame['inp'].fillna(frame['source']).astype('category')
+    frame['batch'] = frame['batch'].astype('category')
+    frame['r_wp'] = pd.to_numeric(frame['r_wp'], errors='coerce')
+    # Failed refinements are written with r_wp 0.00 and an error column
+    frame['failed'] = frame['r_wp'].fillna(0) <= 0
+    if 'error' in frame:
+        frame['failed'] |= frame['error'].notna()
+    return frame
+
+
+def phases(frame):
+    return [column for column in frame.columns
+            if column not in META and frame[column].dtype.kind in 'fiu']
+
+
+def inp_stats(frame):
+    '''
+    Per INP: patterns, failures and the r_wp distribution of good ones
+    '''
+    good = frame[~frame['failed']]
+    stats = good.groupby('inp', observed=True)['r_wp'].agg(
+        ['mean', 'std', 'min', 'median', 'max'])
+    stats.columns = [f'r_wp_{name}' for name in stats.columns]
+    stats.insert(0, 'failed', frame.groupby('inp', observed=True)['failed'].sum())
+    stats.insert(0, 'patterns', frame.groupby('inp', observed=True).size())
+    return stats.reset_index()
+
+
+def phase_stats(frame):
+    '''
+    Per INP and phase: weight count, mean, std, min, median and max
+    '''
+    good = frame[~frame['failed']]
+    # Aggregated wide, a column per phase, then one row per INP and phase;
+    # much faster than melting the weights first
+    stats = good.groupby('inp', observed=True)[phases(frame)].agg(
+        ['count', 'mean', 'std', 'min', 'median', 'max'])
+    stats.columns.names = ['phase', None]
+    stats = stats.stack(level='phase', future_stack=True).reset_index()
+    # Phases of other INPs
+    return stats[stats['count'] > 0].reset_index(drop=True)
+
+
+def rolling_means(frame, window=20):
+    '''
+    Rolling mean of every weight over the last window good patterns of
+    each INP, in the order they were refined
+    '''
+    good = frame[~frame['failed']]
+    if 'timestamp' in good and good['timestamp'].notna().any():
+        good = good.sort_values('timestamp', kind='stable')
+    columns = phases(good)
+    means = good.groupby('inp', observed=True)[columns].rolling(
+        window, min_periods=1).mean()
+    means = means.reset_index(level=0)
+    means.insert(1, 'id', good.loc[means.index, 'id'])
+    return means.reset_index(drop=True)
+
+
+def outliers(frame, threshold=3.0):
+    '''
+    Good patterns whose r_wp or a weight is more than threshold standard
+    deviations from the mean of their INP, with the columns that are in
+    reason and the largest |z| in z
+    '''
+    numpy, _ = import_pandas()
+    good = frame[~frame['failed']]
+    columns = ['r_wp'] + phases(good)
+    values = good[columns]
+    groups = values.groupby(good['inp'], observed=True)
+    z = (values - groups.transform('mean')) / groups.transform('std')
+    z = z.abs()
+    flagged = (z > threshold).fillna(False)
+    mask = flagged.any(axis=1).to_numpy()
+    result = good.loc[mask, ['inp', 'id', 'source'] + columns].copy()
+    names = numpy.array([f'{column}, ' for column in columns], dtype=object)
+    # bool @ str concatenates the names of the flagged columns
+    result['reason'] = (flagged[mask].to_numpy(dtype=object) @ names)
+    result['reason'] = result['reason'].str.rstrip(', ')
+    result['z'] = z.where(flagged).max(axis=1)[mask].to_numpy()
+    return result.reset_index(drop=True)
+
+
+def batch_summary(frame):
+    '''
+    Per INP and batch: patterns, failures, r_wp and the mean weights
+    '''
+    groups = frame.groupby(['inp', 'batch'], sort=False, observed=True)
+    summary = groups.agg(patterns=('id', 'size'), failed=('failed', 'sum'))
+    good = frame[~frame['failed']].groupby(['inp', 'batch'], sort=False, observed=True)
+    summary['r_wp_mean'] = good['r_wp'].mean()
+    summary['r_wp_max'] = good['r_wp'].max()
+    if 'timestamp' in frame and frame['timestamp'].notna().any():
+        summary['first'] = groups['timestamp'].min()
+        summary['last'] = groups['timestamp'].max()
+    summary = summary.join(good[phases(frame)].mean())
+    return summary.reset_index()
+
+
+def summarize(frame, window=20, threshold=3.0):
+    '''
+    All the tables, by the name they are shown under
+    '''
+    return {
+        'INPs': inp_stats(frame),
+        'Phases': phase_stats(frame),
+        'Batches': batch_summary(frame),
+        'Outliers': outliers(frame, threshold=threshold),
+        'Rolling means': rolling_means(frame, window=window),
+    }
+
+
+def write_report(tables, output):
+    '''
+    Tables as the sheets of an xlsx, or as CSVs named after output
+    '''
+    _, pd = import_pandas()
+    output = pathlib.Path(output)
+    if output.suffix.lower() == '.xlsx':
+        with pd.ExcelWriter(output) as writer:
+            for name, table in tables.items():
+                # Excel has no time zones, the times stay in UTC
+                table = table.copy()
+                for column in table.select_dtypes('datetimetz'):
+                    table[column] = table[column].dt.tz_localize(None)
+                table.to_excel(writer, sheet_name=name, index=False)
+        return
+    for name, table in tables.items():
+        table.to_csv(output.with_name(
+            f'{output.stem}-{name.lower().replace(" ", "_")}.csv'), index=False)
@@ -1,61 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import configparser
-import csv
-import logging
 import os
 import pathlib
-import re
-import subprocess
+import queue
 import sys
+import threading
 import time
 import tkinter as tk
 import tkinter.filedialog as filedialog
 from tkinter import font, messagebox, ttk
 
-import psutil
-
-
-class Config(configparser.ConfigParser):
-
-    def __init__(self, file, default):
-        converters = {'path': pathlib.Path}
-        super().__init__(converters=converters)
-        self.file = str(file)
-        self.default = default
-        self.get_config()
-
-    def get_config(self):
-        self.read(self.file)
-        if not self.sections():
-            self.reset_config()
-            self.update_config()
-
-    def reset_config(self):
-        self.read_dict(self.default)
-
-    def update_config(self):
-        with open(self.file, 'w') as file:
-            self.write(file)
-
-
-class LogHandler(logging.Logger):
-
-    def __init__(self, name, level, file):
-        super().__init__(name)
-        self.level = level
-        self.setLevel(self.level)
-        self.file = file
-        self.set_handler()
-
-    def set_handler(self):
-        file_handler = logging.FileHandler(self.file)
-        file_handler.setLevel(self.level)
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        self.file_handler = file_handler
-        self.addHandler(file_handler)
+from .config import DEFAULT_SETTINGS, LOGLEVEL, NAME, Config, LogHandler
+from .engine import Engine
+from .index import FileIndex
+from .scheduler import Scheduler, Task
 
 
 class ProcesserFrame(ttk.Frame):
@@ -133,6 +91,18 @@ class ProcesserFrame(ttk.Frame):
             width=2)
         self.process_button.grid(row=1, column=6)
 
+        self.throughput_text = tk.StringVar()
+        self.throughput_label = ttk.Label(
+            self, textvariable=self.throughput_text,
+            width=8)
+        self.throughput_label.grid(row=1, column=7)
+
+        self.watch_button = ttk.Button(
+            self, text='W',
+            command=self.watch,
+            width=2)
+        self.watch_button.grid(row=1, column=8)
+
     def on_combobox_configure(self, event):
         max_len = max(len(str(i)) for i in self.data['inp_filenames'].values())
         combo_font = font.nametofont(str(event.widget.cget('font')))
@@ -188,11 +158,7 @@ class ProcesserFrame(ttk.Frame):
         patterns_dir = filedialog.askdirectory(
             title='Choose a dir to read all patterns it contains')
         if os.path.isdir(patterns_dir):
-            patterns = list(
-                map(lambda f: os.path.join(patterns_dir, f),
-                    filter(
-                    lambda f: f.endswith('.raw'),
-                        os.listdir(patterns_dir))))
+            patterns = self.app.find_patterns(patterns_dir)
             self.task['patterns'].extend(patterns)
             self.task['patterns'] = list(set(self.task['patterns']))
         else:
@@ -204,7 +170,9 @@ class ProcesserFrame(ttk.Frame):
             defaultextension='.csv',
             filetypes=[('Comma-separated values file', '.csv'),
                        ('text report', '.txt'),
-                       ('microsoft excel', '.xlsx')],
+                       ('microsoft excel', '.xlsx'),
+                       ('Parquet store', '.parquet'),
+                       ('Feather store', '.feather')],
             title='Choose file to output results')
         if not output:
             output = self.app.path / 'result.csv'
@@ -218,11 +186,53 @@ class ProcesserFrame(ttk.Frame):
         self.choose_output()
 
     def process(self):
-        success = False
+        '''
+        Start the task in the background, or offer to cancel it if it runs
+        '''
+        if hash(self) in self.app.running:
+            if messagebox.askyesno(title='Cancel',
+                                   message='Cancel the running task?'):
+                self.app.cancel(hash(self))
+            return False
+        started = False
         try:
-            success = self.app.process(hash(self))
+            started = bool(self.app.process([hash(self)]))
         except Exception as e:
             self.logger.info(f'processerframe.process: {e}')
+        if not started:
+            self.master.change_button_color(self.process_button, 'red')
+        return started
+
+    def watch(self):
+        '''
+        Refine the patterns written to a directory from now on, until
+        cancelled with √ or W
+        '''
+        if hash(self) in self.app.running:
+            self.process()
+            return
+        patterns_dir = filedialog.askdirectory(
+            title='Choose a dir to watch for new patterns')
+        if not os.path.isdir(patterns_dir):
+            return
+        started = False
+        try:
+            started = self.app.watch(hash(self), pathlib.Path(patterns_dir))
+        except Exception as e:
+            self.logger.info(f'processerframe.watch: {e}')
+        if started:
+            self.process_button_text.set('0/0')
+        else:
+            self.master.change_button_color(self.watch_button, 'red')
+
+    def show_progress(self, done, total, throughput):
+        self.process_button_text.set(f'{done}/{total}')
+        self.process_button.configure(width=len(str(total)) * 2 + 1)
+        self.throughput_text.set(f'{throughput:.2f}/s')
+
+    def finish(self, success):
+        self.process_button_text.set('√')
+        self.process_button.configure(width=2)
         if success:
             self.master.change_button_color(self.process_button, 'green')
         else:
@@ -248,6 +258,7 @@ class ControlFrame(ttk.Frame):
 
     def destroy_processer(self, processer):
         try:
+            self.app.cancel(hash(processer))
             self.tasks.pop(hash(processer))
             processer.destroy()
         except IndexError as e:
@@ -277,6 +288,22 @@ class ControlFrame(ttk.Frame):
             command=self.about)
         self.about_button.grid(row=0, column=3)
 
+        self.use_cache = tk.BooleanVar()
+        self.use_cache.set(self.app.engine.use_cache)
+        self.use_cache_checkbutton = ttk.Checkbutton(
+            self, text='Cache',
+            variable=self.use_cache,
+            command=self.toggle_cache)
+        self.use_cache_checkbutton.grid(row=1, column=0, columnspan=2)
+        self.clear_cache_button = ttk.Button(
+            self, text='Clear cache',
+            command=self.clear_cache)
+        self.clear_cache_button.grid(row=1, column=2, columnspan=2)
+        self.summary_button = ttk.Button(
+            self, text='Summary',
+            command=self.summary)
+        self.summary_button.grid(row=2, column=0, columnspan=4)
+
     def select_TC(self):
         self.data['TC_location'] = pathlib.Path(
             filedialog.askopenfilename(
@@ -284,18 +311,67 @@ class ControlFrame(ttk.Frame):
                 filetypes=[('Executable', '.exe')],
                 title='Find the TOPAS tc.exe'))
 
+    def toggle_cache(self):
+        self.app.engine.use_cache = self.use_cache.get()
+
+    def clear_cache(self):
+        if self.app.engine.cache is None:
+            messagebox.showinfo(title='Alert', message='The cache is disabled in config.ini')
+            return
+        self.app.engine.cache.clear()
+        self.logger.info('controlframe.clear_cache: result cache cleared')
+
+    def summary(self):
+        '''
+        Statistics over the outputs written in this session, or over
+        chosen result files when there are none yet
+        '''
+        sources = [output for output in self.app.outputs if output.exists()]
+        if not sources:
+            sources = [pathlib.Path(file) for file in filedialog.askopenfilenames(
+                filetypes=[('Comma-separated values file', '.csv')],
+                title='Choose result files')]
+        if not sources:
+            return
+        try:
+            tables = self.app.summarize(sources)
+        except Exception as e:
+            self.logger.info(f'controlframe.summary: {e}')
+            messagebox.showinfo(title='Alert', message=str(e))
+            return
+        SummaryWindow(self.master, tables)
+
     def process_all(self):
-        success = 0
-        for task in self.tasks.keys():
-            try:
+        self.process_all_failed = 0
+        self.process_all_pending = set()
+        idle = [task for task in self.tasks if task not in self.app.running]
+        try:
+            # One run for all of them, a short task is not queued behind a long one
+            self.process_all_pending.update(self.app.process(idle))
+        except Exception as e:
+            self.process_all_failed += 1
+            self.logger.info(f'controlframe.process_all: {e}')
+        for task in idle:
+            if task not in self.process_all_pending:
                 processer = self.tasks[task]['processer']
-                processer.process()
-            except Exception as e:
-                success += 1
-                self.logger.info(f'controlframe.process_all: {e}')
-        if success == 0:
+                self.master.change_button_color(processer.process_button, 'red')
+        if not self.process_all_pending:
+            self.process_all_finished()
+
+    def task_finished(self, task, success):
+        pending = getattr(self, 'process_all_pending', set())
+        if task not in pending:
+            return
+        pending.discard(task)
+        if not success:
+            self.process_all_failed += 1
+        if not pending:
+            self.process_all_finished()
+
+    def process_all_finished(self):
+        if self.process_all_failed == 0:
             self.master.change_button_color(self.process_all_button, 'green')
-        elif success != 0:
+        else:
             self.master.change_button_color(self.process_all_button, 'red')
 
     def update_processers_INP_combobox(self):
@@ -316,8 +392,55 @@ Date   : 2017-02-25 15:55
         messagebox.showinfo(title='About', message=string)
 
 
+class SummaryWindow(tk.Toplevel):
+    '''
+    The analytics tables, one tab each
+    '''
+
+    # Rows shown per table, Treeview gets slow with more
+    max_rows = 1000
+
+    def __init__(self, master, tables):
+        super().__init__(master)
+        self.wm_title('Summary')
+        notebook = ttk.Notebook(self)
+        notebook.grid(sticky=tk.NSEW)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        for name, table in tables.items():
+            notebook.add(self.create_table(notebook, table), text=name)
+
+    def create_table(self, master, table):
+        frame = ttk.Frame(master)
+        columns = [str(column) for column in table.columns]
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        for column in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=max(60, font.Font().measure(column) + 20),
+                        stretch=False)
+        for row in table.head(self.max_rows).itertuples(index=False):
+            tree.insert('', tk.END, values=[
+                f'{value:.4g}' if isinstance(value, float) else value
+                for value in row])
+        yscroll = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        xscroll = ttk.Scrollbar(frame, orient=tk.HORIZONTAL, command=tree.xview)
+        tree.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
+        tree.grid(row=0, column=0, sticky=tk.NSEW)
+        yscroll.grid(row=0, column=1, sticky=tk.NS)
+        xscroll.grid(row=1, column=0, sticky=tk.EW)
+        if len(table) > self.max_rows:
+            ttk.Label(frame, text=f'First {self.max_rows} of {len(table)} rows').grid(
+                row=2, column=0, sticky=tk.W)
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+        return frame
+
+
 class AppGUI(ttk.tkinter.Tk):
 
+    # ms between two polls of the worker events
+    poll_interval = 100
+
     def __init__(self, data, logger, title, theme):
         self.title = title
         super().__init__(className=self.title)
@@ -336,8 +459,34 @@ class AppGUI(ttk.tkinter.Tk):
         self.control_frame.grid(sticky=tk.N)
         # Create one processerframe
         self.control_frame.create_processer()
+        self.after(self.poll_interval, self.poll_events)
+
+    def poll_events(self):
+        '''
+        Apply the progress events workers queued, tk is only touched here
+        '''
+        while True:
+            try:
+                kind, task_id, *args = self.app.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'done':
+                self.app.running.pop(task_id, None)
+            task = self.tasks.get(task_id)
+            if task is None:
+                # The processer was removed while its task ran
+                continue
+            processer = task['processer']
+            if kind == 'progress':
+                processer.show_progress(*args)
+            elif kind == 'done':
+                processer.finish(*args)
+                self.control_frame.task_finished(task_id, *args)
+        self.after(self.poll_interval, self.poll_events)
 
     def on_exit(self):
+        for task_id in list(self.app.running):
+            self.app.cancel(task_id)
         self.destroy()
 
     @staticmethod
@@ -394,124 +543,138 @@ class App:
         self.inp_path = self.config['PATH'].getpath('inp_path')
         self.TC_location = self.config['PATH'].getpath('TC_location')
         self.TOPAS_location = self.config['PATH'].getpath('TOPAS_location')
+        self.engine = Engine.from_config(self.config, self.logger)
+        self.index = FileIndex.from_config(self.config, self.logger)
         if not self.inp_path.exists():
             self.inp_path.mkdir()
         self.tasks = dict()
+        # Outputs written in this session, for the summary view
+        self.outputs = []
+        # task_id: cancel event of the tasks queued or running
+        self.running = dict()
+        self.events = queue.Queue()
+        # One worker budget for every run and watch, started by run()
+        self.scheduler = None
         self.data = {
             'TC_location': self.config['PATH'].getpath('TC_location'),
             'TOPAS_location': self.config['PATH'].getpath('TOPAS_location'),
-            'inp_filenames': {file.name: file.absolute() for file in self.inp_path.glob('**/*.inp')},
+            'inp_filenames': self.engine.templates.index(self.inp_path,
+                                                         self.index),
             'inp_path': self.inp_path,
             'tasks': self.tasks,
             'app': self,
         }
 
-    def process(self, task_id):
-        success = True
+    def find_patterns(self, directory):
+        '''
+        The patterns in directory matching the [INDEX] globs
+        '''
+        section = self.config['INDEX']
+        return self.index.find(directory, section['patterns'],
+                               recursive=section.getboolean('recursive'))
+
+    def process(self, task_ids):
+        '''
+        Queue the tasks on the scheduler, next to those already running.
+        Returns the ids of the tasks queued, the progress comes back
+        through self.events.
+        '''
+        tasks = []
+        for task_id in task_ids:
+            try:
+                task = self.prepare(task_id)
+            except Exception as e:
+                self.logger.info(f'app.process: {e}')
+                continue
+            if task is not None:
+                tasks.append(task)
+        if not tasks:
+            return []
+        self.scheduler.add(tasks)
+        return [task.id for task in tasks]
+
+    def prepare(self, task_id, watch=False):
         task = self.tasks.get(task_id, {})
-        processer = task['processer']
         output = task.get('output')
         if output is None:
             task.get('processer').choose_output_alert()
-            self.process(task_id)
-            return
+            return self.prepare(task_id, watch=watch)
         patterns = list(set(task.get('patterns', [])))
-        if len(patterns) == 0:
-            self.logger.info('app.process: processing Nothing')
+        if len(patterns) == 0 and not watch:
+            self.logger.info('app.prepare: processing Nothing')
             return
-        results = list()
         program = task.get('program').absolute()
         inp = task.get('inp').absolute()
         tc = self.data.get('TC_location').absolute()
         topas = self.data.get('TOPAS_location').absolute()
-        self.logger.info(
-            f'app.process: Using {program} process {", ".join(patterns)} with {inp}')
         if program == tc:
-            process_func = self.process_TC
+            process_func = None
         elif program == topas:
             process_func = self.process_TP
         else:
             errs = 'Cannot find process program (TC/TP)'
-            self.logger.info(f'app.process: {errs}')
+            self.logger.info(f'app.prepare: {errs}')
             raise Exception(errs)
-        patterns_len = len(patterns)
-        patterns_width = len(str(patterns_len)) * 2 + 1
-        for index, pattern in enumerate(patterns, start=1):
-            processer.process_button_text.set(f'{index}/{patterns_len}')
-            processer.process_button.configure(width=patterns_width)
-            self.gui.update_idletasks()
-            pattern = pathlib.Path(pattern).absolute()
-            try:
-                result = process_func(tc, inp, pattern)
-            except Exception as e:
-                self.logger.info(f'app.process: {program} {inp} ERROR:{e}')
-                result = {'id': pattern.with_suffix('').name, 'r_wp': 0.00}
-                success = False
-            results.append(result)
-
-        # Assume that the same INP generate the same columns of data
-        headers = []
-        for result in results:
-            for key in result:
-                if key not in headers:
-                    headers.append(key)
-        with open(output, 'a', newline='') as f:
-            f_csv = csv.DictWriter(f, headers)
-            f_csv.writeheader()
-            f_csv.writerows(results)
-        # Clear the output and input files
+        self.engine.tc = tc
+        cancel = threading.Event()
+        self.running[task_id] = cancel
+        if output not in self.outputs:
+            self.outputs.append(output)
+        # Clear the output and input files, new ones go to the next run
         task['output'] = None
         task['patterns'] = list()
-        processer.process_button_text.set('√')
-        processer.process_button.configure(width=2)
-        return success
-
-    def process_TC(self, tc, inp, pattern):
-        self.logger.info(f'app.process_TC: processing {inp}-{pattern}')
-        if not inp.exists() or not pattern.exists():
-            raise
-        result = dict()
-        r_wp = []
-        weights = []
-        inp_content = inp.read_text()
-        xdd_start = inp_content.find('xdd')
-        xdd_stop = inp_content.find('\n\t', xdd_start)
-        xdd_string = inp_content[xdd_start:xdd_stop]
-        inp_content = inp_content.replace(xdd_string, f'xdd "{pattern}"')
-        inp_tmp = pathlib.Path('.') / (str(round(time.time())) + '.inp')
-        with open(inp_tmp, mode='w') as f:
-            f.write(inp_content)
-        inp_out = inp_tmp.with_suffix('.out')
-        info = subprocess.STARTUPINFO()
-        info.dwFlags = subprocess.CREATE_NEW_CONSOLE | subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = subprocess.SW_HIDE
-        proc = subprocess.Popen(args=[str(tc), str(inp_tmp)],
-                                startupinfo=info,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        try:
-            outs, errs = proc.communicate(timeout=150)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            outs, errs = proc.communicate()
-            self.logger.info(f'app.process_TC: {outs}-{errs}')
-        id = [('id', pattern.with_suffix('').name)]
-        try:
-            with open(inp_out, mode='r') as f:
-                inp_output = f.read()
-            r_wp = re.findall(r'.*?(r_wp)  (\d+\.\d+).*',
-                              inp_output, re.DOTALL)
-            weights = re.findall(
-                r'phase_name "(.*?)".*?MVW\( \d+\.\d+`?, \d+\.\d+`?, (\d+\.\d+)`?\)',
-                inp_output, re.DOTALL)
-        except Exception as e:
-            self.logger.info(f'app.process_TC: {e}')
-            r_wp = ['r_wp', 0.00]
-            weights = ['error', 0.00]
-        result = {name: value for name, value in id + r_wp + weights}
-        inp_tmp.unlink()
-        inp_out.unlink()
-        return result
+        start = time.monotonic()
+
+        def progress(done, total):
+            elapsed = time.monotonic() - start
+            throughput = done / elapsed if elapsed else 0.0
+            self.events.put(('progress', task_id, done, total, throughput))
+
+        def finish(success):
+            self.events.put(('done', task_id, success))
+
+        scheduled = Task(inp, patterns, output, progress=progress,
+                         finish=finish, process_func=process_func,
+                         cancel=cancel)
+        scheduled.id = task_id
+        return scheduled
+
+    def watch(self, task_id, directory):
+        '''
+        Start watching directory for the task in a thread of its own,
+        which hands the new patterns to the scheduler
+        '''
+        from .watch import Watcher
+        task = self.prepare(task_id, watch=True)
+        if task is None:
+            return False
+        section = self.config['WATCH']
+        watcher = Watcher(directory, suffix=section['suffix'],
+                          settle=section.getfloat('settle'),
+                          poll_interval=section.getfloat('poll_interval'),
+                          use_inotify=section.getboolean('inotify'),
+                          logger=self.logger)
+        threading.Thread(target=self.watch_task, args=(task, watcher),
+                         daemon=True).start()
+        return True
+
+    def watch_task(self, task, watcher):
+        self.logger.info(f'app.watch_task: watching {watcher.directory}')
+        # Cancelling stops the watch and the patterns queued
+        self.scheduler.follow(task, watcher.batches(task.cancel))
+
+    def summarize(self, sources):
+        from . import analytics
+        window = self.config['ANALYTICS'].getint('window')
+        threshold = self.config['ANALYTICS'].getfloat('threshold')
+        return analytics.summarize(analytics.load(sources), window=window,
+                                   threshold=threshold)
+
+    def cancel(self, task_id):
+        cancel = self.running.get(task_id)
+        if cancel is not None:
+            self.logger.info(f'app.cancel: cancelling task {task_id}')
+            cancel.set()
 
     def process_TP(self, tp, inp, pattern):
         # TODO: Use AutoHotkey control TOPAS GUI-Mode
@@ -519,6 +682,7 @@ class App:
         return
 
     def run(self):
+        import psutil
         pid = 42
         try:
             with open('app.pid', mode='r') as f:
@@ -535,41 +699,39 @@ class App:
             with open('app.pid', mode='w') as f:
                 pid = os.getpid()
                 f.write(str(pid))
+        profiler = None
+        if self.config['PROFILE'].getboolean('enabled'):
+            # The whole session, widget updates included
+            from .profiling import Profiler
+            profiler = Profiler.from_config(self.config, self.engine.metrics,
+                                            self.logger).start()
+        self.scheduler = Scheduler(self.engine)
         self.gui = AppGUI(data=self.data,
                           logger=self.logger,
                           title=self.name,
                           theme=self.config['APPEARANCE']['theme'])
-        self.gui.mainloop()
+        if self.config['REPLAY']['record']:
+            from .replay import Recorder
+            self.engine.recorder = Recorder.from_config(self.config, self.logger)
+        try:
+            self.gui.mainloop()
+        finally:
+            # The GUI cancelled the tasks on exit, their rows are written
+            self.scheduler.close()
+            if profiler is not None:
+                profiler.stop()
+            if self.engine.recorder is not None:
+                self.engine.recorder.close()
         # TODO when self.data changed, config needs to be changed too.
         self.config.update_config()
 
 
 def main(file_path):
     PATH = pathlib.Path(file_path)
-    LOGLEVEL = 'DEBUG'
-    NAME = 'XRD batch helper'
     CONFIGFILE = PATH / 'config.ini'
-    DEFAULT_SETTINGS = {
-        'PATH': {
-            'inp_path': 'INP',
-            'tc_location': r'C:\TOPAS5\tc.exe',
-            'TOPAS_location': r'C:\TOPAS5\Topas.exe',
-        },
-        'APPEARANCE': {
-            'theme': 'clam',
-        },
-    }
     LOGFILE = PATH / 'app.log'
     logger = LogHandler(name=NAME, level=LOGLEVEL, file=LOGFILE)
     config = Config(file=CONFIGFILE, default=DEFAULT_SETTINGS)
     app = App(name=NAME, path=PATH, logger=logger, config=config)
     app.run()
 
-
-if __name__ == "__main__":
-    if hasattr(sys, 'frozen'):
-        basis = sys.executable
-    else:
-        basis = sys.argv[0]
-    required_folder = os.path.split(basis)[0]
-    main(file_path=required_folder)
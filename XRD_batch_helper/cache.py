@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import contextlib
+import hashlib
+import json
+import pathlib
+import sqlite3
+import time
+
+
+class ResultCache:
+    '''
+    Results of finished refinements in SQLite, keyed by what tc was given:
+    the rendered INP, the bytes of the pattern and the tc executable.
+    '''
+
+    def __init__(self, file, max_entries=100000, max_age_days=90):
+        self.file = str(file)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results ('
+                       'key TEXT PRIMARY KEY, result TEXT NOT NULL, '
+                       'created REAL NOT NULL, accessed REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed '
+                       'ON results (accessed)')
+
+    @contextlib.contextmanager
+    def connect(self):
+        # A connection per call, workers use the cache from many threads
+        db = sqlite3.connect(self.file, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def key(inp_content, pattern, tc):
+        digest = hashlib.sha256()
+        digest.update(inp_content.encode())
+        with open(pattern, mode='rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        tc = pathlib.Path(tc)
+        stat = tc.stat()
+        digest.update(f'{tc.absolute()}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.connect() as db:
+            row = db.execute('SELECT result FROM results WHERE key = ?',
+                             (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE results SET accessed = ? WHERE key = ?',
+                       (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        now = time.time()
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                       (key, json.dumps(result), now, now))
+
+    def evict(self):
+        '''
+        Drop entries older than max_age_days, then the least recently used
+        ones beyond max_entries.
+        '''
+        oldest = time.time() - self.max_age_days * 24 * 3600
+        with self.connect() as db:
+            db.execute('DELETE FROM results WHERE created < ?', (oldest,))
+            db.execute('DELETE FROM results WHERE key NOT IN ('
+                       'SELECT key FROM results ORDER BY accessed DESC LIMIT ?)',
+                       (self.max_entries,))
+
+    def clear(self):
+        with self.connect() as db:
+            db.execute('DELETE FROM results')
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import configparser
+import logging
+import pathlib
+
+NAME = 'XRD batch helper'
+LOGLEVEL = 'DEBUG'
+DEFAULT_SETTINGS = {
+    'PATH': {
+        'inp_path': 'INP',
+        'tc_location': r'C:\TOPAS5\tc.exe',
+        'TOPAS_location': r'C:\TOPAS5\Topas.exe',
+        # Scratch directory for the temp INP/.out files of tc runs, best on
+        # a local disk or tmpfs; empty is the system temp directory
+        'scratch': '',
+        # Copy the .raw patterns there too before refining them
+        'stage_patterns': 'no',
+    },
+    'APPEARANCE': {
+        'theme': 'clam',
+    },
+    'PROCESS': {
+        # Parallel tc runs, shared by every task and watch of the GUI;
+        # 0 means one worker per CPU core
+        'workers': '0',
+        # Patterns refined by one tc run (one xdd block each), 1 is off
+        # and 0 picks a size per batch, up to chunk_max, for INPs whose
+        # runs usually take less than chunk_below seconds
+        'chunk_size': '1',
+        'chunk_max': '16',
+        'chunk_below': '30',
+        # The first chunk of each INP has its first pattern refined alone
+        # as well; when the two differ by more than chunk_tolerance
+        # (relative), parameters named in the INP are shared between the
+        # blocks and the INP is refined one pattern per run
+        'chunk_check': 'yes',
+        'chunk_tolerance': '0.001',
+        # Start each pattern from the values refined for the previous one
+        # of the same INP, back to the INP's values when r_wp gets worse
+        # than the reference by more than warm_tolerance (relative)
+        'warm_start': 'no',
+        'warm_tolerance': '0.05',
+        # Reject empty, truncated or unfinished .raw files before tc runs
+        'preflight': 'yes',
+        # Refine only the first of byte-identical patterns, the others get
+        # a copy of its row
+        'dedupe': 'yes',
+    },
+    'WATCH': {
+        # A pattern is refined once its size and mtime have not changed
+        # for settle seconds
+        'settle': '1',
+        'poll_interval': '0.5',
+        'suffix': '.raw',
+        # Use inotify on Linux, poll the directory elsewhere or with no
+        'inotify': 'yes',
+    },
+    'CACHE': {
+        # Results of unchanged INP/pattern/tc inputs are reused
+        'enabled': 'yes',
+        'file': 'results.sqlite',
+        'max_entries': '100000',
+        'max_age_days': '90',
+    },
+    'OUTPUT': {
+        # Rows are fsynced in batches of fsync_every, a watched folder's
+        # one by one
+        'fsync_every': '20',
+        # Skip patterns that already have a row in the output
+        'resume': 'no',
+    },
+    'RUNNER': {
+        # Seconds, until min_samples runs of an INP are in the history
+        'timeout': '150',
+        # Then the timeout is p99 of the INP's wall times * timeout_factor
+        'timeout_factor': '3',
+        'min_samples': '10',
+        'min_timeout': '30',
+        'history': 'history.sqlite',
+        # Regex on tc's console output, group 1 is the refinement cycle
+        'cycle_pattern': r'(?i)\bcycle\D{0,3}(\d+)',
+        # and here group 1 is the cycle's r_wp
+        'r_wp_pattern': r'(?i)\br_?wp\W{0,3}(\d+(?:\.\d*)?)',
+        # Kill a refinement early when its r_wp rose for abort_rising cycles
+        # in a row, or did not improve by abort_min_gain (relative) in
+        # abort_stall cycles; 0 turns a rule off. Neither rule applies in
+        # the first abort_grace cycles
+        'abort_rising': '0',
+        'abort_stall': '0',
+        'abort_min_gain': '0.001',
+        'abort_grace': '3',
+    },
+    'ANALYTICS': {
+        # Patterns per rolling mean of the weights
+        'window': '20',
+        # |z-score| of r_wp or a weight that makes a pattern an outlier
+        'threshold': '3',
+    },
+    'DISTRIBUTED': {
+        # host:port the coordinator listens on, an empty host is every
+        # interface. Workers run what the coordinator sends them and the
+        # coordinator takes their rows, so set authkey to a secret of your
+        # own, the same on every machine; run --distributed and worker
+        # refuse to start without one
+        'listen': '127.0.0.1:50077',
+        'authkey': '',
+        # Seconds between worker heartbeats, a worker silent for
+        # dead_after seconds is dead and its jobs go to the others
+        'heartbeat': '5',
+        'dead_after': '20',
+        # Patterns the coordinator keeps out to workers at once
+        'slots': '64',
+    },
+    'INDEX': {
+        # Directory listings kept between starts, empty to list every time
+        'file': 'index.json',
+        # Globs of the patterns the D button and directories given to run
+        # pick up, space separated
+        'patterns': '*.raw',
+        'recursive': 'yes',
+    },
+    'REPLAY': {
+        # A zip every tc run is recorded to, for replay without TOPAS (see
+        # the replay command), each session to its own <name>-<time>.zip;
+        # empty records nothing, as without --record
+        'record': '',
+    },
+    'PROFILE': {
+        # Profile every batch run, as --profile does; slows the Python side
+        # down, tc runs as usual
+        'enabled': 'no',
+        # Functions and allocations in the report
+        'top': '30',
+        # tracemalloc, the slowest part
+        'memory': 'yes',
+        # Chrome trace timeline of the patterns and stages
+        'trace': 'yes',
+    },
+    'METRICS': {
+        # Per-pattern and per-batch JSON lines, empty to disable
+        'jsonl': 'metrics.jsonl',
+        # Prometheus text file for the node exporter, empty to disable
+        'prom': 'metrics.prom',
+    },
+}
+
+
+class Config(configparser.ConfigParser):
+
+    def __init__(self, file, default):
+        converters = {'path': pathlib.Path}
+        super().__init__(converters=converters)
+        self.file = str(file)
+        self.default = default
+        self.get_config()
+
+    def get_config(self):
+        # Defaults first, so sections added in newer versions are present
+        # even when an older config.ini is read over them.
+        self.reset_config()
+        if not self.read(self.file):
+            self.update_config()
+
+    def reset_config(self):
+        self.read_dict(self.default)
+
+    def update_config(self):
+        with open(self.file, 'w') as file:
+            self.write(file)
+
+
+class LogHandler(logging.Logger):
+
+    def __init__(self, name, level, file):
+        super().__init__(name)
+        self.level = level
+        self.setLevel(self.level)
+        self.file = file
+        self.set_handler()
+
+    def set_handler(self):
+        file_handler = logging.FileHandler(self.file)
+        file_handler.setLevel(self.level)
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler.setFormatter(formatter)
+        self.file_handler = file_handler
+        self.addHandler(file_handler)
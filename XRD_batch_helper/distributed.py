@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing.managers
+import os
+import pathlib
+import socket
+import threading
+import time
+
+from .engine import Engine
+
+# What a worker gets: the INP as rendered by the coordinator, with the
+# pattern's path there and its bytes, the worker stages them locally
+Job = collections.namedtuple('Job', 'id inp inp_content pattern data')
+
+
+def parse_address(address, default_host=''):
+    '''
+    'host:port' or ':port' as a (host, port) tuple
+    '''
+    host, _, port = str(address).rpartition(':')
+    return (host or default_host, int(port))
+
+
+def read_authkey(config):
+    '''
+    [DISTRIBUTED] authkey as bytes, ValueError when it is not set: the
+    manager unpickles what it is sent, anyone with the key can run code
+    '''
+    key = config['DISTRIBUTED']['authkey'].strip()
+    # The default of earlier versions, still in the config.ini they wrote
+    if not key or key == 'xrd-batch':
+        raise ValueError(f'set [DISTRIBUTED] authkey in {config.file} to a '
+                         f'secret shared by the coordinator and its workers')
+    return key.encode()
+
+
+class WorkerStats:
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.first_seen = time.monotonic()
+        self.last_seen = self.first_seen
+        self.alive = True
+        self.jobs = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    def as_dict(self):
+        elapsed = self.last_seen - self.first_seen
+        return {
+            'worker': self.name, 'slots': self.slots, 'alive': self.alive,
+            'jobs': self.jobs, 'failed': self.failed,
+            'busy': round(self.busy, 3),
+            'throughput': self.jobs / elapsed if elapsed else 0.0,
+        }
+
+
+class Board:
+    '''
+    Jobs waiting, jobs leased to workers and the workers' heartbeats.
+
+    The coordinator's threads submit jobs and wait on their futures, the
+    workers call hello, beat, take and done through the manager. A worker
+    silent for dead_after seconds is dead and its jobs go back to the
+    front of the queue.
+    '''
+
+    def __init__(self, dead_after=20):
+        self.dead_after = dead_after
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.counter = itertools.count()
+        self.queue = collections.deque()
+        # job id: Job, future and the worker it is leased to, if any
+        self.jobs = dict()
+        self.futures = dict()
+        self.leases = dict()
+        self.workers = dict()
+
+    # Coordinator side
+
+    def submit(self, inp, inp_content, pattern, data):
+        future = concurrent.futures.Future()
+        with self.lock:
+            job = Job(next(self.counter), str(inp), inp_content, str(pattern), data)
+            self.jobs[job.id] = job
+            self.futures[job.id] = future
+            self.queue.append(job.id)
+            self.ready.notify()
+        return job.id, future
+
+    def withdraw(self, job_id):
+        with self.lock:
+            self.forget(job_id)
+
+    def forget(self, job_id):
+        self.jobs.pop(job_id, None)
+        self.leases.pop(job_id, None)
+        future = self.futures.pop(job_id, None)
+        if job_id in self.queue:
+            self.queue.remove(job_id)
+        return future
+
+    def reap(self):
+        '''
+        Mark silent workers dead and queue their jobs again, returns the
+        names of the workers found dead and the number of jobs requeued
+        '''
+        now = time.monotonic()
+        dead = []
+        requeued = 0
+        with self.lock:
+            for worker in self.workers.values():
+                if worker.alive and now - worker.last_seen > self.dead_after:
+                    worker.alive = False
+                    dead.append(worker.name)
+            for job_id, worker in list(self.leases.items()):
+                if worker in dead:
+                    del self.leases[job_id]
+                    self.queue.appendleft(job_id)
+                    requeued += 1
+            if requeued:
+                self.ready.notify_all()
+        return dead, requeued
+
+    def stats(self):
+        with self.lock:
+            return [worker.as_dict() for worker in self.workers.values()]
+
+    # Worker side, through the manager
+
+    def seen(self, worker):
+        stats = self.workers.get(worker)
+        if stats is None:
+            return None
+        stats.last_seen = time.monotonic()
+        stats.alive = True
+        return stats
+
+    def hello(self, worker, slots):
+        with self.lock:
+            stats = self.workers.get(worker)
+            if stats is None:
+                self.workers[worker] = WorkerStats(worker, slots)
+            else:
+                stats.slots = slots
+                self.seen(worker)
+
+    def beat(self, worker):
+        with self.lock:
+            self.seen(worker)
+
+    def take(self, worker, wait=1.0):
+        '''
+        The next job for worker, waiting up to wait seconds for one
+        '''
+        with self.lock:
+            self.seen(worker)
+            if not self.queue:
+                self.ready.wait(wait)
+            if not self.queue:
+                return None
+            job_id = self.queue.popleft()
+            self.leases[job_id] = worker
+            return tuple(self.jobs[job_id])
+
+    def done(self, worker, job_id, result, error, wall):
+        with self.lock:
+            stats = self.seen(worker)
+            if stats is not None:
+                stats.jobs += 1
+                stats.busy += wall
+                if error is not None:
+                    stats.failed += 1
+            # A job reassigned meanwhile keeps the first result to arrive
+            future = self.forget(job_id)
+        if future is not None and not future.done():
+            future.set_result((result, error, worker))
+
+
+class Coordinator:
+    '''
+    Serves jobs to remote workers over a multiprocessing manager.
+
+    process_TC has the signature of Engine.process_TC, run with it as the
+    process_func of a task every pattern goes to a worker as one job. The
+    cache stays on the coordinator.
+    '''
+
+    def __init__(self, engine, authkey, address=('127.0.0.1', 50077),
+                 heartbeat=5, dead_after=20, logger=None):
+        if not authkey:
+            raise ValueError('coordinator: an authkey is required')
+        self.engine = engine
+        self.logger = logger or engine.logger
+        self.heartbeat = heartbeat
+        self.board = Board(dead_after=dead_after)
+        # A class per coordinator, register() is per class
+        manager_class = type('BoardManager', (multiprocessing.managers.BaseManager,), {})
+        manager_class.register('board', callable=lambda: self.board,
+                               exposed=('hello', 'beat', 'take', 'done'))
+        manager_class.register('heartbeat', callable=lambda: self.heartbeat)
+        self.manager = manager_class(address=address, authkey=authkey)
+        self.server = None
+        self.stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, engine, logger):
+        section = config['DISTRIBUTED']
+        return cls(engine,
+                   address=parse_address(section['listen']),
+                   authkey=read_authkey(config),
+                   heartbeat=section.getfloat('heartbeat'),
+                   dead_after=section.getfloat('dead_after'),
+                   logger=logger)
+
+    def start(self):
+        self.server = self.manager.get_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.reaper, daemon=True).start()
+        host, port = self.server.address
+        self.logger.info(f'coordinator.start: listening on {host or socket.gethostname()}:{port}')
+
+    def shutdown(self):
+        self.stop.set()
+        for stats in self.board.stats():
+            self.logger.info(
+                f'coordinator.shutdown: {stats["worker"]} {stats["jobs"]} jobs, '
+                f'{stats["failed"]} failed, {stats["throughput"]:.2f}/s'
+                f'{"" if stats["alive"] else ", dead"}')
+            self.engine.metrics.emit({'type': 'worker', 'time': time.time(), **stats})
+        if self.server is not None:
+            self.server.stop_event.set()
+
+    def reaper(self):
+        while not self.stop.wait(self.heartbeat):
+            dead, requeued = self.board.reap()
+            for worker in dead:
+                self.logger.info(f'coordinator.reaper: {worker} is dead')
+            if requeued:
+                self.logger.info(f'coordinator.reaper: {requeued} jobs queued again')
+
+    def process_TC(self, tc, inp, pattern):
+        self.logger.info(f'coordinator.process_TC: queueing {inp}-{pattern}')
+        if not inp.exists() or not pattern.exists():
+            raise FileNotFoundError(f'{inp} or {pattern} does not exist')
+        engine = self.engine
+        with engine.metrics.stage('render'):
+            inp_content = engine.templates.render(inp, pattern)
+        key = None
+        if tc.exists():
+            # The cache key includes tc, only known when it is here too
+            key, result = engine.cached(tc, inp_content, pattern)
+            if result is not None:
+                return result
+        job_id, future = self.board.submit(inp, inp_content, pattern,
+                                           pattern.read_bytes())
+        cancel = getattr(engine.local, 'cancel', None)
+        with engine.metrics.stage('remote'):
+            while True:
+                try:
+                    result, error, worker = future.result(timeout=self.heartbeat)
+                    break
+                except concurrent.futures.TimeoutError:
+                    if cancel is not None and cancel.is_set():
+                        self.board.withdraw(job_id)
+                        raise concurrent.futures.CancelledError()
+        engine.metrics.note(worker=worker)
+        if error is not None:
+            raise RuntimeError(f'{worker}: {error}')
+        if key is not None and 'error' not in result:
+            with engine.metrics.stage('cache'):
+                engine.cache.put(key, result)
+        return result
+
+
+class Worker:
+    '''
+    Takes jobs from a coordinator and refines them with the local tc,
+    slots at a time, until the coordinator goes away.
+    '''
+
+    def __init__(self, address, authkey, tc, logger, slots=1, name=None,
+                 runner=None, workspace=None):
+        manager_class = type('BoardManager', (multiprocessing.managers.BaseManager,), {})
+        manager_class.register('board')
+        manager_class.register('heartbeat')
+        self.manager = manager_class(address=address, authkey=authkey)
+        self.slots = slots
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.logger = logger
+        self.engine = Engine(tc=tc, logger=logger, workers=slots,
+                             runner=runner, workspace=workspace)
+        self.stop = threading.Event()
+
+    def run(self):
+        self.manager.connect()
+        board = self.manager.board()
+        heartbeat = self.manager.heartbeat()._getvalue()
+        board.hello(self.name, self.slots)
+        self.logger.info(
+            f'worker.run: {self.name} connected to {self.manager.address} with {self.slots} slots')
+        threads = [threading.Thread(target=self.beat, args=(board, heartbeat),
+                                    daemon=True)]
+        threads += [threading.Thread(target=self.loop, args=(board,))
+                    for _ in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        self.logger.info(f'worker.run: {self.name} stopped')
+
+    def beat(self, board, heartbeat):
+        while not self.stop.wait(heartbeat):
+            try:
+                board.beat(self.name)
+            except (EOFError, OSError):
+                self.stop.set()
+
+    def loop(self, board):
+        while not self.stop.is_set():
+            try:
+                job = board.take(self.name)
+                if job is None:
+                    continue
+                result, error, wall = self.refine(Job(*job))
+                board.done(self.name, job[0], result, error, wall)
+            except (EOFError, OSError) as e:
+                self.logger.info(
+                    f'worker.loop: coordinator gone ({type(e).__name__} {e})')
+                self.stop.set()
+
+    def refine(self, job):
+        engine = self.engine
+        # The coordinator may run on Windows
+        name = job.pattern.replace('\\', '/').rsplit('/', 1)[-1]
+        id = pathlib.PurePath(name).with_suffix('').name
+        start = time.monotonic()
+        error = None
+        result = None
+        with engine.workspace.acquire() as directory:
+            local = directory / name
+            local.write_bytes(job.data)
+            engine.local.directory = directory
+            engine.local.staged = {job.pattern: local}
+            try:
+                parsed, _, _ = engine.refine(engine.tc, job.inp, job.inp_content)
+                if parsed is None:
+                    result = {'id': id, 'r_wp': 0.00, 'error': 0.00}
+                else:
+                    result = parsed.as_dict(id)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            finally:
+                engine.local.directory = None
+                engine.local.staged = dict()
+        self.logger.info(f'worker.refine: {job.pattern} {"ERROR " + error if error else "done"}')
+        return result, error, time.monotonic() - start
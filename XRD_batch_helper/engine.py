@@ -0,0 +1,805 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import contextlib
+import collections
+import functools
+import itertools
+import math
+import os
+import pathlib
+import re
+import threading
+import uuid
+
+from .cache import ResultCache
+from .metrics import Metrics, Timings
+from .outparser import parse_out, parse_out_xdds
+from .rawfile import InvalidRaw, content_hash, read_raw
+from .runner import Aborted, Monitor, Runner, RuntimeHistory
+from .scheduler import Task, schedule
+from .template import InpTemplate, TemplateCache
+from .workspace import Workspace
+from .writer import open_writer
+
+# template is None until the first good .out, wall and cycles are the cold
+# run's, for reporting what warm starts save
+Warm = collections.namedtuple('Warm', 'template r_wp wall cycles')
+# TOPAS writes refined values with their error, 1.23`_0.04; an INP takes 1.23`
+ERROR_SUFFIX = re.compile(r'`_\d+(?:\.\d*)?(?:[eE][-+]?\d+)?')
+
+
+class Engine:
+    '''
+    Batch refinement without any GUI, the tkinter App and the command line
+    are both clients of it.
+    '''
+
+    def __init__(self, tc, logger, workers=0, cache=None, fsync_every=20,
+                 resume=False, runner=None, metrics=None, chunk_size=1,
+                 chunk_max=16, chunk_below=30, chunk_check=True,
+                 chunk_tolerance=0.001, warm_start=False,
+                 warm_tolerance=0.05, cycle_pattern=r'(?i)\bcycle\D{0,3}(\d+)',
+                 workspace=None, preflight=True, dedupe=True):
+        self.tc = pathlib.Path(tc)
+        self.logger = logger
+        self.runner = runner or Runner()
+        self.metrics = metrics or Metrics()
+        self.workers = workers or os.cpu_count()
+        self.fsync_every = fsync_every
+        self.resume = resume
+        # Patterns per tc run, 0 lets chunk_size_for pick
+        self.chunk_size = chunk_size
+        self.chunk_max = chunk_max
+        self.chunk_below = chunk_below
+        # inp: whether its chunks give what single runs give, found out by
+        # its first chunk while the others wait on the event in chunk_checks
+        self.chunk_check = chunk_check
+        self.chunk_tolerance = chunk_tolerance
+        self.chunk_agrees = dict()
+        self.chunk_checks = dict()
+        self.chunk_lock = threading.Lock()
+        # inp: Warm, starting values from the last good .out of that INP
+        self.warm_start = warm_start
+        self.warm_tolerance = warm_tolerance
+        self.warm = dict()
+        self.warm_lock = threading.Lock()
+        self.cycle_pattern = re.compile(cycle_pattern)
+        # Check the .raw headers and drop byte-identical patterns before
+        # any tc run
+        self.preflight = preflight
+        self.dedupe = dedupe
+        self.templates = TemplateCache()
+        self.workspace = workspace or Workspace(logger=logger)
+        # The cancel event of the batch a worker thread is running, its
+        # scratch directory and the patterns staged there
+        self.local = threading.local()
+        self.cache = cache
+        self.use_cache = cache is not None
+        # A replay.Recorder every tc run goes to
+        self.recorder = None
+
+    @classmethod
+    def from_config(cls, config, logger):
+        # Files are relative to the app dir, which holds config.ini
+        app_dir = pathlib.Path(config.file).parent
+        runner = config['RUNNER']
+        monitor = None
+        if runner.getint('abort_rising') or runner.getint('abort_stall'):
+            monitor = functools.partial(
+                Monitor, r_wp_pattern=runner['r_wp_pattern'],
+                cycle_pattern=runner['cycle_pattern'],
+                rising=runner.getint('abort_rising'),
+                stall=runner.getint('abort_stall'),
+                min_gain=runner.getfloat('abort_min_gain'),
+                grace=runner.getint('abort_grace'))
+        cache = None
+        if config['CACHE'].getboolean('enabled'):
+            file = app_dir / config['CACHE'].getpath('file')
+            cache = ResultCache(file=file,
+                                max_entries=config['CACHE'].getint('max_entries'),
+                                max_age_days=config['CACHE'].getfloat('max_age_days'))
+        return cls(tc=config['PATH'].getpath('TC_location'),
+                   logger=logger,
+                   workers=config['PROCESS'].getint('workers'),
+                   cache=cache,
+                   fsync_every=config['OUTPUT'].getint('fsync_every'),
+                   resume=config['OUTPUT'].getboolean('resume'),
+                   chunk_size=config['PROCESS'].getint('chunk_size'),
+                   chunk_max=config['PROCESS'].getint('chunk_max'),
+                   chunk_below=config['PROCESS'].getfloat('chunk_below'),
+                   chunk_check=config['PROCESS'].getboolean('chunk_check'),
+                   chunk_tolerance=config['PROCESS'].getfloat('chunk_tolerance'),
+                   warm_start=config['PROCESS'].getboolean('warm_start'),
+                   warm_tolerance=config['PROCESS'].getfloat('warm_tolerance'),
+                   cycle_pattern=config['RUNNER']['cycle_pattern'],
+                   preflight=config['PROCESS'].getboolean('preflight'),
+                   dedupe=config['PROCESS'].getboolean('dedupe'),
+                   runner=Runner(
+                       history=RuntimeHistory(
+                           app_dir / config['RUNNER'].getpath('history')),
+                       timeout=config['RUNNER'].getfloat('timeout'),
+                       factor=config['RUNNER'].getfloat('timeout_factor'),
+                       min_samples=config['RUNNER'].getint('min_samples'),
+                       min_timeout=config['RUNNER'].getfloat('min_timeout'),
+                       monitor=monitor),
+                   workspace=Workspace(
+                       root=app_dir / config['PATH']['scratch']
+                       if config['PATH']['scratch'] else None,
+                       stage_patterns=config['PATH'].getboolean('stage_patterns'),
+                       logger=logger),
+                   metrics=Metrics(
+                       jsonl=app_dir / config['METRICS']['jsonl']
+                       if config['METRICS']['jsonl'] else None,
+                       prom=app_dir / config['METRICS']['prom']
+                       if config['METRICS']['prom'] else None))
+
+    def process(self, inp, patterns, output, progress=None,
+                process_func=None, cancel=None):
+        '''
+        Refine every pattern with inp and append the results to output.
+        progress(done, total) is called from the calling thread after each
+        pattern finishes. Setting the cancel event kills the running tc
+        processes and drops the patterns not started yet.
+        '''
+        task = Task(inp, patterns, output, progress=progress,
+                    process_func=process_func, cancel=cancel)
+        if not self.process_tasks([task]):
+            return
+        return task.success
+
+    def process_tasks(self, tasks):
+        '''
+        Run several tasks over one pool of workers, see scheduler.schedule
+        for the order. Each task's results go to its output in its pattern
+        order, tasks with the same output share one writer. Returns the
+        tasks that had anything to process.
+        '''
+        tc = self.tc.absolute()
+        with contextlib.ExitStack() as stack:
+            started = []
+            # Tasks with the same output share its writer, one header and
+            # journal per file
+            writers = dict()
+            for task in tasks:
+                key = pathlib.Path(task.output).resolve()
+                if key not in writers:
+                    writers[key] = stack.enter_context(open_writer(
+                        task.output, fsync_every=self.fsync_every,
+                        logger=self.logger, inp=task.inp))
+                task.writer = writers[key]
+                if self.prepare(task):
+                    started.append(task)
+            if started:
+                self.run(tc, started)
+        if self.cache is not None:
+            self.cache.evict()
+        return started
+
+    def prepare(self, task):
+        '''
+        Resume, pre-flight and chunk a task whose writer is open. A task
+        left with nothing to refine is finished here; returns whether it
+        has chunks to run.
+        '''
+        task.process_func = task.process_func or self.process_TC
+        if self.resume:
+            done = task.writer.done()
+            count = len(task.patterns)
+            task.patterns = [pattern for pattern in task.patterns
+                             if not done(pattern)]
+            task.skipped = count - len(task.patterns)
+            if task.skipped:
+                self.logger.info(
+                    f'engine.prepare: resume, {task.skipped} patterns already in {task.output}')
+        task.batch = self.metrics.batch(task.inp)
+        self.check(task, 0, dict())
+        if len(task.patterns) == 0:
+            self.logger.info('engine.prepare: processing Nothing')
+            self.write_rejected(task)
+            if task.finish is not None:
+                task.finish(task.success)
+            return False
+        self.logger.info(
+            f'engine.prepare: Using {self.tc.absolute()} process {", ".join(task.patterns)} with {task.inp}')
+        task.chunks = self.chunks(task, 0)
+        return True
+
+    def follow(self, task, batches):
+        '''
+        Process a task whose patterns keep coming: batches yields lists of
+        new patterns, often empty ones, until it is exhausted or the task
+        is cancelled. Each batch is queued as soon as it comes and results
+        are written in the order the patterns came, for a hot folder.
+        Every row is flushed as it is written and rejected patterns get
+        theirs as soon as they are checked, results come minutes apart; a
+        new CSV holds them until the first good row sets its header.
+        '''
+        tc = self.tc.absolute()
+        with open_writer(task.output, fsync_every=1,
+                         logger=self.logger, inp=task.inp) as task.writer, \
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers) as executor:
+            # Patterns the task came with go first
+            first = self.stream(task)
+            futures = dict()
+            for patterns in itertools.chain([first], batches):
+                for chunk in self.extend(task, patterns):
+                    future = executor.submit(
+                        self.timed, task.process_func, tc, task.inp,
+                        [pathlib.Path(task.patterns[index]) for index in chunk],
+                        task.cancel)
+                    futures[future] = chunk
+                for future in [future for future in futures if future.done()]:
+                    self.collect(tc, task, futures.pop(future), future.result())
+                if task.cancelled:
+                    break
+            for future in concurrent.futures.as_completed(futures):
+                rows = None
+                if not future.cancelled():
+                    rows = future.result()
+                chunk = futures[future]
+                self.collect(tc, task, chunk, rows or [
+                    (None, concurrent.futures.CancelledError(), None)] * len(chunk))
+            self.finish(task)
+        if self.cache is not None:
+            self.cache.evict()
+
+    def stream(self, task):
+        '''
+        Set up a task whose writer is open for patterns that keep coming,
+        returns the patterns it came with for the first extend()
+        '''
+        task.process_func = task.process_func or self.process_TC
+        task.streaming = True
+        task.resumed = task.writer.done() if self.resume else None
+        task.batch = self.metrics.batch(task.inp)
+        first, task.patterns = task.patterns, []
+        return first
+
+    def extend(self, task, patterns):
+        '''
+        Add the patterns of a streaming task not seen before, pre-flighted,
+        and return the chunks to queue for them
+        '''
+        patterns = [pattern for pattern in
+                    (str(pathlib.Path(pattern).absolute()) for pattern in patterns)
+                    if pattern not in task.seen
+                    and not (task.resumed and task.resumed(pattern))]
+        if not patterns:
+            return []
+        self.logger.info(
+            f'engine.extend: {len(patterns)} new patterns for {task.inp}')
+        start = len(task.patterns)
+        task.patterns += patterns
+        task.seen.update(patterns)
+        self.check(task, start, task.hashes)
+        self.write_rejected(task)
+        return self.chunks(task, start)
+
+    def check(self, task, start, hashes):
+        '''
+        Pre-flight the patterns of task from start on: .raw files with a bad
+        header go to task.rejected for a failed row at the end, patterns
+        byte-identical to one not written yet (hashes, digest: (path,
+        index)) go to its task.duplicates and get a copy of its row.
+        Neither reaches tc.
+        '''
+        if not self.preflight and not self.dedupe:
+            return
+        kept = []
+        for pattern in task.patterns[start:]:
+            timings = Timings()
+            try:
+                with self.metrics.stage('preflight', timings):
+                    if self.preflight and pattern.lower().endswith('.raw'):
+                        read_raw(pattern)
+                    digest = content_hash(pattern) if self.dedupe else None
+            except (InvalidRaw, OSError) as e:
+                self.logger.info(f'engine.check: rejected {pattern}: {e}')
+                task.success = False
+                task.rejected.append((pattern, timings))
+                continue
+            if digest is not None:
+                first, index = hashes.get(digest, (None, None))
+                # A pattern already written, in a hot folder, is refined again
+                if first is not None and index >= task.next_index:
+                    self.logger.info(
+                        f'engine.check: {pattern} is identical to {first}, gets its row')
+                    task.duplicates.setdefault(first, []).append(pattern)
+                    continue
+                hashes[digest] = (pattern, start + len(kept))
+            kept.append(pattern)
+        task.patterns[start:] = kept
+
+    def chunks(self, task, start):
+        '''
+        The patterns of task from start on, split into the chunks one tc
+        run refines
+        '''
+        count = len(task.patterns) - start
+        chunk_size = 1
+        if task.process_func == self.process_TC and self.chunkable(task.inp):
+            chunk_size = self.chunk_size_for(task.inp, count)
+            if chunk_size > 1:
+                self.logger.info(
+                    f'engine.chunks: {task.inp} in chunks of {chunk_size}')
+        return [range(index, min(index + chunk_size, len(task.patterns)))
+                for index in range(start, len(task.patterns), chunk_size)]
+
+    def run(self, tc, tasks):
+        '''
+        Each result is written as soon as it and all before it in its task
+        are finished. Cancelled patterns get no row.
+
+        On Ctrl-C or an error the tasks are cancelled: running tc processes
+        are killed, queued chunks dropped and the rows finished by then
+        written before the exception goes on.
+        '''
+        for task in tasks:
+            # Handed to every chunk, so an interrupt can reach running tc
+            if task.cancel is None:
+                task.cancel = threading.Event()
+        # tc does the work in its own process, threads only wait on it
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers) as executor:
+            futures = dict()
+            try:
+                for task, chunk in schedule(tasks, self.expected):
+                    future = executor.submit(
+                        self.timed, task.process_func, tc, task.inp,
+                        [pathlib.Path(task.patterns[index]) for index in chunk],
+                        task.cancel)
+                    futures[future] = (task, chunk)
+                for future in concurrent.futures.as_completed(futures):
+                    self.collect_future(tc, tasks, futures, future)
+            except BaseException:
+                self.logger.info('engine.run: interrupted, cancelling the batch')
+                for task in tasks:
+                    task.cancel.set()
+                for future in futures:
+                    future.cancel()
+                for future in concurrent.futures.as_completed(list(futures)):
+                    self.collect_future(tc, tasks, futures, future)
+                raise
+
+    def collect_future(self, tc, tasks, futures, future):
+        task, chunk = futures.pop(future)
+        if any(other.cancelled for other in tasks):
+            for pending, (other, _) in futures.items():
+                if other.cancelled:
+                    pending.cancel()
+        if future.cancelled():
+            rows = [(None, concurrent.futures.CancelledError(), None)] * len(chunk)
+        else:
+            rows = future.result()
+        self.collect(tc, task, chunk, rows)
+
+    def collect(self, tc, task, chunk, rows):
+        for index, (result, error, timings) in zip(chunk, rows):
+            pattern = pathlib.Path(task.patterns[index])
+            task.done += 1
+            status = 'ok'
+            if isinstance(error, concurrent.futures.CancelledError):
+                task.finished[index] = None
+                task.success = False
+                continue
+            if error is not None:
+                self.logger.info(f'engine.collect: {tc} {task.inp} ERROR:{error}')
+                result = {'id': pattern.with_suffix('').name, 'r_wp': 0.00}
+                task.success = False
+                status = 'aborted' if isinstance(error, Aborted) else 'failed'
+            elif 'error' in result:
+                status = 'failed'
+            task.finished[index] = (result, timings, status)
+        while task.next_index in task.finished:
+            row = task.finished.pop(task.next_index)
+            if row is not None:
+                result, timings, status = row
+                pattern = task.patterns[task.next_index]
+                with self.metrics.stage('csv', timings):
+                    task.writer.write(pattern, result, inp=task.inp)
+                    for duplicate in task.duplicates.pop(pattern, ()):
+                        task.writer.write(duplicate, dict(
+                            result, id=pathlib.Path(duplicate).with_suffix('').name),
+                            inp=task.inp)
+                task.batch.pattern(task.patterns[task.next_index], timings, status)
+            task.next_index += 1
+        if task.progress is not None:
+            # GUI refreshes count for the batch, not for a pattern
+            with self.metrics.stage('progress', task.batch.stages):
+                task.progress(task.done, len(task.patterns))
+        if task.complete and not task.streaming:
+            self.finish(task)
+
+    def write_rejected(self, task):
+        # After the results, a first row without phases would leave the
+        # CSV header without them
+        for pattern, timings in task.rejected:
+            with self.metrics.stage('csv', timings):
+                task.writer.write(pattern, {
+                    'id': pathlib.Path(pattern).with_suffix('').name,
+                    'r_wp': 0.00, 'error': 0.00}, inp=task.inp)
+            task.batch.pattern(pattern, timings, 'rejected')
+        task.rejected = []
+
+    def finish(self, task):
+        self.write_rejected(task)
+        task.writer.flush()
+        record = task.batch.finish()
+        self.logger.info(
+            f'engine.finish: {task.inp} {record["patterns"]} patterns in '
+            f'{record["wall"]:.1f}s, {record["throughput"]:.2f}/s, '
+            f'p50 {record["p50"]:.1f}s p95 {record["p95"]:.1f}s, '
+            f'{record["failures"]} failed')
+        if task.finish is not None:
+            task.finish(task.success and not task.cancelled)
+
+    def expected(self, task):
+        '''
+        Expected seconds per pattern: the INP's median in the history, else
+        the median of all INPs, else the tc timeout as a pessimistic guess
+        '''
+        history = self.runner.history
+        if history is None:
+            return self.runner.default_timeout
+        walls = history.walls(task.inp)
+        if not walls:
+            walls = history.walls(None)
+        if not walls:
+            return self.runner.default_timeout
+        return history.quantile(walls, 0.5)
+
+    def chunkable(self, inp):
+        try:
+            return self.templates.get(inp).chunkable
+        except (OSError, ValueError):
+            # The single runs report what is wrong with the INP
+            return False
+
+    def chunk_size_for(self, inp, count):
+        '''
+        Patterns per tc run: chunk_size when set, else enough to amortize
+        tc startup while leaving every worker several chunks to balance.
+        INPs whose runs take longer than chunk_below seconds are not
+        chunked, startup is a small share of them.
+        '''
+        if self.chunk_size > 0:
+            return self.chunk_size
+        history = self.runner.history
+        if history is not None:
+            walls = history.walls(inp)
+            if walls and history.quantile(walls, 0.5) > self.chunk_below:
+                return 1
+        return max(1, min(self.chunk_max, count // (self.workers * 4)))
+
+    def timed(self, process_func, tc, inp, patterns, cancel=None):
+        '''
+        Run process_func on patterns in a worker, returning a (result,
+        error, timings) per pattern. A chunk goes through one tc run, the
+        patterns it gave no result for are run one by one.
+        '''
+        if cancel is not None and cancel.is_set():
+            return [(None, concurrent.futures.CancelledError(), dict())] * len(patterns)
+        self.local.cancel = cancel
+        with self.workspace.acquire() as directory:
+            self.local.directory = directory
+            staging = Timings()
+            with self.metrics.stage('stage', staging):
+                # All patterns of the chunk in one go, before any tc run
+                self.local.staged = self.workspace.stage(directory, patterns)
+            try:
+                rows = self.timed_rows(process_func, tc, inp, patterns)
+            finally:
+                self.local.directory = None
+                self.local.staged = dict()
+        if self.workspace.stage_patterns:
+            for _, _, timings in rows:
+                timings['stage'] = staging.get('stage', 0.0) / len(patterns)
+        return rows
+
+    def timed_rows(self, process_func, tc, inp, patterns):
+        rows = [None] * len(patterns)
+        if len(patterns) > 1:
+            self.metrics.begin(f'chunk of {len(patterns)}')
+            try:
+                results = self.process_TC_chunk(tc, inp, patterns)
+            except Exception as e:
+                self.logger.info(f'engine.timed: chunk of {len(patterns)} failed: {e}')
+                results = [None] * len(patterns)
+            timings = self.metrics.end()
+            # Time of the shared run is split evenly over its patterns
+            share = {name: value / len(patterns) for name, value in timings.items()}
+            for index, result in enumerate(results):
+                if result is not None:
+                    rows[index] = (result, None, Timings(share))
+            fallback = rows.count(None)
+            if fallback:
+                self.logger.info(
+                    f'engine.timed: {fallback} of {len(patterns)} patterns fall back to single runs')
+        for index, pattern in enumerate(patterns):
+            if rows[index] is not None:
+                continue
+            self.metrics.begin(pattern.name)
+            try:
+                rows[index] = (process_func(tc, inp, pattern), None,
+                               self.metrics.end())
+            except Exception as e:
+                rows[index] = (None, e, self.metrics.end())
+        return rows
+
+    @contextlib.contextmanager
+    def run_tc(self, tc, inp, inp_content, scale=1):
+        '''
+        Write inp_content to a temp INP in the worker's scratch directory,
+        run tc on it there and yield the .out and the run's RunStats; both
+        files are removed afterwards.
+        '''
+        stack = contextlib.ExitStack()
+        directory = getattr(self.local, 'directory', None)
+        if directory is None:
+            directory = stack.enter_context(self.workspace.acquire())
+        # Unique per call, a chunk may fall back to several runs in a row
+        inp_tmp = directory / (uuid.uuid4().hex + '.inp')
+        inp_out = inp_tmp.with_suffix('.out')
+        try:
+            with self.metrics.stage('write'):
+                local_content = self.workspace.localize(
+                    inp_content, getattr(self.local, 'staged', None) or dict())
+                with open(inp_tmp, mode='w') as f:
+                    f.write(local_content)
+            with self.metrics.stage('tc'):
+                stats = self.runner.run([str(tc), str(inp_tmp)], inp=inp,
+                                        cwd=directory,
+                                        cancel=getattr(self.local, 'cancel', None),
+                                        scale=scale)
+            self.logger.info(
+                f'engine.run_tc: {inp_tmp.name} exit {stats.returncode} '
+                f'wall {stats.wall:.1f}s cpu {stats.cpu:.1f}s '
+                f'rss {stats.rss / 2 ** 20:.0f}MB')
+            if stats.killed == 'cancelled':
+                raise concurrent.futures.CancelledError()
+            if self.recorder is not None:
+                with self.metrics.stage('record'):
+                    self.recorder.record(inp_content, inp_out, stats)
+            if stats.killed == 'aborted':
+                self.logger.info(f'engine.run_tc: {inp_tmp.name} aborted, {stats.reason}')
+                self.metrics.note(aborted=stats.reason)
+                raise Aborted(stats.reason)
+            if stats.killed == 'timeout':
+                # Whatever .out tc left behind is stale or partial
+                self.logger.info(f'engine.run_tc: {stats.stdout}-{stats.stderr}')
+                raise TimeoutError(f'tc killed after {stats.timeout:.0f}s')
+            yield inp_out, stats
+        finally:
+            with self.metrics.stage('cleanup'):
+                for file in (inp_tmp, inp_out):
+                    if file.exists():
+                        file.unlink()
+            stack.close()
+
+    def cached(self, tc, inp_content, pattern):
+        '''
+        Returns (key, cached result or None), key is None when the cache is off
+        '''
+        if not self.use_cache or self.cache is None:
+            return None, None
+        with self.metrics.stage('cache'):
+            key = self.cache.key(inp_content, pattern, tc)
+            result = self.cache.get(key)
+        if result is not None:
+            self.logger.info(f'engine.cached: cache hit for {pattern}')
+            result['id'] = pattern.with_suffix('').name
+        return key, result
+
+    def process_TC(self, tc, inp, pattern):
+        self.logger.info(f'engine.process_TC: processing {inp}-{pattern}')
+        if not inp.exists() or not pattern.exists():
+            raise FileNotFoundError(f'{inp} or {pattern} does not exist')
+        with self.metrics.stage('render'):
+            inp_content = self.templates.render(inp, pattern)
+        id = pattern.with_suffix('').name
+        key, result = self.cached(tc, inp_content, pattern)
+        if result is not None:
+            return result
+        parsed = None
+        warm = self.warm.get(inp) if self.warm_start else None
+        if warm is not None:
+            with self.metrics.stage('render'):
+                warm_content = warm.template.render(pattern)
+            try:
+                parsed, out_text, stats = self.refine(tc, inp, warm_content)
+            except (Aborted, TimeoutError):
+                # Refined from the INP below, the cold run may converge
+                parsed, stats = None, None
+            if parsed is not None and parsed.r_wp is not None and \
+                    parsed.r_wp <= warm.r_wp * (1 + self.warm_tolerance):
+                self.seed_warm(inp, out_text, parsed.r_wp, warm)
+                self.report_warm(pattern, warm, stats)
+            else:
+                self.logger.info(
+                    f'engine.process_TC: warm start of {pattern} gave r_wp '
+                    f'{parsed.r_wp if parsed else None} against {warm.r_wp}, '
+                    'refining from the INP')
+                parsed = None
+        if parsed is None:
+            parsed, out_text, stats = self.refine(tc, inp, inp_content)
+            if self.warm_start and parsed is not None and parsed.r_wp is not None:
+                self.seed_warm(inp, out_text, parsed.r_wp,
+                               Warm(None, parsed.r_wp, stats.wall,
+                                    self.count_cycles(stats.stdout)))
+        if parsed is None:
+            return {'id': id, 'r_wp': 0.00, 'error': 0.00}
+        result = parsed.as_dict(id)
+        if key is not None and parsed.r_wp is not None:
+            with self.metrics.stage('cache'):
+                self.cache.put(key, result)
+        return result
+
+    def refine(self, tc, inp, inp_content):
+        '''
+        One tc run, returns (parsed .out or None, .out text when warm
+        starts need it, RunStats)
+        '''
+        with self.run_tc(tc, inp, inp_content) as (inp_out, stats):
+            try:
+                with self.metrics.stage('parse'):
+                    parsed = parse_out(inp_out)
+                    out_text = inp_out.read_text() if self.warm_start else None
+            except Exception as e:
+                self.logger.info(f'engine.refine: {e}')
+                return None, None, stats
+        return parsed, out_text, stats
+
+    def seed_warm(self, inp, out_text, r_wp, warm):
+        '''
+        Refined values of the last good .out become the next starting ones,
+        the cold run's r_wp, wall time and cycles stay as the reference.
+        '''
+        try:
+            template = InpTemplate(ERROR_SUFFIX.sub('`', out_text))
+        except ValueError as e:
+            self.logger.info(f'engine.seed_warm: {e}')
+            return
+        with self.warm_lock:
+            self.warm[inp] = warm._replace(template=template)
+
+    def report_warm(self, pattern, warm, stats):
+        cycles = self.count_cycles(stats.stdout)
+        time_saved = warm.wall - stats.wall
+        cycles_saved = None
+        if cycles is not None and warm.cycles is not None:
+            cycles_saved = warm.cycles - cycles
+        self.metrics.note(warm_start=True, cycles=cycles,
+                          cycles_saved=cycles_saved,
+                          time_saved=round(time_saved, 3))
+        self.logger.info(
+            f'engine.report_warm: {pattern} warm start, {cycles} cycles '
+            f'({cycles_saved} saved), {time_saved:.1f}s saved')
+
+    def count_cycles(self, stdout):
+        if not stdout:
+            return None
+        cycles = [int(match.group(1)) for match in
+                  self.cycle_pattern.finditer(stdout.decode(errors='replace'))]
+        return max(cycles) if cycles else None
+
+    def process_TC_chunk(self, tc, inp, patterns):
+        '''
+        Refine patterns with one tc run of an INP holding an xdd block per
+        pattern. Returns a result per pattern, None for those the combined
+        run gave no r_wp for, all None once chunks of inp were found to
+        differ from single runs.
+        '''
+        verdict = self.chunk_verdict(inp)
+        if verdict is False:
+            return [None] * len(patterns)
+        agrees = None
+        try:
+            self.logger.info(f'engine.process_TC_chunk: processing {inp}-{len(patterns)} patterns')
+            results = [None] * len(patterns)
+            keys = [None] * len(patterns)
+            with self.metrics.stage('render'):
+                template = self.templates.get(inp)
+            todo = []
+            for index, pattern in enumerate(patterns):
+                if not pattern.exists():
+                    # Left to the single run, which reports it
+                    continue
+                keys[index], results[index] = self.cached(
+                    tc, template.render(pattern), pattern)
+                if results[index] is None:
+                    todo.append(index)
+            if len(todo) < 2:
+                return results
+            with self.metrics.stage('render'):
+                inp_content = template.render_chunk([patterns[index] for index in todo])
+            with self.run_tc(tc, inp, inp_content, scale=len(todo)) as (inp_out, _):
+                with self.metrics.stage('parse'):
+                    parsed = parse_out_xdds(inp_out)
+            if len(parsed) != len(todo) or all(block.r_wp is None for block in parsed):
+                # r_wp outside the xdd block or blocks tc merged, every
+                # chunk of inp would give the same
+                self.logger.info(
+                    f'engine.process_TC_chunk: {len(parsed)} xdd results for '
+                    f'{len(todo)} patterns, {inp} is refined one pattern per run')
+                agrees = False
+                return results
+            for index, block in zip(todo, parsed):
+                if block.r_wp is not None:
+                    results[index] = block.as_dict(patterns[index].with_suffix('').name)
+            if verdict is None and results[todo[0]] is not None:
+                agrees = self.compare_single(tc, inp, template, patterns[todo[0]],
+                                             results[todo[0]])
+                if agrees is False:
+                    return [None] * len(patterns)
+            for index in todo:
+                if results[index] is not None and keys[index] is not None:
+                    with self.metrics.stage('cache'):
+                        self.cache.put(keys[index], results[index])
+            return results
+        finally:
+            if verdict is None or agrees is False:
+                self.chunk_checked(inp, agrees)
+
+    def chunk_verdict(self, inp):
+        '''
+        Whether chunks of inp give what single runs give: None for the first
+        chunk of inp, which finds out, the others wait for it. Without
+        chunk_check, True until a chunk of inp gave no results.
+        '''
+        while True:
+            with self.chunk_lock:
+                if inp in self.chunk_agrees:
+                    return self.chunk_agrees[inp]
+                if not self.chunk_check:
+                    return True
+                event = self.chunk_checks.get(inp)
+                if event is None:
+                    self.chunk_checks[inp] = threading.Event()
+                    return None
+            event.wait()
+
+    def chunk_checked(self, inp, agrees):
+        '''
+        The verdict of a chunk of inp, None leaves it to the next
+        '''
+        with self.chunk_lock:
+            if agrees is not None:
+                self.chunk_agrees[inp] = agrees
+            event = self.chunk_checks.pop(inp, None)
+        if event is not None:
+            event.set()
+
+    def compare_single(self, tc, inp, template, pattern, result):
+        '''
+        Refine pattern alone and compare with its result from a chunk,
+        None when the single run gave no result
+        '''
+        with self.metrics.stage('check'):
+            parsed, _, _ = self.refine(tc, inp, template.render(pattern))
+        if parsed is None or parsed.r_wp is None:
+            # Nothing to compare with, the next chunk of inp tries again
+            return None
+        single = parsed.as_dict(result['id'])
+
+        def same(a, b):
+            if isinstance(a, float) and isinstance(b, float):
+                return math.isclose(a, b, rel_tol=self.chunk_tolerance, abs_tol=1e-9)
+            return a == b
+
+        agrees = single.keys() == result.keys() and all(
+            same(single[key], result[key]) for key in single)
+        if not agrees:
+            self.logger.info(
+                f'engine.compare_single: {pattern} refined alone gave {single}, '
+                f'in a chunk {result}; {inp} is refined one pattern per run')
+        return agrees
+        for index, block in zip(todo, parsed):
+            if block.r_wp is None:
+                continue
+            results[index] = block.as_dict(patterns[index].with_suffix('').name)
+            if keys[index] is not None:
+                with self.metrics.stage('cache'):
+                    self.cache.put(keys[index], results[index])
+        return results
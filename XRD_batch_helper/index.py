@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import fnmatch
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+
+# Directories changed this recently are listed again: network shares and FAT
+# keep mtimes in seconds, a file added in the same second would be missed
+RECENT = 2.0
+
+
+class FileIndex:
+    '''
+    Listings of directories in a JSON file, so large trees on a network
+    share are not listed again on every start.
+
+    A directory's mtime changes when an entry is added, removed or renamed
+    in it, so a directory whose mtime is the one stored is taken from the
+    file and only the others are listed again with os.scandir.
+    '''
+
+    def __init__(self, file=None, logger=None):
+        self.file = pathlib.Path(file) if file else None
+        self.logger = logger
+        self.lock = threading.Lock()
+        # directory: {'mtime': st_mtime_ns, 'files': [...], 'dirs': [...]}
+        self.entries = dict()
+        self.changed = False
+        if self.file is not None and self.file.exists():
+            try:
+                self.entries = json.loads(self.file.read_text())
+            except (OSError, ValueError) as e:
+                self.log(f'index: ignoring {self.file}: {e}')
+
+    @classmethod
+    def from_config(cls, config, logger):
+        section = config['INDEX']
+        file = None
+        if section['file']:
+            file = pathlib.Path(config.file).parent / section.getpath('file')
+        return cls(file=file, logger=logger)
+
+    def log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def listing(self, directory):
+        '''
+        (file names, directory names) of directory
+        '''
+        key = str(directory)
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            with self.lock:
+                self.changed |= self.entries.pop(key, None) is not None
+            return [], []
+        with self.lock:
+            entry = self.entries.get(key)
+        if (entry is not None and entry['mtime'] == mtime
+                and time.time() - mtime / 1e9 > RECENT):
+            return entry['files'], entry['dirs']
+        files = []
+        dirs = []
+        try:
+            with os.scandir(key) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            dirs.append(entry.name)
+                        else:
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError as e:
+            self.log(f'index.listing: {e}')
+            return [], []
+        files.sort()
+        dirs.sort()
+        with self.lock:
+            self.entries[key] = {'mtime': mtime, 'files': files, 'dirs': dirs}
+            self.changed = True
+        return files, dirs
+
+    def find(self, root, patterns=('*',), recursive=True):
+        '''
+        Paths of the files under root whose path relative to it matches any
+        of the glob patterns, matched from the right like pathlib's match:
+        '*.raw' matches in every subdirectory, 'day1/*.raw' only in day1.
+        '''
+        root = os.path.abspath(root)
+        if isinstance(patterns, str):
+            patterns = patterns.split()
+        paths = [pattern for pattern in patterns if '/' in pattern]
+        # One regex for the name patterns, fnmatch per name and pattern is
+        # most of the time on a large tree
+        names = re.compile('|'.join(
+            fnmatch.translate(os.path.normcase(pattern))
+            for pattern in patterns if '/' not in pattern) or '(?!)')
+        found = []
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            files, dirs = self.listing(directory)
+            for name in files:
+                path = os.path.join(directory, name)
+                if names.match(os.path.normcase(name)) or any(
+                        pathlib.PurePath(os.path.relpath(path, root)).match(pattern)
+                        for pattern in paths):
+                    found.append(path)
+            if recursive:
+                pending.extend(os.path.join(directory, name)
+                               for name in reversed(dirs))
+        self.save()
+        return found
+
+    def save(self):
+        '''
+        Write the listings if they changed, through a temp file so a crash
+        leaves the old index
+        '''
+        with self.lock:
+            if self.file is None or not self.changed:
+                return
+            data = json.dumps(self.entries)
+            self.changed = False
+        tmp = self.file.with_name(f'{self.file.name}.{os.getpid()}.tmp')
+        try:
+            tmp.write_text(data)
+            os.replace(tmp, self.file)
+        except OSError as e:
+            self.log(f'index.save: {e}')
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import json
+import os
+import pathlib
+import threading
+import time
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Timings(dict):
+    '''
+    Seconds per stage of one pattern, notes are extra fields for its record
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.notes = dict()
+
+
+class Metrics:
+    '''
+    Per-stage timings of every pattern, written as JSON lines, plus batch
+    aggregates as JSON and as a Prometheus text file.
+
+    Stages are timed with stage(name) from the thread running the pattern,
+    between begin() and end() on that thread. With a tracer, see
+    profiling.Profiler, each stage and pattern is a span too.
+    '''
+
+    def __init__(self, jsonl=None, prom=None):
+        self.jsonl = pathlib.Path(jsonl) if jsonl else None
+        self.prom = pathlib.Path(prom) if prom else None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Counters for the Prometheus file live as long as the process
+        self.patterns_total = collections.Counter()
+        self.stage_seconds_total = collections.Counter()
+        self.batches_total = 0
+        self.last_batch = None
+        self.tracer = None
+
+    def begin(self, name='pattern'):
+        self.local.timings = Timings()
+        self.local.begun = (name, time.perf_counter())
+
+    def end(self):
+        timings = getattr(self.local, 'timings', None) or Timings()
+        self.local.timings = None
+        tracer = self.tracer
+        begun = getattr(self.local, 'begun', None)
+        if tracer is not None and begun is not None:
+            tracer.span(begun[0], begun[1], time.perf_counter(), 'pattern',
+                        **timings.notes)
+        return timings
+
+    def note(self, **notes):
+        timings = getattr(self.local, 'timings', None)
+        if timings is not None:
+            timings.notes.update(notes)
+
+    @contextlib.contextmanager
+    def stage(self, name, timings=None):
+        if timings is None:
+            timings = getattr(self.local, 'timings', None)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + end - start
+            if self.tracer is not None:
+                self.tracer.span(name, start, end)
+
+    def batch(self, inp):
+        return Batch(self, inp)
+
+    def emit(self, record):
+        if self.jsonl is None:
+            return
+        line = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            with open(self.jsonl, mode='a') as f:
+                f.write(line + '\n')
+
+    def write_prom(self, batch):
+        if self.prom is None:
+            return
+        with self.lock:
+            patterns_total = sorted(self.patterns_total.items())
+            stage_seconds_total = sorted(self.stage_seconds_total.items())
+        lines = [
+            '# HELP xrd_batch_patterns_total Patterns processed by status.',
+            '# TYPE xrd_batch_patterns_total counter',
+        ]
+        for status, count in patterns_total:
+            lines.append(f'xrd_batch_patterns_total{{status="{status}"}} {count}')
+        lines += [
+            '# HELP xrd_batch_stage_seconds_total Time spent per stage.',
+            '# TYPE xrd_batch_stage_seconds_total counter',
+        ]
+        for stage, seconds in stage_seconds_total:
+            lines.append(f'xrd_batch_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+        lines += [
+            '# HELP xrd_batch_batches_total Batches finished.',
+            '# TYPE xrd_batch_batches_total counter',
+            f'xrd_batch_batches_total {self.batches_total}',
+            '# HELP xrd_batch_last_throughput Patterns per second of the last batch.',
+            '# TYPE xrd_batch_last_throughput gauge',
+            f'xrd_batch_last_throughput {batch["throughput"]:.6f}',
+            '# HELP xrd_batch_last_latency_seconds Pattern latency of the last batch.',
+            '# TYPE xrd_batch_last_latency_seconds gauge',
+            f'xrd_batch_last_latency_seconds{{quantile="0.5"}} {batch["p50"]:.6f}',
+            f'xrd_batch_last_latency_seconds{{quantile="0.95"}} {batch["p95"]:.6f}',
+            '# HELP xrd_batch_last_timestamp_seconds End of the last batch.',
+            '# TYPE xrd_batch_last_timestamp_seconds gauge',
+            f'xrd_batch_last_timestamp_seconds {batch["time"]:.3f}',
+        ]
+        # The node exporter must never read a half written file
+        tmp = self.prom.with_name(self.prom.name + '.tmp')
+        tmp.write_text('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prom)
+
+
+class Batch:
+
+    def __init__(self, metrics, inp):
+        self.metrics = metrics
+        self.inp = str(inp)
+        self.start = time.perf_counter()
+        self.latencies = []
+        self.failures = 0
+        self.stages = collections.Counter()
+        self.notes = collections.Counter()
+
+    def pattern(self, pattern, timings, status):
+        latency = sum(timings.values())
+        self.latencies.append(latency)
+        if status != 'ok':
+            self.failures += 1
+        self.stages.update(timings)
+        notes = getattr(timings, 'notes', dict())
+        # Numeric notes, like the time warm starts saved, add up per batch
+        self.notes.update({name: value for name, value in notes.items()
+                           if isinstance(value, (int, float))})
+        with self.metrics.lock:
+            self.metrics.patterns_total[status] += 1
+            self.metrics.stage_seconds_total.update(timings)
+        self.metrics.emit({
+            'type': 'pattern', 'time': time.time(), 'inp': self.inp,
+            'pattern': str(pattern), 'status': status,
+            'latency': round(latency, 6),
+            'stages': {name: round(value, 6) for name, value in timings.items()},
+            **notes,
+        })
+
+    def finish(self):
+        wall = time.perf_counter() - self.start
+        count = len(self.latencies)
+        record = {
+            'type': 'batch', 'time': time.time(), 'inp': self.inp,
+            'patterns': count, 'failures': self.failures,
+            'wall': round(wall, 6),
+            'throughput': count / wall if wall else 0.0,
+            'p50': percentile(self.latencies, 0.5),
+            'p95': percentile(self.latencies, 0.95),
+            'stages': {name: round(value, 6) for name, value in self.stages.items()},
+            **self.notes,
+        }
+        with self.metrics.lock:
+            self.metrics.batches_total += 1
+            self.metrics.last_batch = record
+        if self.metrics.tracer is not None:
+            self.metrics.tracer.span(self.inp, self.start, self.start + wall,
+                                     'batch', patterns=count)
+        self.metrics.emit(record)
+        self.metrics.write_prom(record)
+        return record
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import re
+
+# One alternation, scanned with finditer on every line: each token is found
+# in a single left-to-right pass, no DOTALL backtracking across the file.
+TOKENS = re.compile(
+    r'(?P<r_wp>r_wp)  (?P<r_wp_value>\d+\.\d+)'
+    r'|phase_name "(?P<phase>[^"]*)"'
+    r'|MVW\((?P<mvw>[^)]*)\)')
+# Refined TOPAS values are flagged with ` and may carry an error: 1.23`_0.04
+VALUE = re.compile(r'\s*(\d+\.\d+)`?(?:_(\d+\.\d+))?\s*')
+
+XDD = re.compile(r'\s*xdd\b')
+
+Phase = collections.namedtuple('Phase', 'name weight error')
+
+
+class OutResult:
+
+    def __init__(self, r_wp=None, phases=None):
+        self.r_wp = r_wp
+        self.phases = phases if phases is not None else []
+
+    def as_dict(self, id):
+        '''
+        Row for the result file: id, r_wp and one column per phase weight
+        '''
+        result = {'id': id, 'r_wp': self.r_wp if self.r_wp is not None else 0.00}
+        for phase in self.phases:
+            result[phase.name] = phase.weight
+        return result
+
+
+def parse_value(string):
+    match = VALUE.fullmatch(string)
+    if match is None:
+        return None, None
+    value, error = match.groups()
+    return float(value), float(error) if error is not None else None
+
+
+class OutParser:
+    '''
+    Incremental parser of the lines of a TOPAS .out file.
+
+    r_wp is the first "r_wp  <value>" found, every phase_name is paired with
+    the first MVW(...) after it and its third value is the weight.
+    '''
+
+    def __init__(self):
+        self.result = OutResult()
+        self.phase = None
+
+    def feed(self, line):
+        # Most lines are sites and peaks, skip them without a regex
+        if 'r_wp' not in line and 'phase_name' not in line and 'MVW' not in line:
+            return
+        result = self.result
+        for match in TOKENS.finditer(line):
+            kind = match.lastgroup
+            if kind == 'r_wp_value':
+                if result.r_wp is None:
+                    result.r_wp = float(match.group('r_wp_value'))
+            elif kind == 'phase':
+                # Later names before the MVW are swallowed, like the old regex
+                if self.phase is None:
+                    self.phase = match.group('phase')
+            elif kind == 'mvw' and self.phase is not None:
+                values = match.group('mvw').split(',')
+                if len(values) == 3:
+                    weight, error = parse_value(values[2])
+                    if weight is not None and all(
+                            parse_value(value)[0] is not None
+                            for value in values[:2]):
+                        result.phases.append(Phase(self.phase, weight, error))
+                        self.phase = None
+
+
+def parse_lines(lines):
+    parser = OutParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.result
+
+
+def parse_xdd_lines(lines):
+    '''
+    One result per xdd block, for an .out refined from several patterns at
+    once. What comes before the first xdd is global and left out.
+    '''
+    parsers = []
+    for line in lines:
+        if XDD.match(line):
+            parsers.append(OutParser())
+        if parsers:
+            parsers[-1].feed(line)
+    return [parser.result for parser in parsers]
+
+
+def parse_out(path):
+    with open(path, mode='r') as f:
+        return parse_lines(f)
+
+
+def parse_out_xdds(path):
+    with open(path, mode='r') as f:
+        return parse_xdd_lines(f)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import cProfile
+import io
+import json
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Tracer:
+    '''
+    Spans in the Chrome trace event format, for chrome://tracing or
+    https://ui.perfetto.dev. Times are time.perf_counter() seconds.
+    '''
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = dict()
+
+    def span(self, name, start, end, category='stage', **args):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        # list.append is atomic, the workers share the list without a lock
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid,
+            'tid': thread.ident,
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'args': args,
+        })
+
+    def write(self, file):
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                  'tid': ident, 'args': {'name': name}}
+                 for ident, name in list(self.threads.items())]
+        with open(file, mode='w') as f:
+            json.dump({'traceEvents': names + list(self.events),
+                       'displayTimeUnit': 'ms'}, f)
+
+
+class Profiler:
+    '''
+    cProfile of every thread, tracemalloc and a Tracer for the stages of
+    metrics, from start() to stop().
+
+    stop() writes next to app.log, all named profile-<time>:
+    - .txt, the top hotspots by own and cumulative time and the top
+      allocations, to attach to a ticket
+    - .pstats, for snakeviz or pstats
+    - .trace.json, a span per pattern, stage and batch
+    '''
+
+    def __init__(self, directory, metrics=None, top=30, memory=True,
+                 trace=True, logger=None):
+        self.directory = pathlib.Path(directory)
+        self.metrics = metrics
+        self.top = top
+        self.memory = memory
+        self.tracer = Tracer() if trace else None
+        self.logger = logger
+        self.profiles = []
+        self.profile = None
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    @classmethod
+    def from_config(cls, config, metrics, logger):
+        section = config['PROFILE']
+        return cls(pathlib.Path(config.file).parent, metrics=metrics,
+                   top=section.getint('top'),
+                   memory=section.getboolean('memory'),
+                   trace=section.getboolean('trace'),
+                   logger=logger)
+
+    def profile_thread(self):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+        return profile
+
+    def thread_started(self, frame, event, arg):
+        # Runs once per thread started after start(), the profile
+        # enabled here replaces this hook for the thread
+        self.profile_thread()
+
+    def start(self):
+        self.start_time = time.time()
+        if self.memory:
+            tracemalloc.start()
+        if self.metrics is not None:
+            self.metrics.tracer = self.tracer
+        self.profile = self.profile_thread()
+        # From 3.12 cProfile is a sys.monitoring tool, which sees every
+        # thread and of which only one can be active: a profile per thread
+        # fails to enable and the thread dies
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.thread_started)
+        return self
+
+    def stop(self):
+        '''
+        Write the report, from the thread that called start()
+        '''
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        # Only the calling thread's profile can be disabled, the workers'
+        # threads have ended with their executors or keep theirs
+        self.profile.disable()
+        wall = time.time() - self.start_time
+        if self.metrics is not None:
+            self.metrics.tracer = None
+        snapshot = None
+        peak = 0
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        stem = time.strftime('profile-%Y%m%d-%H%M%S',
+                             time.localtime(self.start_time))
+        base = self.directory / stem
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(f'{base}.pstats')
+        report = self.report(stats, snapshot, peak, wall, len(profiles))
+        pathlib.Path(f'{base}.txt').write_text(report)
+        if self.tracer is not None:
+            self.tracer.write(f'{base}.trace.json')
+        if self.logger is not None:
+            self.logger.info(f'profiler.stop: report written to {base}.txt')
+        return pathlib.Path(f'{base}.txt')
+
+    def report(self, stats, snapshot, peak, wall, threads):
+        out = io.StringIO()
+        # One profile sees all threads from 3.12
+        threads = 'all' if sys.version_info >= (3, 12) else threads
+        out.write(f'{wall:.2f}s wall over {threads} threads, '
+                  f'started {time.ctime(self.start_time)}\n')
+        if snapshot is not None:
+            out.write(f'peak traced memory {peak / 2**20:.1f} MiB\n')
+        if self.tracer is not None:
+            totals = dict()
+            for event in list(self.tracer.events):
+                if event['cat'] == 'stage':
+                    totals[event['name']] = totals.get(event['name'], 0) + event['dur']
+            out.write('\nStage totals over all threads:\n')
+            for name, dur in sorted(totals.items(), key=lambda item: -item[1]):
+                out.write(f'{dur / 1e6:12.3f}s  {name}\n')
+        stats.stream = out
+        for key, title in (('tottime', 'own'), ('cumulative', 'cumulative')):
+            out.write(f'\nTop {self.top} by {title} time:\n')
+            stats.sort_stats(key).print_stats(self.top)
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__)])
+            out.write(f'\nTop {self.top} allocations still held:\n')
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                out.write(f'{stat.size / 1024:12.1f} KiB {stat.count:8} blocks  '
+                          f'{stat.traceback}\n')
+        return out.getvalue()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import hashlib
+import mmap
+import pathlib
+import struct
+
+# Bruker RAW1.01, little endian: a 712-byte file header, then per range a
+# 304-byte range header, its supplementary headers and steps float32 counts.
+# Files are read through mmap, a check never reads the counts.
+FILE_HEADER = 712
+RANGE_HEADER = 304
+# Measurement status at 8 of the file header
+STATUS = {1: 'done', 2: 'active', 3: 'aborted', 4: 'interrupted'}
+# Formats TOPAS reads that are accepted on their magic alone
+OTHER_VERSIONS = (b'RAW ', b'RAW2', b'RAW4')
+
+Range = collections.namedtuple('Range', 'steps start step_size offset')
+RawInfo = collections.namedtuple(
+    'RawInfo', 'path version status sample_id date time ranges size')
+
+
+class InvalidRaw(ValueError):
+    pass
+
+
+def text(data, start, length):
+    return data[start:start + length].split(b'\0', 1)[0].decode(
+        'latin-1').strip()
+
+
+def read_raw(path):
+    '''
+    Check the headers of a .raw file against its size and return its
+    metadata, raises InvalidRaw for an empty, truncated or unfinished one.
+    '''
+    path = pathlib.Path(path)
+    size = path.stat().st_size
+    if size == 0:
+        raise InvalidRaw(f'{path.name} is empty')
+    with open(path, mode='rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse(path, data, size)
+
+
+def parse(path, data, size):
+    magic = bytes(data[:8])
+    if not magic.startswith(b'RAW1.01'):
+        if magic.startswith(OTHER_VERSIONS):
+            return RawInfo(path, magic[:4].decode().strip(), None, None,
+                           None, None, [], size)
+        raise InvalidRaw(f'{path.name} is not a Bruker RAW file')
+    if size < FILE_HEADER:
+        raise InvalidRaw(f'{path.name} is truncated in its header')
+    status, range_count = struct.unpack_from('<II', data, 8)
+    if status == 2:
+        raise InvalidRaw(f'{path.name} is still being measured')
+    if range_count == 0:
+        raise InvalidRaw(f'{path.name} has no ranges')
+    ranges = []
+    offset = FILE_HEADER
+    for index in range(range_count):
+        if offset + RANGE_HEADER > size:
+            raise InvalidRaw(f'{path.name} is truncated in range {index}')
+        header_length, steps = struct.unpack_from('<II', data, offset)
+        start, = struct.unpack_from('<d', data, offset + 16)
+        step_size, = struct.unpack_from('<d', data, offset + 176)
+        # 248 and 252 are the varying parameters and the record length
+        supplementary, = struct.unpack_from('<I', data, offset + 256)
+        if header_length != RANGE_HEADER:
+            raise InvalidRaw(f'{path.name} range {index} has a '
+                             f'{header_length}-byte header')
+        if steps == 0 or step_size <= 0:
+            raise InvalidRaw(f'{path.name} range {index} has no steps')
+        counts = offset + RANGE_HEADER + supplementary
+        offset = counts + 4 * steps
+        if offset > size:
+            raise InvalidRaw(f'{path.name} is truncated in range {index}, '
+                             f'{size} of {offset} bytes')
+        ranges.append(Range(steps, start, step_size, counts))
+    return RawInfo(path, 'RAW1.01', STATUS.get(status, str(status)),
+                   text(data, 326, 60), text(data, 16, 10), text(data, 26, 10),
+                   ranges, size)
+
+
+def counts(info, index=0):
+    '''
+    The counts of a range as a read-only numpy memmap, numpy is imported
+    on use
+    '''
+    import numpy
+    rng = info.ranges[index]
+    return numpy.memmap(info.path, dtype='<f4', mode='r', offset=rng.offset,
+                        shape=(rng.steps,))
+
+
+def content_hash(path):
+    '''
+    Digest of the file's bytes, equal for byte-identical patterns
+    '''
+    path = pathlib.Path(path)
+    if path.stat().st_size == 0:
+        return hashlib.blake2b(b'').hexdigest()
+    with open(path, mode='rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.blake2b(data).hexdigest()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import hashlib
+import json
+import pathlib
+import re
+import stat
+import sys
+import threading
+import time
+import zipfile
+import zlib
+
+XDD = re.compile(r'xdd "([^"]*)"')
+VERSION = 1
+
+
+def template_key(inp_content):
+    '''
+    The INP with its xdd paths left out, equal for every pattern refined
+    with the same INP
+    '''
+    return hashlib.blake2b(XDD.sub('xdd ""', inp_content).encode(),
+                           digest_size=16).hexdigest()
+
+
+def base_name(path):
+    # Recorded on Windows, replayed on Linux
+    return path.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+class Recorder:
+    '''
+    Every tc run of an engine into a zip: the INP as rendered, the .out,
+    stdout, stderr, wall time and exit status, for replay on a machine
+    without TOPAS.
+
+    Pattern paths are cut to their names, the patterns themselves are not
+    kept. The manifest is written by close(), an archive not closed is
+    unreadable. An existing archive is never overwritten.
+    '''
+
+    def __init__(self, archive, logger=None):
+        self.archive = pathlib.Path(archive)
+        self.logger = logger
+        try:
+            self.zip = zipfile.ZipFile(self.archive, mode='x',
+                                       compression=zipfile.ZIP_DEFLATED)
+        except FileExistsError:
+            raise FileExistsError(
+                f'{self.archive} exists, record to another archive') from None
+        self.lock = threading.Lock()
+        self.runs = []
+
+    @classmethod
+    def from_config(cls, config, logger):
+        # A session per archive, stamped like the profiler's reports
+        path = pathlib.Path(config.file).parent / config['REPLAY'].getpath('record')
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return cls(path.with_name(f'{path.stem}-{stamp}{path.suffix}'),
+                   logger=logger)
+
+    def record(self, inp_content, out, stats):
+        '''
+        One finished run, out is the .out path, which may not exist
+        '''
+        patterns = [base_name(path) for path in XDD.findall(inp_content)]
+        inp_content = XDD.sub(
+            lambda match: f'xdd "{base_name(match.group(1))}"', inp_content)
+        try:
+            out_bytes = out.read_bytes()
+        except OSError:
+            out_bytes = None
+        run = {
+            'key': template_key(inp_content), 'patterns': patterns,
+            'wall': round(stats.wall, 3), 'cpu': round(stats.cpu, 3),
+            'returncode': stats.returncode, 'killed': stats.killed,
+            'out': out_bytes is not None,
+        }
+        with self.lock:
+            run['id'] = len(self.runs)
+            self.runs.append(run)
+            prefix = f'runs/{run["id"]}'
+            self.zip.writestr(f'{prefix}.inp', inp_content)
+            if out_bytes is not None:
+                self.zip.writestr(f'{prefix}.out', out_bytes)
+            self.zip.writestr(f'{prefix}.stdout', stats.stdout or b'')
+            self.zip.writestr(f'{prefix}.stderr', stats.stderr or b'')
+
+    def close(self):
+        with self.lock:
+            self.zip.writestr('manifest.json', json.dumps(
+                {'version': VERSION, 'created': time.time(), 'runs': self.runs}))
+            self.zip.close()
+        if self.logger is not None:
+            self.logger.info(
+                f'recorder.close: {len(self.runs)} tc runs in {self.archive}')
+
+
+class Replay:
+    '''
+    Stands in for tc with the runs of an archive: for an INP it picks a
+    recorded run of the same INP and number of xdds, else any run with as
+    many xdds, waits its wall time times scale while writing its stdout,
+    writes its .out and exits with its status.
+
+    The same pattern names always get the same run, a batch larger than
+    the archive cycles through its runs. An INP with a number of xdds never
+    recorded, a chunk size the recording did not use, fails like tc
+    without an .out.
+    '''
+
+    def __init__(self, archive, scale=1.0):
+        self.zip = zipfile.ZipFile(archive)
+        self.scale = scale
+        manifest = json.loads(self.zip.read('manifest.json'))
+        if manifest.get('version') != VERSION:
+            raise ValueError(f'{archive} is not a version {VERSION} archive')
+        self.runs = manifest['runs']
+
+    def pick(self, inp_content):
+        patterns = [base_name(path) for path in XDD.findall(inp_content)]
+        key = template_key(inp_content)
+        runs = [run for run in self.runs
+                if run['key'] == key and len(run['patterns']) == len(patterns)]
+        if not runs:
+            runs = [run for run in self.runs
+                    if len(run['patterns']) == len(patterns)]
+        if not runs:
+            return None, patterns
+        return runs[zlib.crc32('|'.join(patterns).encode()) % len(runs)], patterns
+
+    def run(self, inp, stdout=None):
+        '''
+        Replay a run for inp, returns the exit status
+        '''
+        inp = pathlib.Path(inp)
+        stdout = stdout or sys.stdout.buffer
+        run, patterns = self.pick(inp.read_text())
+        if run is None:
+            stdout.write(f'replay: no run with {len(patterns)} xdds\n'.encode())
+            return 1
+        prefix = f'runs/{run["id"]}'
+        lines = self.zip.read(f'{prefix}.stdout').splitlines(keepends=True)
+        # Spread over the wall time, as tc prints its cycles
+        pause = run['wall'] * self.scale / (len(lines) + 1)
+        for line in lines:
+            time.sleep(pause)
+            stdout.write(line)
+            stdout.flush()
+        time.sleep(pause)
+        if run['out']:
+            names = iter(patterns)
+            out = self.zip.read(f'{prefix}.out').decode(errors='surrogateescape')
+            out = XDD.sub(lambda match: f'xdd "{next(names, match.group(1))}"', out)
+            inp.with_suffix('.out').write_bytes(out.encode(errors='surrogateescape'))
+        sys.stderr.buffer.write(self.zip.read(f'{prefix}.stderr'))
+        # Killed runs have negative statuses, which no process exits with
+        returncode = run['returncode']
+        return returncode if returncode is not None and returncode >= 0 else 1
+
+
+def write_launcher(path, archive, scale=1.0):
+    '''
+    An executable to give as tc, running Replay on archive: a .bat or .cmd
+    file on Windows, a shell script elsewhere
+    '''
+    path = pathlib.Path(path)
+    archive = pathlib.Path(archive).absolute()
+    package = pathlib.Path(__file__).absolute().parents[1]
+    if path.suffix.lower() in ('.bat', '.cmd'):
+        path.write_text(
+            '@echo off\r\n'
+            f'set PYTHONPATH={package};%PYTHONPATH%\r\n'
+            f'"{sys.executable}" -m XRD_batch_helper.replay '
+            f'--scale {scale} "{archive}" %*\r\n')
+    else:
+        path.write_text(
+            '#!/bin/sh\n'
+            f'PYTHONPATH="{package}${{PYTHONPATH:+:$PYTHONPATH}}" '
+            f'exec "{sys.executable}" -m XRD_batch_helper.replay '
+            f'--scale {scale} "{archive}" "$@"\n')
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def main(argv=None):
+    # Started once per pattern, so only the standard library is imported
+    parser = argparse.ArgumentParser(
+        prog='python -m XRD_batch_helper.replay',
+        description='Stand in for tc with the runs of a recorded archive.')
+    parser.add_argument('archive', type=pathlib.Path)
+    parser.add_argument('inp', type=pathlib.Path)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='times the recorded wall time (default 1)')
+    args = parser.parse_args(argv)
+    return Replay(args.archive, scale=args.scale).run(args.inp)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+
+# reason says why a run was killed early, see Monitor
+RunStats = collections.namedtuple(
+    'RunStats', 'returncode wall cpu rss timeout killed stdout stderr reason',
+    defaults=(None,))
+
+
+class Aborted(RuntimeError):
+    '''
+    tc was killed by a Monitor rule, the message is the reason
+    '''
+
+
+def startupinfo():
+    '''
+    Hide the console window tc opens on Windows, nothing to do elsewhere
+    '''
+    if os.name != 'nt':
+        return None
+    info = subprocess.STARTUPINFO()
+    info.dwFlags = subprocess.CREATE_NEW_CONSOLE | subprocess.STARTF_USESHOWWINDOW
+    info.wShowWindow = subprocess.SW_HIDE
+    return info
+
+
+def kill_tree(pid):
+    '''
+    Kill a process and everything it started, children first. The process
+    itself is left for its Popen to reap, so its returncode stays right.
+    '''
+    # psutil is imported on use, it is slow to import for commands that
+    # never start tc
+    import psutil
+    try:
+        parent = psutil.Process(pid)
+        children = parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return
+    for proc in children + [parent]:
+        with contextlib.suppress(psutil.NoSuchProcess):
+            proc.kill()
+    psutil.wait_procs(children, timeout=5)
+
+
+class Monitor:
+    '''
+    Follows the r_wp tc prints as it refines and tells when the run is not
+    worth finishing: r_wp rose for rising cycles in a row, or the best r_wp
+    has not improved by min_gain (relative) for stall cycles. Neither rule
+    applies before grace cycles, 0 turns a rule off.
+
+    Every r_wp line counts as a cycle, its number is taken from the line
+    when cycle_pattern finds one.
+    '''
+
+    def __init__(self, r_wp_pattern=r'(?i)\br_?wp\W{0,3}(\d+(?:\.\d*)?)',
+                 cycle_pattern=r'(?i)\bcycle\D{0,3}(\d+)', rising=0, stall=0,
+                 min_gain=0.001, grace=3):
+        self.r_wp_pattern = re.compile(r_wp_pattern)
+        self.cycle_pattern = re.compile(cycle_pattern)
+        self.rising = rising
+        self.stall = stall
+        self.min_gain = min_gain
+        self.grace = grace
+        self.cycles = 0
+        self.cycle = None
+        self.last = None
+        self.rises = 0
+        self.best = None
+        self.best_cycle = 0
+        self.reason = None
+
+    @property
+    def enabled(self):
+        return bool(self.rising or self.stall)
+
+    def feed(self, line):
+        '''
+        One line of tc's output, returns the reason to abort or None
+        '''
+        if self.reason is not None:
+            return self.reason
+        match = self.r_wp_pattern.search(line)
+        if match is None:
+            return None
+        r_wp = float(match.group(1))
+        cycle = self.cycle_pattern.search(line)
+        self.cycles += 1
+        self.cycle = int(cycle.group(1)) if cycle else self.cycles
+        self.rises = self.rises + 1 if self.last is not None and r_wp > self.last else 0
+        self.last = r_wp
+        if self.best is None or r_wp < self.best * (1 - self.min_gain):
+            self.best = r_wp
+            self.best_cycle = self.cycles
+        if self.cycles <= self.grace:
+            return None
+        if self.rising and self.rises >= self.rising:
+            self.reason = (f'r_wp rose for {self.rises} cycles to {r_wp} '
+                           f'at cycle {self.cycle}')
+        elif self.stall and self.cycles - self.best_cycle >= self.stall:
+            self.reason = (f'r_wp {self.best} not improved in '
+                           f'{self.cycles - self.best_cycle} cycles, '
+                           f'at cycle {self.cycle}')
+        return self.reason
+
+
+class RuntimeHistory:
+    '''
+    Wall time, CPU time and peak RSS of past tc runs per INP, in SQLite.
+    '''
+
+    def __init__(self, file):
+        self.file = str(file)
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS runs ('
+                       'inp TEXT NOT NULL, wall REAL NOT NULL, cpu REAL, '
+                       'rss INTEGER, status TEXT NOT NULL, finished REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS runs_inp ON runs (inp, finished)')
+
+    @contextlib.contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.file, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, inp, stats, status):
+        with self.connect() as db:
+            db.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                       (str(inp), stats.wall, stats.cpu, stats.rss, status,
+                        time.time()))
+
+    def walls(self, inp, limit=500):
+        '''
+        Wall times of the latest successful runs of inp, or of any INP when
+        inp is None, sorted
+        '''
+        with self.connect() as db:
+            if inp is None:
+                rows = db.execute('SELECT wall FROM runs WHERE status = ? '
+                                  'ORDER BY finished DESC LIMIT ?',
+                                  ('ok', limit)).fetchall()
+            else:
+                rows = db.execute('SELECT wall FROM runs WHERE inp = ? AND status = ? '
+                                  'ORDER BY finished DESC LIMIT ?',
+                                  (str(inp), 'ok', limit)).fetchall()
+        return sorted(row[0] for row in rows)
+
+    @staticmethod
+    def quantile(values, q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Runner:
+    '''
+    Runs tc under supervision: the timeout of an INP is p99 of its past
+    wall times times factor, resources are sampled while it runs and the
+    whole process tree is killed on timeout.
+    '''
+
+    def __init__(self, history=None, timeout=150, factor=3.0, min_samples=10,
+                 min_timeout=30, poll_interval=0.2, monitor=None):
+        self.history = history
+        # Makes a Monitor per run, None runs tc unwatched
+        self.monitor = monitor
+        self.default_timeout = timeout
+        self.factor = factor
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self.poll_interval = poll_interval
+
+    def timeout(self, inp):
+        if self.history is None:
+            return self.default_timeout
+        walls = self.history.walls(inp)
+        if len(walls) < self.min_samples:
+            return self.default_timeout
+        return max(self.min_timeout,
+                   self.history.quantile(walls, 0.99) * self.factor)
+
+    def run(self, args, inp, cwd=None, cancel=None, scale=1):
+        '''
+        Run args to the end, or kill it on timeout, when the cancel event
+        is set or when its monitor gives up on it; stats.killed tells which.
+
+        stdout is read line by line as tc writes it. scale is the number of
+        patterns refined by this run, the timeout is scaled up by it and
+        the history records the wall time per pattern. A run of several
+        patterns prints their r_wp mixed, it is not monitored.
+        '''
+        timeout = self.timeout(inp) * scale
+        monitor = None
+        if self.monitor is not None and scale == 1:
+            monitor = self.monitor()
+        start = time.monotonic()
+        proc = subprocess.Popen(args=args,
+                                cwd=cwd,
+                                startupinfo=startupinfo(),
+                                start_new_session=os.name != 'nt',
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        lines = []
+        errs = []
+        readers = [
+            threading.Thread(target=self.read_lines,
+                             args=(proc.stdout, lines, monitor), daemon=True),
+            threading.Thread(target=lambda: errs.append(proc.stderr.read()),
+                             daemon=True)]
+        for reader in readers:
+            reader.start()
+        cpu = dict()
+        # Once before the first wait, a run shorter than poll_interval
+        # would report none
+        rss = self.sample(proc.pid, cpu)
+        killed = None
+        while True:
+            try:
+                proc.wait(timeout=self.poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                rss = max(rss, self.sample(proc.pid, cpu))
+                if cancel is not None and cancel.is_set():
+                    killed = 'cancelled'
+                elif time.monotonic() - start > timeout:
+                    killed = 'timeout'
+                elif monitor is not None and monitor.reason is not None:
+                    killed = 'aborted'
+                if killed is not None:
+                    kill_tree(proc.pid)
+                    proc.wait()
+                    break
+        # The pipes close with the process tree
+        for reader in readers:
+            reader.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        stats = RunStats(returncode=proc.returncode,
+                         wall=time.monotonic() - start,
+                         cpu=sum(cpu.values()),
+                         rss=rss,
+                         timeout=timeout,
+                         killed=killed,
+                         stdout=b''.join(lines),
+                         stderr=b''.join(errs),
+                         reason=monitor.reason if killed == 'aborted' else None)
+        if self.history is not None:
+            status = killed or ('ok' if proc.returncode == 0 else 'error')
+            self.history.record(inp, stats._replace(wall=stats.wall / scale),
+                                status)
+        return stats
+
+    @staticmethod
+    def read_lines(stream, lines, monitor):
+        for line in stream:
+            lines.append(line)
+            if monitor is not None:
+                monitor.feed(line.decode(errors='replace'))
+
+    @staticmethod
+    def sample(pid, cpu):
+        '''
+        Add the CPU seconds of the tree to cpu (by pid) and return its RSS
+        '''
+        import psutil
+        rss = 0
+        try:
+            parent = psutil.Process(pid)
+            procs = [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return rss
+        for proc in procs:
+            with contextlib.suppress(psutil.NoSuchProcess, psutil.AccessDenied):
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    cpu[proc.pid] = times.user + times.system
+                    rss += proc.memory_info().rss
+        return rss
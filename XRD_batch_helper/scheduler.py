@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import collections
+import functools
+import heapq
+import itertools
+import pathlib
+import queue
+import threading
+
+from .metrics import Timings
+from .writer import open_writer
+
+
+class Task:
+    '''
+    One INP, its patterns and output, and its progress while the engine
+    runs it next to other tasks.
+
+    progress(done, total) follows each finished pattern, finish(success)
+    follows the last one, both from the thread running the engine.
+    '''
+
+    def __init__(self, inp, patterns, output, progress=None, finish=None,
+                 process_func=None, cancel=None):
+        self.inp = pathlib.Path(inp).absolute()
+        # Sorted, so the CSV rows come out in the same order on every run
+        self.patterns = sorted(set(str(pathlib.Path(pattern).absolute())
+                                   for pattern in patterns))
+        self.output = output
+        self.progress = progress
+        self.finish = finish
+        self.process_func = process_func
+        self.cancel = cancel
+        self.success = True
+        self.writer = None
+        self.batch = None
+        self.chunks = []
+        # Results waiting for the ones before them, by pattern index
+        self.finished = dict()
+        self.next_index = 0
+        self.done = 0
+        # Patterns left out because the output has their rows, see resume
+        self.skipped = 0
+        # Patterns still coming, see Engine.follow: those added so far,
+        # digest: (pattern, index) of those kept and the predicate of those
+        # the output already has when resuming
+        self.streaming = False
+        self.seen = set()
+        self.hashes = dict()
+        self.resumed = None
+        # (pattern, timings) of those that failed the pre-flight check
+        self.rejected = []
+        # pattern: the byte-identical ones after it, which get its result
+        self.duplicates = dict()
+
+    @property
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    @property
+    def complete(self):
+        return self.next_index == len(self.patterns)
+
+
+def schedule(tasks, expected):
+    '''
+    Order the chunks of all tasks for one shared pool of workers.
+
+    expected(task) is the expected seconds of one pattern of the task.
+    Every task gets an equal share of worker time: a chunk is queued by
+    the expected seconds its task was given before it, so a 5-pattern task
+    is not stuck behind a 500-pattern one. Among chunks with the same
+    share, the longest goes first, which keeps the makespan short.
+    Returns (task, chunk) pairs.
+    '''
+    jobs = []
+    for order, task in enumerate(tasks):
+        seconds = expected(task)
+        given = 0.0
+        for chunk in task.chunks:
+            length = seconds * len(chunk)
+            jobs.append((given, -length, order, chunk.start, task, chunk))
+            given += length
+    jobs.sort(key=lambda job: job[:4])
+    return [(task, chunk) for *_, task, chunk in jobs]
+
+
+class Scheduler:
+    '''
+    One worker budget for tasks that come and go, as the GUI starts them.
+
+    engine.workers threads run the chunks of every open task, ordered as
+    schedule() orders them: a task added later starts at the worker time
+    handed out so far, so it neither waits behind the tasks running nor
+    jumps ahead of what they were promised. One dispatch thread owns the
+    tasks, their writers and rows, as the thread running Engine.run does.
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Condition()
+        # (given, -seconds, order, task, chunk), guarded by lock
+        self.jobs = []
+        self.order = itertools.count()
+        self.clock = 0.0
+        self.closed = False
+        # Only the dispatch thread touches these: the worker seconds given
+        # to each task, its chunks queued or running, the streaming tasks
+        # still fed and the writers by output, with the tasks using them
+        self.given = dict()
+        self.pending = collections.Counter()
+        self.feeding = set()
+        self.writers = dict()
+        self.calls = queue.Queue()
+        self.workers = [threading.Thread(target=self.work, name=f'worker-{index}')
+                        for index in range(engine.workers)]
+        self.dispatcher = threading.Thread(target=self.dispatch, name='dispatch')
+        for thread in self.workers + [self.dispatcher]:
+            thread.start()
+
+    def add(self, tasks):
+        '''
+        Queue tasks next to those running, see Engine.process_tasks. Their
+        progress and finish callbacks come from the dispatch thread.
+        '''
+        self.calls.put(functools.partial(self.start, list(tasks)))
+
+    def follow(self, task, batches):
+        '''
+        Engine.follow on the shared workers: each batch is queued as it
+        comes, the calling thread is held until batches is exhausted or
+        the task cancelled
+        '''
+        task.streaming = True
+        self.calls.put(functools.partial(self.start, [task]))
+        try:
+            for patterns in batches:
+                if patterns:
+                    self.calls.put(functools.partial(self.extend, task, patterns))
+                if task.cancelled:
+                    break
+        except Exception as e:
+            self.engine.logger.info(f'scheduler.follow: {e}')
+            task.success = False
+        finally:
+            self.calls.put(functools.partial(self.fed, task))
+
+    def close(self, wait=True):
+        '''
+        Stop once the queued chunks are done, cancel the tasks first for a
+        quick exit
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.lock.notify_all()
+
+        def join():
+            for thread in self.workers:
+                thread.join()
+            self.calls.put(None)
+
+        closer = threading.Thread(target=join, name='close')
+        closer.start()
+        if wait:
+            closer.join()
+            self.dispatcher.join()
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.jobs and not self.closed:
+                    self.lock.wait()
+                if not self.jobs:
+                    return
+                given, _, _, task, chunk = heapq.heappop(self.jobs)
+                self.clock = max(self.clock, given)
+            patterns = [pathlib.Path(task.patterns[index]) for index in chunk]
+            try:
+                rows = self.engine.timed(task.process_func, self.engine.tc.absolute(),
+                                         task.inp, patterns, task.cancel)
+            except Exception as e:
+                rows = [(None, e, Timings())] * len(chunk)
+            self.calls.put(functools.partial(self.collect, task, chunk, rows))
+
+    def dispatch(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                break
+            try:
+                call()
+            except Exception as e:
+                self.engine.logger.info(f'scheduler.dispatch: {e}')
+        for writer, _ in self.writers.values():
+            writer.close()
+
+    def start(self, tasks):
+        for task in tasks:
+            try:
+                self.open(task)
+                if task.streaming:
+                    self.feeding.add(task)
+                    self.extend(task, self.engine.stream(task))
+                elif self.engine.prepare(task):
+                    self.queue(task, task.chunks)
+                else:
+                    self.release(task)
+            except Exception as e:
+                self.engine.logger.info(f'scheduler.start: {task.inp}: {e}')
+                self.feeding.discard(task)
+                task.success = False
+                if task.writer is not None:
+                    self.release(task)
+                if task.finish is not None:
+                    task.finish(False)
+
+    def extend(self, task, patterns):
+        if task in self.feeding:
+            self.queue(task, self.engine.extend(task, patterns))
+            task.writer.flush()
+
+    def fed(self, task):
+        if task in self.feeding:
+            self.feeding.discard(task)
+            self.settle(task)
+
+    def queue(self, task, chunks):
+        seconds = self.engine.expected(task)
+        with self.lock:
+            given = max(self.clock, self.given.get(task, 0.0))
+            for chunk in chunks:
+                length = seconds * len(chunk)
+                heapq.heappush(self.jobs,
+                               (given, -length, next(self.order), task, chunk))
+                given += length
+            self.lock.notify(len(chunks))
+        self.given[task] = given
+        self.pending[task] += len(chunks)
+
+    def collect(self, task, chunk, rows):
+        try:
+            self.engine.collect(self.engine.tc.absolute(), task, chunk, rows)
+            if task.streaming:
+                # Hot folder rows come minutes apart, each is flushed; the
+                # batch tasks sharing the writer keep its fsync_every
+                task.writer.flush()
+        finally:
+            self.pending[task] -= 1
+            self.settle(task)
+
+    def settle(self, task):
+        '''
+        Finish and let go of a task with no chunks left and no patterns
+        coming
+        '''
+        if self.pending[task] or task in self.feeding:
+            return
+        del self.pending[task]
+        self.given.pop(task, None)
+        # Engine.collect finished the others with their last row, unless
+        # it failed before
+        if not task.streaming and not task.complete:
+            task.success = False
+        if task.streaming or not task.complete:
+            self.engine.finish(task)
+        self.release(task)
+        if self.engine.cache is not None:
+            self.engine.cache.evict()
+
+    def open(self, task):
+        '''
+        The writer of task's output, shared by the tasks writing there
+        '''
+        key = pathlib.Path(task.output).resolve()
+        if key not in self.writers:
+            self.writers[key] = [open_writer(
+                task.output, fsync_every=self.engine.fsync_every,
+                logger=self.engine.logger, inp=task.inp), set()]
+        writer, users = self.writers[key]
+        users.add(task)
+        task.writer = writer
+
+    def release(self, task):
+        key = pathlib.Path(task.output).resolve()
+        writer, users = self.writers[key]
+        users.discard(task)
+        if not users:
+            del self.writers[key]
+            writer.close()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import pathlib
+import uuid
+
+# Output suffix: pyarrow.dataset format of its part files
+FORMATS = {
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+}
+
+
+def import_arrow():
+    '''
+    pyarrow is only needed for columnar output, so it is imported on use
+    '''
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Parquet/Feather output needs pyarrow, '
+                          'pip install pyarrow') from e
+    return pyarrow
+
+
+def field_type(pa, name, value):
+    if name in ('id', 'pattern', 'inp', 'batch') or isinstance(value, str):
+        return pa.string()
+    if isinstance(value, bool):
+        return pa.bool_()
+    # Weights and r_wp may come as ints, a column must keep one type
+    return pa.float64()
+
+
+def parts(output):
+    output = pathlib.Path(output)
+    if not output.is_dir():
+        return []
+    return sorted(file for file in output.iterdir()
+                  if file.suffix == output.suffix)
+
+
+def dataset(output):
+    '''
+    All parts of a store as one pyarrow dataset, the schema is the union of
+    theirs and columns a part lacks read as nulls.
+    '''
+    pa = import_arrow()
+    output = pathlib.Path(output)
+    files = [str(file) for file in parts(output)]
+    fmt = FORMATS[output.suffix.lower()]
+    fmt = 'ipc' if fmt == 'feather' else fmt
+    schemas = [pa.dataset.dataset(file, format=fmt).schema for file in files]
+    schema = pa.unify_schemas(schemas) if schemas else pa.schema([])
+    return pa.dataset.dataset(files, schema=schema, format=fmt)
+
+
+def read_results(output, columns=None, where=None):
+    '''
+    Read the results of every run in a store as a pyarrow Table, only the
+    given columns are read from disk. where is a pyarrow.dataset expression.
+    '''
+    data = dataset(output)
+    if columns is not None:
+        columns = [column for column in columns if column in data.schema.names]
+    return data.to_table(columns=columns, filter=where)
+
+
+def export_xlsx(output, xlsx, columns=None):
+    '''
+    Write the results of a store to an Excel workbook, returns the rows
+    written. openpyxl is imported on use, like pyarrow.
+    '''
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ImportError('xlsx export needs openpyxl, pip install openpyxl') from e
+    table = read_results(output, columns=columns)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('results')
+    sheet.append(table.column_names)
+    for batch in table.to_batches():
+        for row in batch.to_pylist():
+            sheet.append([value.replace(tzinfo=None)
+                          if isinstance(value, datetime.datetime) else value
+                          for value in row.values()])
+    workbook.save(xlsx)
+    return table.num_rows
+
+
+class ResultStore:
+    '''
+    Results as Parquet or Feather files in the <output> directory.
+
+    Every fsync_every results go to a new part file as one row group, so a
+    crash loses at most that many. When the run ends its parts are merged
+    into one file holding them as row groups. Each part has the columns of
+    its own rows, a phase seen for the first time just adds a column and
+    readers fill it with nulls for older rows.
+
+    Same interface as writer.ResultWriter.
+    '''
+
+    def __init__(self, output, fsync_every=20, logger=None, inp=None):
+        self.pa = import_arrow()
+        self.output = pathlib.Path(output)
+        self.format = FORMATS[self.output.suffix.lower()]
+        self.fsync_every = max(1, fsync_every)
+        self.logger = logger
+        self.inp = str(inp) if inp is not None else None
+        # One id per run, ordered by time like the part file names
+        self.batch = f'{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+        self.rows = []
+        self.parts = []
+        self.closed = False
+        self.output.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def done(self):
+        '''
+        Predicate telling if a pattern already has a row in any run
+        '''
+        paths = set()
+        if parts(self.output):
+            table = read_results(self.output, columns=['pattern'])
+            if 'pattern' in table.column_names:
+                paths = set(table.column('pattern').to_pylist())
+        return lambda pattern: str(pattern) in paths
+
+    def write(self, pattern, result, inp=None):
+        '''
+        inp is the INP of the row when tasks of several share the store
+        '''
+        row = {
+            'pattern': str(pattern),
+            'inp': str(inp) if inp is not None else self.inp,
+            'batch': self.batch,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc),
+        }
+        row.update(result)
+        self.rows.append(row)
+        if len(self.rows) >= self.fsync_every:
+            self.flush()
+
+    def schema(self, rows):
+        pa = self.pa
+        fields = dict()
+        for row in rows:
+            for name, value in row.items():
+                if name == 'timestamp':
+                    fields[name] = pa.timestamp('us', tz='UTC')
+                elif name not in fields or value is not None:
+                    fields[name] = field_type(pa, name, value)
+        return pa.schema(list(fields.items()))
+
+    def write_file(self, path, tables):
+        '''
+        Write tables as the row groups of one file, atomically
+        '''
+        tmp = path.with_name(path.name + '.tmp')
+        schema = tables[0].schema
+        if self.format == 'parquet':
+            with self.pa.parquet.ParquetWriter(tmp, schema) as writer:
+                for table in tables:
+                    writer.write_table(table)
+        else:
+            with self.pa.OSFile(str(tmp), 'wb') as sink:
+                with self.pa.ipc.new_file(sink, schema) as writer:
+                    for table in tables:
+                        writer.write_table(table)
+        with open(tmp, mode='rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema(self.rows))
+        path = self.output / f'{self.batch}-{len(self.parts):05d}{self.output.suffix}'
+        self.write_file(path, [table])
+        self.parts.append(path)
+        self.rows = []
+
+    def compact(self):
+        '''
+        Merge the parts of this run into one file, a row group per part
+        '''
+        if len(self.parts) < 2:
+            return
+        pa = self.pa
+        fmt = 'ipc' if self.format == 'feather' else self.format
+        tables = [pa.dataset.dataset(str(part), format=fmt).to_table()
+                  for part in self.parts]
+        schema = pa.unify_schemas([table.schema for table in tables])
+        conformed = []
+        for table in tables:
+            columns = [table.column(field.name) if field.name in table.column_names
+                       else pa.nulls(table.num_rows, field.type)
+                       for field in schema]
+            conformed.append(pa.Table.from_arrays(columns, schema=schema))
+        path = self.output / f'{self.batch}{self.output.suffix}'
+        self.write_file(path, conformed)
+        for part in self.parts:
+            part.unlink()
+        self.parts = [path]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        try:
+            self.compact()
+        except Exception as e:
+            # The parts are still there and readable one by one
+            if self.logger is not None:
+                self.logger.info(f'store.close: merging {self.output} parts: {e}')
+
+
+class XlsxWriter(ResultStore):
+    '''
+    Keeps the results in a Parquet store next to the workbook
+    (<output>.parquet) and exports all of them to it when the run ends.
+    '''
+
+    def __init__(self, output, fsync_every=20, logger=None, inp=None):
+        self.xlsx = pathlib.Path(output)
+        super().__init__(self.xlsx.with_name(self.xlsx.name + '.parquet'),
+                         fsync_every=fsync_every, logger=logger, inp=inp)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        export_xlsx(self.output, self.xlsx)
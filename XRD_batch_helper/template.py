@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pathlib
+import re
+import threading
+
+# Global parameters an xdd block declares or changes, prm !name is fixed
+GLOBAL_PRM = re.compile(r'\b(?:prm|existing_prm)\s+([A-Za-z_]\w*)')
+
+
+class InpTemplate:
+    '''
+    An INP split around its xdd line, render() only joins the pieces.
+    '''
+
+    def __init__(self, text, mtime=None):
+        self.text = text
+        self.mtime = mtime
+        xdd_start = text.find('xdd')
+        if xdd_start == -1:
+            raise ValueError('INP has no xdd line')
+        xdd_stop = text.find('\n\t', xdd_start)
+        if xdd_stop == -1:
+            xdd_stop = text.find('\n', xdd_start)
+        if xdd_stop == -1:
+            xdd_stop = len(text)
+        self.xdd_string = text[xdd_start:xdd_stop]
+        # Every occurrence is a slot, as str.replace did
+        self.pieces = text.split(self.xdd_string)
+
+    def render(self, pattern):
+        return f'xdd "{pattern}"'.join(self.pieces)
+
+    @property
+    def named_parameters(self):
+        '''
+        Refined global parameters of the xdd block, copies of the block
+        in a chunk would share them and refine them together
+        '''
+        return GLOBAL_PRM.findall(self.pieces[-1])
+
+    @property
+    def chunkable(self):
+        return len(self.pieces) == 2 and not self.named_parameters
+
+    def render_chunk(self, patterns):
+        '''
+        One INP with a copy of the xdd block (the xdd line to the end) per
+        pattern, for refining them all with a single tc run.
+        '''
+        if not self.chunkable:
+            raise ValueError('Only an INP with a single xdd and no global '
+                             'refined parameters can be chunked')
+        head, tail = self.pieces
+        return head + ''.join(f'xdd "{pattern}"' + tail for pattern in patterns)
+
+
+class TemplateCache:
+    '''
+    Parsed INP templates keyed by path, reparsed when the file's mtime or
+    size changes.
+    '''
+
+    def __init__(self):
+        self.templates = dict()
+        self.lock = threading.Lock()
+
+    def get(self, inp):
+        inp = pathlib.Path(inp)
+        stat = inp.stat()
+        mtime = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            template = self.templates.get(inp)
+        if template is not None and template.mtime == mtime:
+            return template
+        template = InpTemplate(inp.read_text(), mtime=mtime)
+        with self.lock:
+            self.templates[inp] = template
+        return template
+
+    def render(self, inp, pattern):
+        return self.get(inp).render(pattern)
+
+    def index(self, inp_path, files=None):
+        '''
+        INP file names under inp_path mapped to their absolute paths, the
+        templates themselves are parsed on first use. files is a FileIndex
+        to list the directories through.
+        '''
+        if files is not None:
+            return {file.name: file for file in map(
+                pathlib.Path, files.find(inp_path, '*.inp'))}
+        return {file.name: file.absolute()
+                for file in pathlib.Path(inp_path).glob('**/*.inp')}
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    '''
+    inotify through libc, names of files closed after writing or moved
+    into directory
+    '''
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                    IN_CLOSE_WRITE | IN_MOVED_TO | IN_MODIFY)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch {directory} failed')
+
+    def read(self, timeout):
+        '''
+        Returns (names, overflow), overflow means events were lost
+        '''
+        names = []
+        overflow = False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names, overflow
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.append(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    '''
+    The fallback where there is no inotify: names whose size or mtime
+    changed since the last scan
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = self.scan()
+
+    def scan(self):
+        seen = dict()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                seen[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return seen
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        seen = self.scan()
+        names = [name for name, stat in seen.items()
+                 if self.seen.get(name) != stat]
+        self.seen = seen
+        return names, False
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    '''
+    New pattern files in a directory, each once it has finished writing:
+    its size and mtime have not changed for settle seconds.
+
+    batches(stop) yields the files that settled every poll_interval
+    seconds, often an empty list, until the stop event is set. With
+    existing the files already there come first.
+    '''
+
+    def __init__(self, directory, suffix='.raw', settle=1.0, poll_interval=0.5,
+                 existing=False, use_inotify=True, logger=None):
+        self.directory = pathlib.Path(directory).absolute()
+        self.suffix = suffix.lower()
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.logger = logger
+        self.source = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.source = Inotify(self.directory)
+            except OSError as e:
+                self.log(f'watcher: no inotify, polling instead: {e}')
+        if self.source is None:
+            self.source = Poller(self.directory)
+        # path: (size, mtime) at the last check and since when it is so
+        self.candidates = dict()
+        self.emitted = set()
+        if existing:
+            self.rescan()
+
+    def log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def rescan(self):
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                self.add(entry.name)
+
+    def add(self, name):
+        if not name.lower().endswith(self.suffix):
+            return
+        path = self.directory / name
+        if path not in self.emitted:
+            self.candidates.setdefault(path, None)
+
+    def settled(self):
+        now = time.monotonic()
+        ready = []
+        for path, last in list(self.candidates.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Removed or renamed before it settled
+                del self.candidates[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if last is not None and last[0] == current and now - last[1] >= self.settle:
+                del self.candidates[path]
+                self.emitted.add(path)
+                ready.append(path)
+            elif last is None or last[0] != current:
+                self.candidates[path] = (current, now)
+        return sorted(ready)
+
+    def batches(self, stop):
+        try:
+            while not stop.is_set():
+                # Unsettled files are checked again a poll later at most
+                names, overflow = self.source.read(self.poll_interval)
+                if overflow:
+                    self.log('watcher: inotify queue overflowed, rescanning')
+                    self.rescan()
+                for name in names:
+                    self.add(name)
+                yield self.settled()
+        finally:
+            self.source.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import atexit
+import contextlib
+import itertools
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+PREFIX = 'xrd_batch-'
+
+
+class Workspace:
+    '''
+    Scratch directories for tc runs under root, one per busy worker, inside
+    a session directory named after this process.
+
+    Temp INPs and .out files live there instead of the working directory,
+    which is often the network share the app was started from. With
+    stage_patterns the .raw files of a chunk are copied there too, in one
+    go before its runs, so tc reads them from the local disk.
+
+    Sessions of processes that are gone are removed when the first worker
+    directory is made, this one's at exit.
+    '''
+
+    def __init__(self, root=None, stage_patterns=False, logger=None):
+        self.root = pathlib.Path(root or tempfile.gettempdir()).absolute()
+        self.stage_patterns = stage_patterns
+        self.logger = logger
+        self.session = self.root / f'{PREFIX}{os.getpid()}'
+        # Made on first use, commands that never run tc leave no trace
+        self.opened = False
+        # Worker directories not in use, reused so their count stays at
+        # the number of workers ever busy at once
+        self.free = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def clean(self):
+        '''
+        Remove the sessions left by crashed or killed processes
+        '''
+        import psutil
+        for session in self.root.glob(f'{PREFIX}*'):
+            pid = session.name[len(PREFIX):]
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if psutil.pid_exists(int(pid)):
+                continue
+            shutil.rmtree(session, ignore_errors=True)
+            if self.logger is not None:
+                self.logger.info(f'workspace.clean: removed leftover {session}')
+
+    def close(self):
+        shutil.rmtree(self.session, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        '''
+        A worker directory for the calling thread, emptied when released
+        '''
+        with self.lock:
+            if not self.opened:
+                self.root.mkdir(parents=True, exist_ok=True)
+                self.clean()
+                self.session.mkdir(exist_ok=True)
+                atexit.register(self.close)
+                self.opened = True
+            directory = self.free.pop() if self.free else None
+        if directory is None:
+            directory = self.session / f'worker-{next(self.counter)}'
+            directory.mkdir(parents=True, exist_ok=True)
+        try:
+            yield directory
+        finally:
+            for file in directory.iterdir():
+                with contextlib.suppress(OSError):
+                    if file.is_dir():
+                        shutil.rmtree(file)
+                    else:
+                        file.unlink()
+            with self.lock:
+                self.free.append(directory)
+
+    def stage(self, directory, patterns):
+        '''
+        Copy patterns into directory when stage_patterns is on. Returns the
+        local copy of each pattern by its original path, patterns that
+        could not be copied are read from where they are.
+        '''
+        staged = dict()
+        if not self.stage_patterns:
+            return staged
+        for index, pattern in enumerate(patterns):
+            pattern = pathlib.Path(pattern)
+            # Prefixed, two patterns of a chunk may share a file name
+            local = directory / f'{index}-{pattern.name}'
+            try:
+                shutil.copyfile(pattern, local)
+            except OSError as e:
+                if self.logger is not None:
+                    self.logger.info(f'workspace.stage: {e}')
+                continue
+            staged[str(pattern)] = local
+        return staged
+
+    @staticmethod
+    def localize(inp_content, staged):
+        '''
+        Point the xdd lines of a rendered INP at the staged copies
+        '''
+        for pattern, local in staged.items():
+            inp_content = inp_content.replace(f'xdd "{pattern}"',
+                                              f'xdd "{local}"')
+        return inp_content
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import os
+import pathlib
+import uuid
+
+from .store import FORMATS, ResultStore, XlsxWriter
+
+# The columns of a failed row
+FAILED = ('id', 'r_wp', 'error')
+
+
+def open_writer(output, fsync_every=20, logger=None, inp=None):
+    '''
+    The writer for output by its suffix: a columnar store for .parquet,
+    .feather and .arrow, a workbook for .xlsx and CSV for anything else.
+    '''
+    suffix = pathlib.Path(output).suffix.lower()
+    if suffix in FORMATS:
+        return ResultStore(output, fsync_every=fsync_every, logger=logger, inp=inp)
+    if suffix == '.xlsx':
+        return XlsxWriter(output, fsync_every=fsync_every, logger=logger, inp=inp)
+    return ResultWriter(output, fsync_every=fsync_every, logger=logger)
+
+
+def is_header(row):
+    '''
+    Whether a CSV row, as a list, is a header line
+    '''
+    return bool(row) and row[0] == 'id' and 'r_wp' in row
+
+
+class ResultWriter:
+    '''
+    Appends results to a CSV as they arrive. A row with a column the
+    header lacks, a phase first refined by a later INP, starts a new
+    header line with the columns so far and the new ones; readers take
+    each block with the header above it, see analytics.load_csv. Every
+    row names the run that wrote it in a batch column.
+
+    Every written pattern is also listed in a sidecar journal
+    (<output>.journal), both files are fsynced every fsync_every rows so a
+    crash loses at most that many results.
+
+    The header of a new file comes from its first good row, failed rows
+    before it are held until then or close(), so flushing every row, as
+    a watched folder does, still gives one header.
+    '''
+
+    def __init__(self, output, fsync_every=20, logger=None):
+        self.output = pathlib.Path(output)
+        self.journal = self.output.with_name(self.output.name + '.journal')
+        self.fsync_every = max(1, fsync_every)
+        self.logger = logger
+        self.headers = self.read_headers()
+        # One id per run, like the batch of store.ResultStore
+        self.batch = f'{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+        self.writer = None
+        self.held = []
+        self.pending = 0
+        self.file = open(self.output, mode='a', newline='')
+        self.journal_file = open(self.journal, mode='a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_headers(self):
+        '''
+        The last header of the file, the one its last rows were written with
+        '''
+        if not self.output.exists() or self.output.stat().st_size == 0:
+            return None
+        headers = None
+        with open(self.output, mode='r', newline='') as f:
+            for row in csv.reader(f):
+                if headers is None or is_header(row):
+                    headers = row
+        return headers
+
+    def done(self):
+        '''
+        Predicate telling if a pattern already has a row: by path from the
+        journal, or by id from the CSV when there is no journal.
+        '''
+        if self.journal.exists() and self.journal.stat().st_size:
+            with open(self.journal, mode='r') as f:
+                paths = set(line.rstrip('\n') for line in f)
+            return lambda pattern: str(pattern) in paths
+        ids = set()
+        if self.headers is not None:
+            with open(self.output, mode='r', newline='') as f:
+                # Header lines further down only add an id of "id"
+                ids = set(row.get('id') for row in csv.DictReader(f))
+        return lambda pattern: pathlib.Path(pattern).with_suffix('').name in ids
+
+    def write(self, pattern, result, inp=None):
+        failed = all(key in FAILED for key in result)
+        result = dict(result, batch=self.batch)
+        if self.writer is None and self.headers is None and failed:
+            self.held.append((pattern, result))
+        elif self.writer is None:
+            self.open_csv(result)
+            self.write_row(pattern, result)
+        else:
+            self.write_row(pattern, result)
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.flush()
+
+    def open_csv(self, columns):
+        new_file = self.headers is None
+        if new_file:
+            self.headers = list(columns)
+        self.writer = csv.DictWriter(self.file, self.headers,
+                                     extrasaction='ignore')
+        if new_file:
+            self.writer.writeheader()
+        held, self.held = self.held, []
+        for pattern, result in held:
+            self.write_row(pattern, result)
+
+    def write_row(self, pattern, result):
+        # The error marker of a failed row is not worth a new header, the
+        # row's r_wp of 0 tells it apart
+        extras = [key for key in result
+                  if key not in self.headers and key not in FAILED]
+        if extras:
+            if self.logger is not None:
+                self.logger.info(
+                    f'writer.write: new header in {self.output} for {", ".join(extras)}')
+            self.headers = self.headers + extras
+            self.writer = csv.DictWriter(self.file, self.headers,
+                                         extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerow(result)
+        self.journal_file.write(f'{pattern}\n')
+
+    def flush(self):
+        # The CSV first, the journal must never list a row that is not there
+        for file in (self.file, self.journal_file):
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.held:
+            self.open_csv(dict.fromkeys(
+                key for _, result in self.held for key in result))
+        self.flush()
+        self.file.close()
+        self.journal_file.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Coordinator and worker processes on localhost, with fake_tc.py standing in
+for TOPAS.
+
+    python benchmarks/bench_distributed.py [--patterns 200] [--workers 3]
+        [--slots 2] [--sleep 0.5] [--kill-after 2]
+
+With --kill-after one worker is killed that many seconds in, its jobs must
+go to the others. Reports throughput, per-worker stats and whether every
+pattern got its row.
+'''
+import argparse
+import csv
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+from XRD_batch_helper.distributed import Coordinator  # noqa: E402
+from XRD_batch_helper.engine import Engine  # noqa: E402
+from XRD_batch_helper.metrics import Metrics  # noqa: E402
+from XRD_batch_helper.scheduler import Task  # noqa: E402
+from fixtures import make_inp, make_patterns  # noqa: E402
+
+WORKER = '''
+import logging, pathlib, sys
+sys.path.insert(0, {root!r})
+from XRD_batch_helper.distributed import Worker
+from XRD_batch_helper.runner import Runner
+logger = logging.getLogger('worker')
+Worker(address=('127.0.0.1', {port}), authkey=b'bench', tc={tc!r},
+       logger=logger, slots={slots}, name={name!r},
+       runner=Runner(poll_interval=0.01)).run()
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patterns', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--slots', type=int, default=2)
+    parser.add_argument('--sleep', type=float, default=0.5,
+                        help='seconds fake_tc pretends to refine')
+    parser.add_argument('--kill-after', type=float,
+                        help='kill the first worker after that many seconds')
+    parser.add_argument('--port', type=int, default=50177)
+    args = parser.parse_args()
+    os.environ['FAKE_TC_SLEEP'] = str(args.sleep)
+    logger = logging.getLogger('bench')
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        inp = make_inp(directory / 'bench.inp')
+        patterns = make_patterns(directory / 'patterns', args.patterns)
+        output = directory / 'result.csv'
+        engine = Engine(tc=HERE / 'fake_tc.py', logger=logger,
+                        workers=args.workers * args.slots, metrics=Metrics())
+        coordinator = Coordinator(engine, address=('127.0.0.1', args.port),
+                                  authkey=b'bench', heartbeat=0.5,
+                                  dead_after=2)
+        coordinator.start()
+        workers = [
+            subprocess.Popen([sys.executable, '-c', WORKER.format(
+                root=str(HERE.parent), port=args.port,
+                tc=str(HERE / 'fake_tc.py'), slots=args.slots,
+                name=f'worker-{index}')])
+            for index in range(args.workers)]
+        if args.kill_after:
+            threading.Timer(args.kill_after, workers[0].kill).start()
+        task = Task(inp, patterns, output,
+                    process_func=coordinator.process_TC)
+        start = time.perf_counter()
+        try:
+            engine.process_tasks([task])
+        finally:
+            wall = time.perf_counter() - start
+            stats = coordinator.board.stats()
+            coordinator.shutdown()
+            for worker in workers:
+                worker.wait(timeout=10)
+        with open(output, newline='') as f:
+            rows = list(csv.DictReader(f))
+    print(f'{args.patterns} patterns on {args.workers} workers x {args.slots} '
+          f'slots, fake tc sleeps {args.sleep}s')
+    print(f'{wall:.2f}s, {args.patterns / wall:.1f} patterns/s, '
+          f'{len(rows)} rows, all written: {len(rows) == args.patterns}')
+    print(f'{"worker":>10} {"alive":>6} {"jobs":>6} {"failed":>7} {"busy s":>8} '
+          f'{"patterns/s":>11}')
+    for worker in stats:
+        print(f'{worker["worker"]:>10} {str(worker["alive"]):>6} '
+              f'{worker["jobs"]:>6} {worker["failed"]:>7} '
+              f'{worker["busy"]:>8.1f} {worker["throughput"]:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
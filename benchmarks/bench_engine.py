@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Throughput and overhead of the batch engine, with fake_tc.py standing in
+for TOPAS so it runs on plain Linux.
+
+    python benchmarks/bench_engine.py [--sizes 10 1000 100000] [--sleep 0]
+
+For every size it reports patterns/second, the per-pattern time the engine
+spends outside tc (render, temp files, parsing, CSV) and peak memory.
+'''
+import argparse
+import logging
+import os
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+from XRD_batch_helper.engine import Engine  # noqa: E402
+from XRD_batch_helper.metrics import Metrics  # noqa: E402
+from XRD_batch_helper.runner import Runner  # noqa: E402
+from fixtures import make_inp, make_patterns  # noqa: E402
+
+
+def bench(size, workers, phases, chunk_size, directory):
+    directory = pathlib.Path(directory)
+    inp = make_inp(directory / 'bench.inp', phases=phases)
+    patterns = make_patterns(directory / 'patterns', size)
+    logger = logging.getLogger('bench')
+    handler = logging.FileHandler(directory / 'bench.log')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    engine = Engine(tc=HERE / 'fake_tc.py', logger=logger, workers=workers,
+                    runner=Runner(poll_interval=0.01), metrics=Metrics(),
+                    chunk_size=chunk_size)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        engine.process(inp, patterns, directory / 'result.csv')
+    finally:
+        wall = time.perf_counter() - start
+        _, traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.removeHandler(handler)
+        handler.close()
+    stages = engine.metrics.last_batch['stages']
+    tc = stages.get('tc', 0.0)
+    overhead = sum(stages.values()) - tc
+    return {
+        'size': size,
+        'wall': wall,
+        'throughput': size / wall,
+        'tc': tc / size,
+        'overhead': overhead / size,
+        'traced': traced,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--phases', type=int, default=6)
+    parser.add_argument('--chunk-size', type=int, default=1,
+                        help='patterns per fake tc run, 0 for auto')
+    parser.add_argument('--sleep', type=float, default=0.0,
+                        help='seconds fake_tc pretends to refine')
+    args = parser.parse_args()
+    os.environ['FAKE_TC_SLEEP'] = str(args.sleep)
+    print(f'{args.workers} workers, {args.phases} phases, chunks of '
+          f'{args.chunk_size}, fake tc sleeps {args.sleep}s')
+    print(f'{"patterns":>9} {"wall s":>9} {"patterns/s":>11} {"tc ms":>8} '
+          f'{"overhead ms":>12} {"traced MB":>10} {"max RSS MB":>11}')
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            result = bench(size, args.workers, args.phases, args.chunk_size,
+                           directory)
+        # ru_maxrss is in KB on Linux and never goes down, it is the peak so far
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f'{result["size"]:>9} {result["wall"]:>9.2f} '
+              f'{result["throughput"]:>11.1f} {result["tc"] * 1000:>8.1f} '
+              f'{result["overhead"] * 1000:>12.3f} '
+              f'{result["traced"] / 2 ** 20:>10.1f} {rss:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Finding the patterns of a tree with FileIndex, cold and from its file,
+against the recursive glob the app used before.
+
+    python benchmarks/bench_index.py [--dirs 200] [--files 50] [--root DIR]
+
+With --root an existing tree is searched instead, e.g. a network share.
+'''
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parents[1]))
+
+from XRD_batch_helper.index import FileIndex  # noqa: E402
+
+
+def make_tree(root, dirs, files):
+    for index in range(dirs):
+        directory = root / f'day{index // 20}' / f'run{index}'
+        directory.mkdir(parents=True)
+        for number in range(files):
+            (directory / f'p{number}.raw').touch()
+            (directory / f'p{number}.xy').touch()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dirs', type=int, default=200)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--root', type=pathlib.Path)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        root = args.root
+        if root is None:
+            root = directory / 'tree'
+            make_tree(root, args.dirs, args.files)
+            # Older than index.RECENT, as a tree on a share would be
+            time.sleep(2.1)
+        file = directory / 'index.json'
+        rows = [
+            ('glob **/*.raw', timed(lambda: list(root.glob('**/*.raw')))),
+            ('index, cold', timed(lambda: FileIndex(file).find(root, '*.raw'))),
+            ('index, from file', timed(lambda: FileIndex(file).find(root, '*.raw'))),
+        ]
+    for name, (seconds, count) in rows:
+        print(f'{name:>18} {seconds * 1000:8.1f} ms {count:>7} patterns')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Compare XRD_batch_helper.outparser with the regexes process_TC used before.
+
+    python benchmarks/bench_outparser.py [--size-mb 4] [--phases 12]
+
+The second table is an .out without r_wp, as tc leaves after a crash or a
+kill: the old `.*?(r_wp)` regex restarts its scan from every position and
+goes quadratic, so it is only timed on small files.
+'''
+import argparse
+import pathlib
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parents[1]))
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent))
+
+from XRD_batch_helper.outparser import parse_out  # noqa: E402
+from fixtures import make_out  # noqa: E402
+
+
+def old_parse(path):
+    with open(path, mode='r') as f:
+        inp_output = f.read()
+    r_wp = re.findall(r'.*?(r_wp)  (\d+\.\d+).*',
+                      inp_output, re.DOTALL)
+    weights = re.findall(
+        r'phase_name "(.*?)".*?MVW\( \d+\.\d+`?, \d+\.\d+`?, (\d+\.\d+)`?\)',
+        inp_output, re.DOTALL)
+    return r_wp + weights
+
+
+def best_time(func, path, repeat):
+    return min(timeit.repeat(lambda: func(path), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=4)
+    parser.add_argument('--phases', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / 'bench.out'
+        make_out(path, args.size_mb * 1024 * 1024, args.phases)
+        old = old_parse(path)
+        new = parse_out(path)
+        assert float(old[0][1]) == new.r_wp
+        assert [(name, float(weight)) for name, weight in old[1:]] == \
+            [(phase.name, phase.weight) for phase in new.phases]
+        size = path.stat().st_size / 1024 / 1024
+        print(f'converged .out, {size:.1f} MB, {len(new.phases)} phase blocks')
+        for name, func in (('regex', old_parse), ('outparser', parse_out)):
+            best = best_time(func, path, args.repeat)
+            print(f'{name:>10}: {best * 1000:8.1f} ms {size / best:8.1f} MB/s')
+
+        print('.out without r_wp')
+        print(f'{"KB":>10} {"regex ms":>10} {"outparser ms":>13}')
+        for size in (4, 8, 16):
+            make_out(path, size * 1024, 1, r_wp=False)
+            old = best_time(old_parse, path, 1)
+            new = best_time(parse_out, path, args.repeat)
+            print(f'{size:>10} {old * 1000:>10.1f} {new * 1000:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
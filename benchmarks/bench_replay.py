@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+The batch engine at production volume, with tc replayed from an archive
+recorded with `run --record`.
+
+    python benchmarks/bench_replay.py [--archive runs.zip] [--multiply 100]
+        [--scale 0.01] [--workers 8] [--output result.csv]
+
+Without --archive, one is recorded first from fake_tc.py over --record
+patterns. The batch has multiply times as many patterns as the archive has
+tc runs, each replayed with its recorded .out and scale times its wall
+time. Reports throughput and where the time outside tc goes, including
+the writer (csv) and the parser (parse).
+
+Every replayed run starts a Python process, tens of milliseconds of CPU;
+--scale 0 shows that floor.
+'''
+import argparse
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+HERE = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+sys.path.insert(0, str(HERE))
+
+from XRD_batch_helper.engine import Engine  # noqa: E402
+from XRD_batch_helper.metrics import Metrics  # noqa: E402
+from XRD_batch_helper.replay import Recorder, Replay, write_launcher  # noqa: E402
+from XRD_batch_helper.runner import Runner  # noqa: E402
+from fixtures import make_inp, make_patterns  # noqa: E402
+
+
+def engine_for(tc, workers, directory):
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.FileHandler(directory / 'bench.log'))
+    logger.setLevel(logging.INFO)
+    return Engine(tc=tc, logger=logger, workers=workers,
+                  runner=Runner(poll_interval=0.01), metrics=Metrics())
+
+
+def record(directory, count, workers):
+    inp = make_inp(directory / 'bench.inp')
+    patterns = make_patterns(directory / 'recorded', count)
+    archive = directory / 'runs.zip'
+    engine = engine_for(HERE / 'fake_tc.py', workers, directory)
+    engine.recorder = Recorder(archive)
+    try:
+        engine.process(inp, patterns, directory / 'recorded.csv')
+    finally:
+        engine.recorder.close()
+    return archive, inp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--archive', type=pathlib.Path)
+    parser.add_argument('--inp', type=pathlib.Path,
+                        help='INP of the recording, default a synthetic one')
+    parser.add_argument('--record', type=int, default=50,
+                        help='patterns to record without --archive')
+    parser.add_argument('--multiply', type=int, default=100)
+    parser.add_argument('--scale', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--sleep', type=float, default=0.5,
+                        help='seconds fake_tc refines while recording')
+    parser.add_argument('--output', type=pathlib.Path,
+                        help='result file, its suffix picks the writer')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        archive, inp = args.archive, args.inp
+        if archive is None:
+            os.environ['FAKE_TC_SLEEP'] = str(args.sleep)
+            archive, inp = record(directory, args.record, args.workers)
+        elif inp is None:
+            inp = make_inp(directory / 'bench.inp')
+        runs = Replay(archive).runs
+        size = len(runs) * args.multiply
+        tc = write_launcher(directory / 'replay_tc', archive, scale=args.scale)
+        patterns = make_patterns(directory / 'patterns', size)
+        output = args.output or directory / 'result.csv'
+        engine = engine_for(tc, args.workers, directory)
+        start = time.perf_counter()
+        engine.process(inp, patterns, output)
+        wall = time.perf_counter() - start
+        batch = engine.metrics.last_batch
+    stages = batch['stages']
+    print(f'{len(runs)} recorded runs x {args.multiply} = {size} patterns, '
+          f'{args.workers} workers, wall times x {args.scale}')
+    print(f'{wall:.2f}s, {size / wall:.1f} patterns/s, '
+          f'{batch["failures"]} failed, p50 {batch["p50"]:.3f}s '
+          f'p95 {batch["p95"]:.3f}s')
+    print(f'{"stage":>10} {"total s":>9} {"ms/pattern":>11}')
+    for name, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        print(f'{name:>10} {seconds:>9.2f} {seconds / size * 1000:>11.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Stand-in for TOPAS tc: fake_tc.py file.inp writes file.out like tc does.
+
+FAKE_TC_SLEEP sets the seconds it pretends to refine (default 0). An INP
+that already holds refined values, as warm starts give it, converges in a
+quarter of the cycles and of the time. Every cycle prints its r_wp; with
+FAKE_TC_DIVERGE, a fraction of the runs has it rising from cycle 3 on.
+A pattern's refined values depend on its bytes only, alone or in a chunk.
+'''
+import os
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent))
+
+from fixtures import out_text  # noqa: E402
+
+
+def main():
+    inp = pathlib.Path(sys.argv[1])
+    inp_content = inp.read_text()
+    cycles = 20 if 'MVW( 0, 0, 0)' in inp_content else 5
+    diverge = random.Random(inp.name).random() < float(
+        os.environ.get('FAKE_TC_DIVERGE', '0'))
+    r_wp = 40.0
+    for cycle in range(1, cycles + 1):
+        time.sleep(float(os.environ.get('FAKE_TC_SLEEP', '0')) / 20)
+        r_wp = r_wp * 1.1 if diverge and cycle > 2 else r_wp * 0.8 + 1
+        print(f'Cycle {cycle} Rwp {r_wp:.3f}', flush=True)
+    inp.with_suffix('.out').write_text(out_text(inp_content))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
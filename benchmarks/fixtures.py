@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Synthetic INPs, patterns and .out files, so benchmarks run without TOPAS.
+'''
+import pathlib
+import random
+import re
+import struct
+import zlib
+
+PHASES = ('Alite', 'Belite', 'Aluminate', 'Ferrite', 'Lime', 'Periclase',
+          'Portlandite', 'Calcite', 'Quartz', 'Gypsum', 'Bassanite', 'Arcanite')
+SITE = '\t\tsite Ca{0} num_posns 4 x 0.1234 y 0.5678 z 0.9012 occ Ca 1 beq 0.5'
+
+
+def inp_text(phases=6, sites=20):
+    # r_wp inside the xdd block is reported per pattern in chunked runs
+    lines = ['xdd "placeholder.raw"',
+             '\tr_wp 0 r_exp 0',
+             '\tCuKa5(0.0001)',
+             '\tbkg @ 0 0 0 0 0 0',
+             '\tstart_X 5',
+             '\tfinish_X 70']
+    for index in range(phases):
+        name = PHASES[index % len(PHASES)]
+        if index >= len(PHASES):
+            name = f'{name} {index}'
+        lines.append('\tstr')
+        lines.append(f'\t\tphase_name "{name}"')
+        lines.extend(SITE.format(site) for site in range(sites))
+        lines.append('\t\tMVW( 0, 0, 0)')
+    return '\n'.join(lines) + '\n'
+
+
+def make_inp(path, phases=6, sites=20):
+    path = pathlib.Path(path)
+    path.write_text(inp_text(phases, sites))
+    return path
+
+
+def block_seed(block, seed):
+    '''
+    Seed of an xdd block: its pattern's bytes when it can be read, else its
+    name, so a pattern refines the same alone and in a chunk
+    '''
+    match = re.match(r'xdd "([^"]*)"', block)
+    if match is None:
+        return seed
+    try:
+        return f'{seed}:{zlib.crc32(pathlib.Path(match.group(1)).read_bytes())}'
+    except OSError:
+        return f'{seed}:{pathlib.PurePath(match.group(1)).name}'
+
+
+def out_text(inp_content, seed=None):
+    '''
+    What tc writes next to the INP: the INP with refined, ` flagged values
+    '''
+    blocks = []
+    # Once per xdd block when several patterns are refined together
+    for text in re.split(r'(?=xdd ")', inp_content):
+        rng = random.Random(block_seed(text, seed))
+        for _ in range(text.count('r_wp 0 r_exp 0')):
+            text = text.replace(
+                'r_wp 0 r_exp 0',
+                f'r_wp  {rng.uniform(5, 15):.3f} r_exp  {rng.uniform(2, 5):.3f}', 1)
+        for _ in range(text.count('MVW( 0, 0, 0)')):
+            text = text.replace(
+                'MVW( 0, 0, 0)',
+                f'MVW( {rng.uniform(100, 3000):.3f}, {rng.uniform(100, 1000):.3f}`, '
+                f'{rng.uniform(0, 100):.3f}`_{rng.uniform(0.01, 1):.3f})', 1)
+        blocks.append(text)
+    return ''.join(blocks)
+
+
+def make_out(path, size, phases, r_wp=True):
+    '''
+    A multi-phase .out padded with site/peak lines, as a large refinement
+    with many structures writes.
+    '''
+    lines = ['r_exp  3.21 r_exp_dash  4.56 r_wp  7.891 r_wp_dash  9.87'
+             if r_wp else 'r_exp  3.21 r_exp_dash  4.56',
+             'xdd "pattern.raw"',
+             '\tCuKa5(0.0001)']
+    padding = '\t\tsite Ca1 num_posns 4 x 0.1234` y 0.5678` z 0.9012` occ Ca 1 beq 0.5'
+    structure = []
+    for index in range(phases):
+        structure.append('\tstr')
+        structure.append(f'\t\tphase_name "Phase {index}"')
+        structure.extend([padding] * 40)
+        structure.append(f'\t\tMVW( 1234.567, 456.789`, {index + 1}.234`)')
+    block = '\n'.join(structure) + '\n'
+    with open(path, mode='w') as f:
+        f.write('\n'.join(lines) + '\n')
+        # The old regex pairs all of them up, repeat whole structures only
+        written = 0
+        while written < size:
+            written += f.write(block)
+
+
+def raw_bytes(seed=0, steps=1000, start=5.0, step_size=0.02):
+    '''
+    A Bruker RAW1.01 file with one range of steps float32 counts, the
+    counts depend on seed
+    '''
+    header = bytearray(712)
+    header[0:8] = b'RAW1.01\0'
+    struct.pack_into('<II', header, 8, 1, 1)
+    header[16:26] = b'10/17/2026'
+    header[326:326 + 60] = f'sample {seed}'.encode().ljust(60, b'\0')
+    range_header = bytearray(304)
+    struct.pack_into('<II', range_header, 0, 304, steps)
+    struct.pack_into('<d', range_header, 16, start)
+    struct.pack_into('<d', range_header, 176, step_size)
+    rng = random.Random(seed)
+    counts = struct.pack(f'<{steps}f', *(100 + rng.random() * 10 for _ in range(steps)))
+    return bytes(header) + bytes(range_header) + counts
+
+
+def make_patterns(directory, count, steps=1000):
+    '''
+    count valid .raw files, each with distinct counts
+    '''
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = directory / f'pattern{index:06d}.raw'
+        path.write_bytes(raw_bytes(seed=index, steps=steps))
+        paths.append(path)
+    return paths
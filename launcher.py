@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Starts XRD_batch_helper as a package, for double clicking and as the entry
+script of a frozen build; XRD_batch_helper/app.py does not run on its own.
+
+    python launcher.py [command ...]     same as python -m XRD_batch_helper
+    pyinstaller --onefile --windowed launcher.py
+'''
+import sys
+
+from XRD_batch_helper.__main__ import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import configparser
+import csv
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).absolute().parents[1]
+FAKE_TC = ROOT / 'benchmarks' / 'fake_tc.py'
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from fixtures import inp_text, out_text  # noqa: E402
+from XRD_batch_helper.outparser import parse_lines  # noqa: E402
+from XRD_batch_helper.template import InpTemplate  # noqa: E402
+
+
+def app_dir(tmp_path, **sections):
+    '''
+    An app dir whose config.ini has sections over a test setup: two
+    workers, no cache
+    '''
+    config = configparser.ConfigParser()
+    config.read_dict({'PROCESS': {'workers': '2'}, 'CACHE': {'enabled': 'no'}})
+    config.read_dict(sections)
+    directory = tmp_path / 'app'
+    directory.mkdir()
+    with open(directory / 'config.ini', 'w') as f:
+        config.write(f)
+    return directory
+
+
+def make_inp(tmp_path, text=None):
+    path = tmp_path / 'test.inp'
+    path.write_text(text or inp_text(phases=3, sites=2))
+    return path
+
+
+def make_patterns(directory, count, start=1):
+    # fake_tc refines a pattern by its bytes, each one differs
+    directory.mkdir(exist_ok=True)
+    paths = []
+    for index in range(start, start + count):
+        path = directory / f'p{index}.xy'
+        path.write_text(''.join(f'{5 + step * 0.02:.2f} {100 + index * step}\n'
+                                for step in range(50)))
+        paths.append(path)
+    return paths
+
+
+def expected(inp, pattern):
+    '''
+    The row fake_tc gives pattern refined alone
+    '''
+    content = InpTemplate(inp.read_text()).render(pattern)
+    return parse_lines(out_text(content).splitlines(keepends=True)).as_dict(
+        pattern.stem)
+
+
+def run(app, *args, tc=FAKE_TC):
+    return subprocess.run(
+        [sys.executable, '-m', 'XRD_batch_helper', '--app-dir', str(app),
+         'run', '--tc', str(tc), *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=120)
+
+
+def rows(output):
+    '''
+    The rows of output without its header lines, values as written
+    '''
+    with open(output, newline='') as f:
+        return [row for row in csv.DictReader(f) if row['id'] != 'id']
+
+
+def same(row, result):
+    return all(float(row[key]) == value
+               for key, value in result.items() if key != 'id')
+
+
+def test_run(tmp_path):
+    app = app_dir(tmp_path)
+    inp = make_inp(tmp_path)
+    patterns = make_patterns(tmp_path / 'data', 4)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+                  '--output', str(output))
+    assert process.returncode == 0, process.stderr
+    written = rows(output)
+    assert [row['id'] for row in written] == ['p1', 'p2', 'p3', 'p4']
+    for row, pattern in zip(written, patterns):
+        assert same(row, expected(inp, pattern))
+    assert len({row['batch'] for row in written}) == 1
+
+
+def test_tasks_share_an_output(tmp_path):
+    app = app_dir(tmp_path)
+    inp = make_inp(tmp_path)
+    make_patterns(tmp_path / 'a', 2)
+    make_patterns(tmp_path / 'b', 2, start=3)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--task', str(inp), str(tmp_path / 'a' / '*.xy'), str(output),
+                  '--task', str(inp), str(tmp_path / 'b' / '*.xy'), str(output))
+    assert process.returncode == 0, process.stderr
+    assert sorted(row['id'] for row in rows(output)) == ['p1', 'p2', 'p3', 'p4']
+    assert output.read_text().count('id,') == 1
+
+
+def test_failed_run(tmp_path):
+    app = app_dir(tmp_path)
+    inp = make_inp(tmp_path)
+    make_patterns(tmp_path / 'data', 1)
+    missing = tmp_path / 'data' / 'missing.xy'
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp),
+                  '--patterns', str(tmp_path / 'data' / 'p1.xy'), str(missing),
+                  '--output', str(output))
+    assert process.returncode == 1
+    assert {row['id']: float(row['r_wp']) > 0 for row in rows(output)} == {
+        'missing': False, 'p1': True}
+
+
+def test_cache_hits(tmp_path):
+    app = app_dir(tmp_path, CACHE={'enabled': 'yes'})
+    inp = make_inp(tmp_path)
+    make_patterns(tmp_path / 'data', 3)
+    patterns = str(tmp_path / 'data' / '*.xy')
+    first = run(app, '--inp', str(inp), '--patterns', patterns,
+                '--output', str(tmp_path / 'first.csv'))
+    assert first.stderr.count('engine.run_tc:') == 3
+    second = run(app, '--inp', str(inp), '--patterns', patterns,
+                 '--output', str(tmp_path / 'second.csv'))
+    assert second.returncode == 0, second.stderr
+    assert second.stderr.count('engine.cached: cache hit') == 3
+    assert 'engine.run_tc:' not in second.stderr
+    assert [dict(row, batch=None) for row in rows(tmp_path / 'second.csv')] == [
+        dict(row, batch=None) for row in rows(tmp_path / 'first.csv')]
+    # A changed INP is refined again
+    make_inp(tmp_path, inp_text(phases=2, sites=2))
+    third = run(app, '--inp', str(inp), '--patterns', patterns,
+                '--output', str(tmp_path / 'third.csv'))
+    assert third.stderr.count('engine.run_tc:') == 3
+
+
+def test_resume(tmp_path):
+    app = app_dir(tmp_path)
+    inp = make_inp(tmp_path)
+    make_patterns(tmp_path / 'data', 2)
+    output = tmp_path / 'out.csv'
+    args = ('--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+            '--output', str(output), '--resume')
+    assert run(app, *args).returncode == 0
+    make_patterns(tmp_path / 'data', 1, start=3)
+    process = run(app, *args)
+    assert process.returncode == 0, process.stderr
+    assert process.stderr.count('engine.run_tc:') == 1
+    assert [row['id'] for row in rows(output)] == ['p1', 'p2', 'p3']
+    # Nothing left to refine is a clean run
+    process = run(app, *args)
+    assert process.returncode == 0, process.stderr
+    assert 'engine.run_tc:' not in process.stderr
+    assert len(rows(output)) == 3
+
+
+def test_chunks(tmp_path):
+    app = app_dir(tmp_path, PROCESS={'workers': '2', 'chunk_size': '3'})
+    inp = make_inp(tmp_path)
+    patterns = make_patterns(tmp_path / 'data', 6)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+                  '--output', str(output))
+    assert process.returncode == 0, process.stderr
+    # Two chunks and the check of the first pattern alone
+    assert process.stderr.count('engine.run_tc:') == 3
+    for row, pattern in zip(rows(output), patterns):
+        assert row['id'] == pattern.stem
+        assert same(row, expected(inp, pattern))
+
+
+def test_chunks_without_r_wp_per_block(tmp_path):
+    app = app_dir(tmp_path, PROCESS={'workers': '2', 'chunk_size': '3'})
+    # r_wp before the xdd line is global, a chunk has none per pattern
+    text = inp_text(phases=3, sites=2).replace('\tr_wp 0 r_exp 0\n', '')
+    inp = make_inp(tmp_path, 'r_wp 0 r_exp 0\n' + text)
+    patterns = make_patterns(tmp_path / 'data', 6)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+                  '--output', str(output))
+    assert process.returncode == 0, process.stderr
+    # The first chunk and single runs, the second chunk is not tried
+    assert process.stderr.count('engine.run_tc:') == 7
+    for row, pattern in zip(rows(output), patterns):
+        # fake_tc draws the global r_wp at random
+        assert float(row['r_wp']) > 0
+        assert same(row, dict(expected(inp, pattern), r_wp=float(row['r_wp'])))
+
+
+def test_warm_start(tmp_path):
+    app = app_dir(tmp_path, PROCESS={'workers': '1'})
+    inp = make_inp(tmp_path)
+    make_patterns(tmp_path / 'data', 3)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+                  '--output', str(output), '--warm-start')
+    assert process.returncode == 0, process.stderr
+    # The first pattern refines from the INP, the others from the one before
+    assert process.stderr.count('engine.report_warm:') == 2
+    assert process.stderr.count('engine.run_tc:') == 3
+    assert [row['id'] for row in rows(output)] == ['p1', 'p2', 'p3']
+
+
+def test_warm_start_timeout(tmp_path):
+    app = app_dir(tmp_path, PROCESS={'workers': '1'}, RUNNER={'timeout': '1'})
+    tc = tmp_path / 'tc'
+    # Hangs on an INP with refined values, as a warm start gives it
+    tc.write_text('#!/bin/sh\n'
+                  'if grep -q \'`\' "$1"; then sleep 60; fi\n'
+                  f'exec "{sys.executable}" "{FAKE_TC}" "$1"\n')
+    tc.chmod(0o755)
+    inp = make_inp(tmp_path)
+    patterns = make_patterns(tmp_path / 'data', 2)
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(tmp_path / 'data' / '*.xy'),
+                  '--output', str(output), '--warm-start', tc=tc)
+    assert process.returncode == 0, process.stderr
+    assert 'refining from the INP' in process.stderr
+    for row, pattern in zip(rows(output), patterns):
+        assert same(row, expected(inp, pattern))
+
+
+def test_duplicates_and_rejected(tmp_path):
+    app = app_dir(tmp_path)
+    inp = make_inp(tmp_path)
+    data = tmp_path / 'data'
+    first, _ = make_patterns(data, 2)
+    (data / 'p1_again.xy').write_bytes(first.read_bytes())
+    (data / 'cut.raw').write_bytes(b'RAW1.01\0' + bytes(100))
+    output = tmp_path / 'out.csv'
+    process = run(app, '--inp', str(inp), '--patterns', str(data / '*'),
+                  '--output', str(output))
+    # A rejected pattern fails the run
+    assert process.returncode == 1
+    assert process.stderr.count('engine.run_tc:') == 2
+    written = {row['id']: row for row in rows(output)}
+    assert sorted(written) == ['cut', 'p1', 'p1_again', 'p2']
+    assert dict(written['p1_again'], id='p1') == written['p1']
+    assert float(written['cut']['r_wp']) == 0
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from XRD_batch_helper import index
+from XRD_batch_helper.index import FileIndex
+
+
+def age(path, seconds):
+    # Older than index.RECENT, so the stored listing is trusted
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_listing(tmp_path):
+    (tmp_path / 'b.raw').touch()
+    (tmp_path / 'a.raw').touch()
+    (tmp_path / 'day1').mkdir()
+    assert FileIndex().listing(tmp_path) == (['a.raw', 'b.raw'], ['day1'])
+    assert FileIndex().listing(tmp_path / 'missing') == ([], [])
+
+
+def test_listing_from_the_index_file(tmp_path):
+    directory = tmp_path / 'patterns'
+    directory.mkdir()
+    (directory / 'a.raw').touch()
+    age(directory, 60)
+    files = FileIndex(tmp_path / 'index.json')
+    assert files.listing(directory) == (['a.raw'], [])
+    files.save()
+    # An unchanged directory is not listed again
+    stored = FileIndex(tmp_path / 'index.json')
+    stored.entries[str(directory)]['files'] = ['stored.raw']
+    assert stored.listing(directory) == (['stored.raw'], [])
+    # An entry added changes its mtime
+    (directory / 'b.raw').touch()
+    age(directory, 30)
+    assert stored.listing(directory) == (['a.raw', 'b.raw'], [])
+
+
+def test_recent_directory_listed_again(tmp_path, monkeypatch):
+    files = FileIndex()
+    files.listing(tmp_path)
+    files.entries[str(tmp_path)]['files'] = ['stored.raw']
+    assert files.listing(tmp_path) == ([], [])
+    monkeypatch.setattr(index, 'RECENT', -1e9)
+    files.entries[str(tmp_path)]['files'] = ['stored.raw']
+    assert files.listing(tmp_path) == (['stored.raw'], [])
+
+
+def test_find(tmp_path):
+    (tmp_path / 'day1').mkdir()
+    (tmp_path / 'day1' / 'p1.raw').touch()
+    (tmp_path / 'day1' / 'p1.xy').touch()
+    (tmp_path / 'p2.RAW').touch()
+    files = FileIndex()
+    found = files.find(tmp_path, '*.raw')
+    expected = [str(tmp_path / 'day1' / 'p1.raw')]
+    if os.path.normcase('A') == 'a':
+        expected.insert(0, str(tmp_path / 'p2.RAW'))
+    assert found == expected
+    assert files.find(tmp_path, 'day1/*.xy', recursive=True) == [
+        str(tmp_path / 'day1' / 'p1.xy')]
+    assert files.find(tmp_path, '*.raw', recursive=False) == expected[:-1]
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from XRD_batch_helper.outparser import Phase, parse_lines, parse_out_xdds
+
+OUT = '''\
+r_wp  7.123 r_exp  3.210
+xdd "C:\\patterns\\p1.raw"
+\tstr
+\t\tphase_name "Alite"
+\t\tsite Ca1 num_posns 4 x 0.1234 y 0.5678 z 0.9012 occ Ca 1 beq 0.5
+\t\tMVW( 1234.567, 456.789`, 65.432`_0.123)
+\tstr
+\t\tphase_name "Belite"
+\t\tMVW( 987.654, 345.678`, 34.568`)
+'''
+
+
+def test_parse_lines():
+    result = parse_lines(OUT.splitlines(keepends=True))
+    assert result.r_wp == 7.123
+    assert result.phases == [Phase('Alite', 65.432, 0.123),
+                             Phase('Belite', 34.568, None)]
+    assert result.as_dict('p1') == {'id': 'p1', 'r_wp': 7.123,
+                                    'Alite': 65.432, 'Belite': 34.568}
+
+
+def test_first_r_wp_and_malformed_mvw():
+    result = parse_lines([
+        'r_wp  5.000\n', 'r_wp  9.000\n',
+        'phase_name "Lime"\n', 'MVW( 1.0, 2.0)\n',
+        'MVW( x, 2.0, 3.0)\n', 'MVW( 1.0, 2.0, 3.0)\n'])
+    assert result.r_wp == 5.0
+    assert result.phases == [Phase('Lime', 3.0, None)]
+
+
+def test_no_r_wp():
+    result = parse_lines(['phase_name "Quartz"\n'])
+    assert result.r_wp is None
+    assert result.as_dict('p1') == {'id': 'p1', 'r_wp': 0.0}
+
+
+def test_parse_out_xdds(tmp_path):
+    path = tmp_path / 'chunk.out'
+    block = OUT.split('xdd', 1)[1]
+    path.write_text('r_wp  1.000\n'
+                    + 'xdd' + block.replace('7.123', '6.0') + '\tr_wp  6.500\n'
+                    + 'xdd' + block.replace('65.432', '60.0'))
+    results = parse_out_xdds(path)
+    assert [result.r_wp for result in results] == [6.5, None]
+    assert [phase.weight for phase in results[1].phases] == [60.0, 34.568]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pathlib
+import struct
+
+import pytest
+
+from XRD_batch_helper import rawfile
+
+DATA = pathlib.Path(__file__).parent / 'data'
+
+
+def range_header(steps, start, step_size, supplementary=0):
+    '''
+    A RAW1.01 range header, the fields at their offsets in Bruker's layout
+    '''
+    header = bytearray(304)
+    struct.pack_into('<II', header, 0, 304, steps)
+    struct.pack_into('<dd', header, 8, start / 2, start)   # theta, 2theta
+    struct.pack_into('<f', header, 108, 1000.0)            # high voltage
+    struct.pack_into('<d', header, 176, step_size)
+    struct.pack_into('<f', header, 192, 0.5)               # time per step
+    struct.pack_into('<II', header, 224, 40, 40)           # kV, mA
+    struct.pack_into('<d', header, 240, 1.5406)            # used lambda
+    struct.pack_into('<II', header, 248, 0, 4)             # varying, record length
+    struct.pack_into('<I', header, 256, supplementary)
+    return bytes(header)
+
+
+def raw_file(ranges, status=1, sample_id='cement 42'):
+    '''
+    A RAW1.01 file of (steps, start, step_size, supplementary) ranges, the
+    counts of each range are 0, 1, 2, ...
+    '''
+    header = bytearray(712)
+    header[:7] = b'RAW1.01'
+    struct.pack_into('<II', header, 8, status, len(ranges))
+    header[16:26] = b'10/17/26\0\0'
+    header[26:36] = b'09:41:07\0\0'
+    header[36:42] = b'xrdlab'
+    header[326:326 + len(sample_id)] = sample_id.encode('latin-1')
+    header[608:610] = b'Cu'
+    struct.pack_into('<ddd', header, 616, 1.5418, 1.5406, 1.54439)
+    data = bytes(header)
+    for steps, start, step_size, supplementary in ranges:
+        data += range_header(steps, start, step_size, supplementary)
+        if supplementary:
+            # One record: type, length, reserved, then its data
+            record = struct.pack('<III', 200, supplementary, 0)
+            data += record + bytes(supplementary - len(record))
+        data += struct.pack(f'<{steps}f', *range(steps))
+    return data
+
+
+def write(tmp_path, data, name='p1.raw'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_parse_ranges_after_supplementary_headers(tmp_path):
+    path = write(tmp_path, raw_file([(10, 5.0, 0.02, 0), (6, 20.0, 0.05, 40)]))
+    info = rawfile.read_raw(path)
+    assert info.version == 'RAW1.01'
+    assert info.status == 'done'
+    assert (info.sample_id, info.date, info.time) == ('cement 42', '10/17/26', '09:41:07')
+    assert [(r.steps, r.start, r.step_size) for r in info.ranges] == [
+        (10, 5.0, 0.02), (6, 20.0, 0.05)]
+    assert info.ranges[0].offset == 712 + 304
+    assert info.ranges[1].offset == 712 + 304 + 40 + 304 + 40
+    assert list(rawfile.counts(info, 1)) == [0, 1, 2, 3, 4, 5]
+
+
+def test_parse_truncated(tmp_path):
+    data = raw_file([(10, 5.0, 0.02, 0)])
+    with pytest.raises(rawfile.InvalidRaw, match='truncated in range 0'):
+        rawfile.read_raw(write(tmp_path, data[:-4]))
+    with pytest.raises(rawfile.InvalidRaw, match='truncated in its header'):
+        rawfile.read_raw(write(tmp_path, data[:500]))
+
+
+def test_parse_rejects(tmp_path):
+    with pytest.raises(rawfile.InvalidRaw, match='still being measured'):
+        rawfile.read_raw(write(tmp_path, raw_file([(10, 5.0, 0.02, 0)], status=2)))
+    with pytest.raises(rawfile.InvalidRaw, match='no ranges'):
+        rawfile.read_raw(write(tmp_path, raw_file([])))
+    with pytest.raises(rawfile.InvalidRaw, match='no steps'):
+        rawfile.read_raw(write(tmp_path, raw_file([(10, 5.0, 0.0, 0)])))
+    with pytest.raises(rawfile.InvalidRaw, match='not a Bruker RAW file'):
+        rawfile.read_raw(write(tmp_path, b'5.00 120\n5.02 131\n'))
+    with pytest.raises(rawfile.InvalidRaw, match='empty'):
+        rawfile.read_raw(write(tmp_path, b''))
+
+
+def test_parse_other_versions(tmp_path):
+    info = rawfile.read_raw(write(tmp_path, b'RAW4.00' + bytes(100)))
+    assert info.version == 'RAW4'
+    assert info.ranges == []
+
+
+def test_content_hash(tmp_path):
+    data = raw_file([(10, 5.0, 0.02, 0)])
+    first = rawfile.content_hash(write(tmp_path, data, 'p1.raw'))
+    assert first == rawfile.content_hash(write(tmp_path, data, 'p2.raw'))
+    assert first != rawfile.content_hash(write(tmp_path, data[:-1], 'p3.raw'))
+
+
+@pytest.mark.parametrize('path', sorted(DATA.glob('*.raw')), ids=lambda path: path.name)
+def test_data_files(path):
+    # Every range is read where the one before it ends, the last ends the file
+    info = rawfile.read_raw(path)
+    assert info.version == 'RAW1.01'
+    assert info.ranges
+    end = info.ranges[-1].offset + 4 * info.ranges[-1].steps
+    assert end == info.size
+    for index, rng in enumerate(info.ranges):
+        assert 0 < rng.step_size < 1
+        values = rawfile.counts(info, index)
+        assert (values >= 0).all()
+
+
+def test_two_ranges_file():
+    info = rawfile.read_raw(DATA / 'two_ranges.raw')
+    assert info.sample_id == 'OPC CEM I 42.5 R'
+    assert [(r.steps, r.start, r.step_size) for r in info.ranges] == [
+        (3251, 5.0, 0.02), (501, 70.0, 0.04)]
+    assert rawfile.counts(info, 1)[-1] == 500
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+
+from XRD_batch_helper.runner import Monitor, Runner
+
+
+def feed(monitor, values):
+    reasons = [monitor.feed(f'Cycle {cycle} Rwp {value}\n')
+               for cycle, value in enumerate(values, start=1)]
+    return reasons
+
+
+def test_rising():
+    monitor = Monitor(rising=2, grace=2)
+    reasons = feed(monitor, [9.0, 10.0, 11.0, 8.0, 9.0, 10.0])
+    # The rises during the grace cycles count once it is over
+    assert reasons[:2] == [None, None]
+    assert reasons[2] == 'r_wp rose for 2 cycles to 11.0 at cycle 3'
+    assert reasons[-1] == reasons[2]
+
+
+def test_stall():
+    monitor = Monitor(stall=3, grace=1, min_gain=0.01)
+    reasons = feed(monitor, [10.0, 9.0, 8.95, 8.93, 8.92])
+    assert reasons[:4] == [None] * 4
+    assert reasons[4] == 'r_wp 9.0 not improved in 3 cycles, at cycle 5'
+
+
+def test_ignores_other_lines():
+    monitor = Monitor(rising=1, grace=0)
+    assert monitor.feed('Loading C:\\data\\p1.raw\n') is None
+    assert monitor.feed('Rwp 5.0\n') is None
+    assert monitor.cycle == 1
+    assert monitor.feed('Rwp 6.0\n') == 'r_wp rose for 1 cycles to 6.0 at cycle 2'
+
+
+def test_disabled():
+    monitor = Monitor()
+    assert not monitor.enabled
+    assert feed(monitor, [5.0, 6.0, 7.0, 8.0, 9.0]) == [None] * 5
+
+
+def test_short_run_sampled():
+    # Well inside the first poll_interval
+    stats = Runner(poll_interval=5).run(
+        [sys.executable, '-c', 'import time; time.sleep(0.5); print("Cycle 1 Rwp 5.0")'],
+        inp='test.inp')
+    assert stats.returncode == 0
+    assert stats.killed is None
+    assert stats.stdout == b'Cycle 1 Rwp 5.0\n'
+    assert stats.rss > 0
+    assert stats.wall < 5
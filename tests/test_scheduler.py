@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+import pathlib
+import sys
+import time
+
+from XRD_batch_helper.engine import Engine
+from XRD_batch_helper.scheduler import Scheduler, Task, schedule
+
+ROOT = pathlib.Path(__file__).absolute().parents[1]
+FAKE_TC = ROOT / 'benchmarks' / 'fake_tc.py'
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from fixtures import inp_text  # noqa: E402
+
+
+def task(name, count, chunk_size):
+    task = Task(f'{name}.inp', [f'{name}_{index:03}.raw' for index in range(count)],
+                f'{name}.csv')
+    task.chunks = [range(start, min(start + chunk_size, count))
+                   for start in range(0, count, chunk_size)]
+    return task
+
+
+def test_small_task_not_stuck_behind_large():
+    large = task('large', 500, 10)
+    small = task('small', 5, 5)
+    order = schedule([large, small], lambda task: 1.0)
+    assert len(order) == 51
+    # Both start at once, the longer chunk first
+    assert order[0] == (large, large.chunks[0])
+    assert order[1] == (small, small.chunks[0])
+    assert [chunk for _, chunk in order[2:]] == large.chunks[1:]
+
+
+def test_equal_share_of_expected_seconds():
+    slow = task('slow', 4, 1)
+    fast = task('fast', 8, 1)
+    order = schedule([slow, fast], lambda task: 2.0 if task is slow else 1.0)
+    # A slow pattern takes the time of two fast ones
+    assert [task.inp.stem for task, _ in order] == [
+        'slow', 'fast', 'fast', 'slow', 'fast', 'fast', 'slow', 'fast',
+        'fast', 'slow', 'fast', 'fast']
+
+
+def test_ties_keep_task_and_chunk_order():
+    first = task('first', 4, 2)
+    second = task('second', 4, 2)
+    order = schedule([first, second], lambda task: 1.0)
+    assert [(task.inp.stem, chunk.start) for task, chunk in order] == [
+        ('first', 0), ('second', 0), ('first', 2), ('second', 2)]
+
+
+def test_streaming_task_shares_writer(tmp_path, monkeypatch):
+    monkeypatch.setenv('FAKE_TC_SLEEP', '0.5')
+    inp = tmp_path / 'test.inp'
+    inp.write_text(inp_text(phases=2, sites=1))
+    patterns = []
+    for index in range(4):
+        path = tmp_path / f'p{index}.xy'
+        path.write_text(f'5.00 {index}\n5.02 {index + 1}\n')
+        patterns.append(path)
+    output = tmp_path / 'out.csv'
+    engine = Engine(tc=FAKE_TC, logger=logging.getLogger('test'), workers=1)
+    scheduler = Scheduler(engine)
+    batch = Task(inp, patterns[:3], output)
+    stream = Task(inp, [], output)
+    seen = []
+
+    def batches():
+        yield [patterns[3]]
+        # The watched row is on disk before the watch ends
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and not (
+                output.exists() and 'p3,' in output.read_text()):
+            time.sleep(0.05)
+            yield []
+        seen.append(output.read_text())
+        seen.append(stream.writer is batch.writer and batch.writer.fsync_every)
+
+    try:
+        scheduler.add([batch])
+        scheduler.follow(stream, batches())
+    finally:
+        scheduler.close()
+    text, fsync_every = seen
+    assert 'p3,' in text
+    assert fsync_every == engine.fsync_every
+    assert output.read_text().count('id,') == 1
+    assert batch.success and stream.success
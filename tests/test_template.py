@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import pytest
+
+from XRD_batch_helper.template import InpTemplate, TemplateCache
+
+INP = 'iters 1000\nxdd "placeholder.raw"\n\tr_wp 0\n\tstr\n\t\tphase_name "Alite"\n'
+
+
+def test_render():
+    template = InpTemplate(INP)
+    assert template.xdd_string == 'xdd "placeholder.raw"'
+    assert template.render('p1.raw') == INP.replace('placeholder', 'p1')
+
+
+def test_render_chunk():
+    template = InpTemplate(INP)
+    assert template.chunkable
+    text = template.render_chunk(['p1.raw', 'p2.raw'])
+    head, block = INP.split('xdd "placeholder.raw"')
+    assert text == head + 'xdd "p1.raw"' + block + 'xdd "p2.raw"' + block
+
+
+def test_not_chunkable():
+    # A refined global parameter in the block would be shared by the copies
+    template = InpTemplate(INP + '\tprm sh 0.1\n\tprm !fixed 1\n')
+    assert template.named_parameters == ['sh']
+    assert not template.chunkable
+    with pytest.raises(ValueError):
+        template.render_chunk(['p1.raw'])
+    assert InpTemplate(INP + '\tprm !fixed 1\n').chunkable
+    # Every occurrence of the xdd line is a slot
+    assert not InpTemplate(INP + 'xdd "placeholder.raw"\n').chunkable
+
+
+def test_no_xdd():
+    with pytest.raises(ValueError):
+        InpTemplate('iters 1000\n')
+
+
+def test_cache_reparses_changed_file(tmp_path):
+    inp = tmp_path / 'test.inp'
+    inp.write_text(INP)
+    cache = TemplateCache()
+    first = cache.get(inp)
+    assert cache.get(inp) is first
+    inp.write_text(INP + '\tstr\n')
+    assert cache.get(inp) is not first
+    assert cache.render(inp, 'p1.raw').endswith('\tstr\n')
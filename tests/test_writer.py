@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import csv
+
+from XRD_batch_helper.writer import ResultWriter, is_header
+
+
+def rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_done_from_journal_and_csv(tmp_path):
+    output = tmp_path / 'out.csv'
+    with ResultWriter(output) as writer:
+        writer.write('/data/p1.raw', {'id': 'p1', 'r_wp': 7.1, 'Alite': 65.4})
+    done = ResultWriter(output).done()
+    assert done('/data/p1.raw')
+    assert not done('/data/p2.raw')
+    # Without a journal, by id from the CSV
+    (tmp_path / 'out.csv.journal').unlink()
+    done = ResultWriter(output).done()
+    assert done('/elsewhere/p1.raw')
+    assert not done('/data/p2.raw')
+
+
+def test_failed_rows_held_for_the_header(tmp_path):
+    output = tmp_path / 'out.csv'
+    writer = ResultWriter(output, fsync_every=10)
+    writer.write('p1.raw', {'id': 'p1', 'r_wp': 0, 'error': 'tc failed'})
+    assert writer.held
+    writer.write('p2.raw', {'id': 'p2', 'r_wp': 7.1, 'Alite': 65.4})
+    writer.close()
+    header, first, second = rows(output)
+    assert header == ['id', 'r_wp', 'Alite', 'batch']
+    assert first[:3] == ['p1', '0', '']
+    assert second[:3] == ['p2', '7.1', '65.4']
+    assert first[3] == second[3] == writer.batch
+
+
+def test_only_failed_rows(tmp_path):
+    output = tmp_path / 'out.csv'
+    with ResultWriter(output) as writer:
+        writer.write('p1.raw', {'id': 'p1', 'r_wp': 0, 'error': 'tc failed'})
+    assert rows(output)[0] == ['id', 'r_wp', 'error', 'batch']
+
+
+def test_new_header_for_new_columns(tmp_path):
+    output = tmp_path / 'out.csv'
+    with ResultWriter(output) as writer:
+        writer.write('p1.raw', {'id': 'p1', 'r_wp': 7.1, 'Alite': 65.4})
+    with ResultWriter(output) as writer:
+        assert writer.headers == ['id', 'r_wp', 'Alite', 'batch']
+        writer.write('p2.raw', {'id': 'p2', 'r_wp': 6.2, 'Alite': 60.0})
+        writer.write('p3.raw', {'id': 'p3', 'r_wp': 6.3, 'Lime': 1.5})
+    lines = rows(output)
+    assert [index for index, row in enumerate(lines) if is_header(row)] == [0, 3]
+    assert lines[3] == ['id', 'r_wp', 'Alite', 'batch', 'Lime']
+    assert lines[4][:5] == ['p3', '6.3', '', writer.batch, '1.5']
+    assert ResultWriter(output).headers == lines[3]
+
+
+def test_rejected_first_with_every_row_flushed(tmp_path):
+    # A watched folder flushes every row, its first file may be rejected
+    output = tmp_path / 'out.csv'
+    writer = ResultWriter(output, fsync_every=1)
+    writer.write('p1.raw', {'id': 'p1', 'r_wp': 0, 'error': 0})
+    assert output.read_text() == ''
+    writer.write('p2.raw', {'id': 'p2', 'r_wp': 7.1, 'Alite': 65.4})
+    writer.write('p3.raw', {'id': 'p3', 'r_wp': 0, 'error': 0})
+    writer.close()
+    lines = rows(output)
+    assert [row for row in lines if is_header(row)] == [['id', 'r_wp', 'Alite', 'batch']]
+    assert [row[0] for row in lines[1:]] == ['p1', 'p2', 'p3']
+    assert (tmp_path / 'out.csv.journal').read_text() == 'p1.raw\np2.raw\np3.raw\n'